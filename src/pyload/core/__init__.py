@@ -53,6 +53,9 @@ class Core:
     DEFAULT_STORAGEDIR = os.path.join(USERHOMEDIR, "Downloads", "pyLoad")
     DEBUG_LEVEL_MAP = {"debug": 1, "trace": 2, "stack": 3}
 
+    #: longest time the main loop sleeps without being woken up
+    LOOP_INTERVAL = 1
+
 
     @property
     def version(self):
@@ -77,6 +80,7 @@ class Core:
     # NOTE: should `restore` reset config as well?
     def __init__(self, userdir, cachedir, storagedir, debug=None, restore=False):
         self._running = Event()
+        self._wakeup = Event()
         self._do_restart = False
         self._do_exit = False
         self._ = lambda x: x
@@ -190,6 +194,7 @@ class Core:
 
         self.files = self.file_manager = FileManager(self)
         self.scheduler = Scheduler(self)
+        self.db.schedule_maintenance()
 
         self.pgm = self.plugin_manager = PluginManager(self)
         self.evm = self.event_manager = EventManager(self)
@@ -272,11 +277,8 @@ class Core:
     def _setup_network(self):
         self.log.debug("Setup network...")
 
-        # TODO: Move to accountmanager
-        self.log.info(self._("Activating accounts..."))
-        self.acm.get_account_infos()
-        # self.scheduler.add_job(0, self.acm.get_account_infos)
-
+        #: account plugins are imported by their first use, see
+        #: AccountManager.get_account_plugin
         self.log.info(self._("Activating Plugins..."))
         self.adm.core_ready()
 
@@ -342,13 +344,14 @@ class Core:
             self.thm.pause = False  # NOTE: Recheck...
             while True:
                 self._running.wait()
+                self._wakeup.clear()
                 self.thread_manager.run()
+                self.scheduler.run()
                 if self._do_restart:
                     raise Restart
                 if self._do_exit:
                     raise Exit
-                self.scheduler.run()
-                time.sleep(1)
+                self._wakeup.wait(self.LOOP_INTERVAL)
 
         except Restart:
             self.restart()
@@ -361,6 +364,14 @@ class Core:
             self.terminate()
 
 
+    def wakeup(self):
+        """
+        wake up the main loop, e.g. when a download slot was freed or links were
+        added.
+        """
+        self._wakeup.set()
+
+
     # TODO: Remove
     def is_client_connected(self):
         return (self.last_client_connected + 30) > time.time()
@@ -375,6 +386,8 @@ class Core:
 
     def terminate(self):
         self.stop()
+        self.scheduler.stop()
+        self.request_factory.close()
         self.log.info(self._("Exiting core..."))
         # self.tsm.exit()
         # self.db.exit()  # NOTE: Why here?
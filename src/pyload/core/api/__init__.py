@@ -122,6 +122,35 @@ class Api:
         )
         return f
 
+    def _set_positions(self, packs, queue):
+        """
+        replace the sparse order values of package and link data by their
+        positions, the indices order_package and order_file take.
+        """
+        orders = self.pyload.db.get_package_orders(queue)
+        pids = sorted((pid for pid in orders if orders[pid] >= 0), key=orders.get)
+        positions = {pid: index for index, pid in enumerate(pids)}
+
+        for pack in packs:
+            pack["order"] = positions.get(pack["id"], pack["order"])
+            if "links" in pack:
+                self._set_link_positions(pack["links"].values())
+
+    def _set_link_positions(self, links):
+        for index, link in enumerate(sorted(links, key=lambda x: x["order"])):
+            link["order"] = index
+
+    def _package_folder(self, name):
+        if not self.pyload.config.get("general", "folder_per_package"):
+            return ""
+
+        return (
+            name.replace("http://", "")
+            .replace(":", "")
+            .replace("/", "_")
+            .replace("\\", "_")
+        )
+
     def _convert_config_format(self, c):
         sections = {}
         for section_name, sub in c.items():
@@ -180,6 +209,7 @@ class Api:
             if option in (
                 "limit_speed",
                 "max_speed",
+                "plugin_speeds",
             ):  #: not so nice to update the limit
                 self.pyload.request_factory.update_bucket()
 
@@ -298,6 +328,62 @@ class Api:
         """
         return fs.free_space(self.pyload.config.get("general", "storage_folder"))
 
+    @permission(Perms.STATUS)
+    def get_cache_stats(self):
+        """
+        Size, hit, miss and eviction counters of the file and package cache.
+
+        :return: dict
+        """
+        return self.pyload.files.get_cache_stats()
+
+    @permission(Perms.STATUS)
+    def get_database_stats(self):
+        """
+        Group commit counters and queued jobs of the database thread.
+
+        :return: dict
+        """
+        return self.pyload.db.get_stats()
+
+    @permission(Perms.STATUS)
+    def get_scheduler_stats(self):
+        """
+        Queue depth, running jobs and start lateness in seconds of the scheduler.
+
+        :return: dict
+        """
+        return self.pyload.scheduler.get_stats()
+
+    @permission(Perms.STATUS)
+    def get_write_stats(self):
+        """
+        Write amplification, writes per callback and flush latency of the running
+        downloads.
+
+        :return: dict of file id -> stats
+        """
+        data = {}
+        for pyfile in self.pyload.thread_manager.get_active_files():
+            if not isinstance(pyfile, PyFile):
+                continue
+            try:
+                stats = pyfile.plugin.req.write_stats
+            except Exception:
+                continue
+            if stats:
+                data[pyfile.id] = stats
+        return data
+
+    @permission(Perms.STATUS)
+    def get_plugin_import_times(self):
+        """
+        Seconds spent importing each loaded plugin module, slowest first.
+
+        :return: dict of "type.name" and seconds
+        """
+        return self.pyload.plugin_manager.get_import_times()
+
     @legacy("getServerVersion")
     @permission(Perms.ALL)
     def get_server_version(self):
@@ -311,12 +397,14 @@ class Api:
         Clean way to quit pyLoad.
         """
         self.pyload._do_exit = True
+        self.pyload.wakeup()
 
     def restart(self):
         """
         Restart pyload core.
         """
         self.pyload._do_restart = True
+        self.pyload.wakeup()
 
     @legacy("getLog")
     @permission(Perms.LOGS)
@@ -412,17 +500,7 @@ class Api:
         :param dest: `Destination`
         :return: package id of the new package
         """
-        if self.pyload.config.get("general", "folder_per_package"):
-            folder = name
-        else:
-            folder = ""
-
-        folder = (
-            folder.replace("http://", "")
-            .replace(":", "")
-            .replace("/", "_")
-            .replace("\\", "_")
-        )
+        folder = self._package_folder(name)
 
         pid = self.pyload.files.add_package(name, folder, Destination(dest))
 
@@ -438,6 +516,26 @@ class Api:
 
         return pid
 
+    @permission(Perms.ADD)
+    def ingest_package(self, name, links, dest=Destination.QUEUE.value):
+        """
+        Adds a package like `add_package`, but links may be any iterable of urls
+        which is consumed and inserted in batches, suitable for huge link lists.
+
+        :param name: name of the new package
+        :param links: iterable of urls
+        :param dest: `Destination`
+        :return: package id of the new package
+        """
+        pid = self.pyload.files.add_package(
+            name, self._package_folder(name), Destination(dest)
+        )
+
+        self.pyload.files.ingest_links(links, pid)
+        self.pyload.files.save()
+
+        return pid
+
     @legacy("parseURLs")
     @permission(Perms.ADD)
     def parse_urls(self, html=None, url=None):
@@ -600,6 +698,9 @@ class Api:
         if not data:
             raise PackageDoesNotExists(pid)
 
+        data["order"] = self.pyload.db.get_package_index(data["queue"], data["order"])
+        self._set_link_positions(data["links"].values())
+
         pdata = PackageData(
             data["id"],
             data["name"],
@@ -628,6 +729,8 @@ class Api:
         if not data:
             raise PackageDoesNotExists(pid)
 
+        data["order"] = self.pyload.db.get_package_index(data["queue"], data["order"])
+
         pdata = PackageData(
             data["id"],
             data["name"],
@@ -655,6 +758,9 @@ class Api:
             raise FileDoesNotExists(fid)
 
         fileinfo = list(info.values())[0]
+        fileinfo["order"] = self.pyload.db.get_link_index(
+            fileinfo["package"], fileinfo["order"]
+        )
         fdata = self._convert_py_file(fileinfo)
         return fdata
 
@@ -693,6 +799,9 @@ class Api:
 
         :return: list of `PackageInfo`
         """
+        packs = self.pyload.files.get_info_data(Destination.QUEUE)
+        self._set_positions(packs.values(), Destination.QUEUE.value)
+
         return [
             PackageData(
                 pack["id"],
@@ -707,7 +816,7 @@ class Api:
                 pack["sizetotal"],
                 pack["linkstotal"],
             )
-            for pack in self.pyload.files.get_info_data(Destination.QUEUE).values()
+            for pack in packs.values()
         ]
 
     @legacy("getQueueData")
@@ -720,6 +829,9 @@ class Api:
 
         :return: list of `PackageData`
         """
+        packs = self.pyload.files.get_complete_data(Destination.QUEUE)
+        self._set_positions(packs.values(), Destination.QUEUE.value)
+
         return [
             PackageData(
                 pack["id"],
@@ -734,7 +846,7 @@ class Api:
                 pack["sizetotal"],
                 links=[self._convert_py_file(x) for x in pack["links"].values()],
             )
-            for pack in self.pyload.files.get_complete_data(Destination.QUEUE).values()
+            for pack in packs.values()
         ]
 
     @legacy("getCollector")
@@ -745,6 +857,9 @@ class Api:
 
         :return: list of `PackageInfo`
         """
+        packs = self.pyload.files.get_info_data(Destination.COLLECTOR)
+        self._set_positions(packs.values(), Destination.COLLECTOR.value)
+
         return [
             PackageData(
                 pack["id"],
@@ -759,7 +874,7 @@ class Api:
                 pack["sizetotal"],
                 pack["linkstotal"],
             )
-            for pack in self.pyload.files.get_info_data(Destination.COLLECTOR).values()
+            for pack in packs.values()
         ]
 
     @legacy("getCollectorData")
@@ -770,6 +885,9 @@ class Api:
 
         :return: list of `PackageInfo`
         """
+        packs = self.pyload.files.get_complete_data(Destination.COLLECTOR)
+        self._set_positions(packs.values(), Destination.COLLECTOR.value)
+
         return [
             PackageData(
                 pack["id"],
@@ -784,9 +902,7 @@ class Api:
                 pack["sizetotal"],
                 links=[self._convert_py_file(x) for x in pack["links"].values()],
             )
-            for pack in self.pyload.files.get_complete_data(
-                Destination.COLLECTOR.value
-            ).values()
+            for pack in packs.values()
         ]
 
     @legacy("addFiles")
@@ -1015,10 +1131,10 @@ class Api:
         :return: dict mapping order to package id
         """
         packs = self.pyload.files.get_info_data(Destination(destination))
+        self._set_positions(packs.values(), Destination(destination).value)
         order = {}
 
-        for pid in packs:
-            pack = self.pyload.files.get_package_data(int(pid))
+        for pack in packs.values():
             while pack["order"] in order.keys():  #: just in case
                 pack["order"] += 1
             order[pack["order"]] = pack["id"]
@@ -1034,6 +1150,7 @@ class Api:
         :return: dict mapping order to file id
         """
         raw_data = self.pyload.files.get_package_data(int(pid))
+        self._set_link_positions(raw_data["links"].values())
         order = {}
         for id, pyfile in raw_data["links"].items():
             while pyfile["order"] in order.keys():  #: just in case
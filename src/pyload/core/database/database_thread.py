@@ -5,14 +5,15 @@ import inspect
 import os
 import shutil
 import sqlite3
+import time
 from contextlib import closing
-from queue import Queue
-from threading import Event, Thread
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
 
 from ... import exc_logger
 
 # DATABASE VERSION
-__version__ = 4
+__version__ = 5
 
 
 class style:
@@ -46,6 +47,18 @@ class style:
 
         return x
 
+    @classmethod
+    def read(cls, fn):
+        """
+        like queue, but served by a reader connection when available.
+        """
+
+        @staticmethod
+        def x(*args, **kwargs):
+            return cls.db.read(fn, *args, **kwargs)
+
+        return x
+
 
 class DatabaseJob:
     def __init__(self, f, *args, **kwargs):
@@ -57,6 +70,7 @@ class DatabaseJob:
 
         self.result = None
         self.exception = False
+        self.deferred = False  #: nobody waits for the result, see async_
 
         self.frame = inspect.currentframe()
 
@@ -91,6 +105,27 @@ class DatabaseJob:
         self.done.wait()
 
 
+class ReaderConnection:
+    """
+    read-only connection used concurrently to the writer thread in WAL mode.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.conn = sqlite3.connect(
+            db.db_path, isolation_level=None, check_same_thread=False
+        )
+        self.conn.execute("PRAGMA query_only=ON")
+        self.c = self.conn.cursor()
+
+    def close(self):
+        self.c.close()
+        self.conn.close()
+
+    def __getattr__(self, attr):
+        return getattr(self.db, attr)
+
+
 class DatabaseThread(Thread):
 
     subs = []
@@ -111,6 +146,14 @@ class DatabaseThread(Thread):
         self.version_path = os.path.join(datadir, self.VERSION_FILENAME)
 
         self.jobs = Queue()
+        self.pending = 0  #: jobs queued and not processed yet, see read
+        self.pending_lock = Lock()
+        self.readers = None  #: pool of ReaderConnection, only set in WAL mode
+
+        self.group_commit = False
+        self.batching = False  #: inside _process_batch
+        self.batch_commit = False  #: commit was called inside the batch
+        self.commit_stats = {"commits": 0, "jobs": 0}
 
         self.setuplock = Event()
 
@@ -124,34 +167,146 @@ class DatabaseThread(Thread):
         """
         main loop, which executes commands.
         """
+        timings = []
+        started = time.time()
+
+        def phase(name):
+            nonlocal started
+            now = time.time()
+            timings.append(f"{name} {now - started:.3f}s")
+            started = now
+
         convert = self._check_version()  #: returns None or current version
+        phase("version check")
 
         self.conn = sqlite3.connect(self.db_path, isolation_level=None)
         os.chmod(self.db_path, 0o600)
 
         self.c = self.conn.cursor()  #: compatibility
+        phase("connect")
 
         if convert is not None:
             self._convert_db(convert)
+            phase("convert")
 
         self._create_tables()
+        phase("create tables")
+        self._lower_ids()
+        phase("lower ids")
         self._migrate_user()
+        phase("migrate users")
 
         self.conn.commit()
 
+        if self.pyload.config.get("database", "wal_mode"):
+            self._setup_readers()
+            phase("reader pool")
+
+        self.pyload.log.debug("Database init: " + ", ".join(timings))
+
+        self.group_commit = self.pyload.config.get("database", "group_commit")
+        latency = self.pyload.config.get("database", "group_commit_latency")
+
         self.setuplock.set()
 
+        j = None
         while True:
-            j = self.jobs.get()
+            if j is None:
+                j = self.jobs.get()
             if j == "quit":
+                self._close_readers()
                 self.c.close()
                 self.conn.close()
                 break
-            j.process_job()
+            if self.group_commit and j.deferred:
+                j = self._process_batch(j, latency / 1000)
+            else:
+                j.process_job()
+                self._done()
+                j = None
+
+    def _process_batch(self, job, latency):
+        """
+        runs deferred jobs in a single transaction until the queue runs dry of
+        them or latency seconds passed, returns the job that ended the batch.
+        """
+        deadline = time.time() + latency
+        jobs = 0
+
+        self.c.execute("BEGIN")
+        self.batching = True
+        self.batch_commit = False
+        try:
+            while job is not None and job != "quit" and job.deferred:
+                job.process_job()
+                jobs += 1
+                if self.batch_commit:  #: commit ends the batch
+                    job = None
+                    break
+                try:
+                    job = self.jobs.get(timeout=max(0, deadline - time.time()))
+                except Empty:
+                    job = None
+        finally:
+            self.batching = False
+            if self.conn.in_transaction:
+                self.conn.commit()
+            self.commit_stats["commits"] += 1
+            self.commit_stats["jobs"] += jobs
+            self._done(jobs)
+
+        return job
+
+    def jobs_per_commit(self):
+        """
+        average number of jobs committed together in group commit mode.
+        """
+        commits = self.commit_stats["commits"]
+        return self.commit_stats["jobs"] / commits if commits else 0
+
+    def get_stats(self):
+        return {
+            "group_commit": self.group_commit,
+            "commits": self.commit_stats["commits"],
+            "jobs": self.commit_stats["jobs"],
+            "jobs_per_commit": self.jobs_per_commit(),
+            "pending": self.pending,
+        }
+
+    def _setup_readers(self):
+        """
+        switch to WAL journal mode and open the reader connections.
+        """
+        self.c.execute("PRAGMA journal_mode=WAL")
+        if self.c.fetchone()[0].lower() != "wal":
+            self.pyload.log.warning(
+                self._("Database does not support WAL mode, reads will be queued")
+            )
+            return
+        self.c.execute("PRAGMA synchronous=NORMAL")
+
+        amount = max(1, self.pyload.config.get("database", "read_connections"))
+        readers = Queue()
+        for i in range(amount):
+            readers.put(ReaderConnection(self))
+        self.readers = readers
+
+    def _close_readers(self):
+        readers, self.readers = self.readers, None
+        if readers is None:
+            return
+        while not readers.empty():
+            readers.get().close()
 
     @style.queue
     def shutdown(self):
         self.conn.commit()
+        if self.group_commit:
+            self.pyload.log.debug(
+                "Database group commit: {} jobs in {} commits".format(
+                    self.commit_stats["jobs"], self.commit_stats["commits"]
+                )
+            )
         self.jobs.put("quit")
 
     def _check_version(self):
@@ -197,6 +352,19 @@ class DatabaseThread(Thread):
             'CREATE TABLE IF NOT EXISTS "users" ("id" INTEGER PRIMARY KEY AUTOINCREMENT, "name" TEXT NOT NULL, "email" TEXT DEFAULT "" NOT NULL, "password" TEXT NOT NULL, "role" INTEGER DEFAULT 0 NOT NULL, "permission" INTEGER DEFAULT 0 NOT NULL, "template" TEXT DEFAULT "default" NOT NULL)'
         )
         self.pyload.log.info(self._("Database was converted from v3 to v4."))
+        self._convertV4()
+
+    def _convertV4(self):
+        self.c.execute('DROP VIEW IF EXISTS "pstats"')
+        self._create_pstats()
+        self.c.execute(
+            'INSERT INTO "pstats" (id, linkstotal, linksdone, sizetotal, sizedone) \
+        SELECT p.id, COUNT(l.id), COUNT(s.id), IFNULL(SUM(l.size), 0), IFNULL(SUM(s.size), 0) \
+        FROM packages p LEFT OUTER JOIN links l ON p.id = l.package \
+        LEFT OUTER JOIN links s ON s.id = l.id AND s.status IN (0,4,13) \
+        GROUP BY p.id'
+        )
+        self.pyload.log.info(self._("Database was converted from v4 to v5."))
 
     # --convert scripts end
 
@@ -211,6 +379,9 @@ class DatabaseThread(Thread):
             'CREATE TABLE IF NOT EXISTS "links" ("id" INTEGER PRIMARY KEY AUTOINCREMENT, "url" TEXT NOT NULL, "name" TEXT, "size" INTEGER DEFAULT 0 NOT NULL, "status" INTEGER DEFAULT 3 NOT NULL, "plugin" TEXT DEFAULT "DefaultPlugin" NOT NULL, "error" TEXT DEFAULT "", "linkorder" INTEGER DEFAULT 0 NOT NULL, "package" INTEGER DEFAULT 0 NOT NULL, FOREIGN KEY(package) REFERENCES packages(id))'
         )
         self.c.execute('CREATE INDEX IF NOT EXISTS "p_id_index" ON links(package)')
+        self.c.execute(
+            'CREATE INDEX IF NOT EXISTS "runnable_index" ON links(package, linkorder, plugin) WHERE status IN (2,3,14)'
+        )
         self.c.execute(
             'CREATE TABLE IF NOT EXISTS "storage" ("id" INTEGER PRIMARY KEY AUTOINCREMENT, "identifier" TEXT NOT NULL, "key" TEXT NOT NULL, "value" TEXT DEFAULT "")'
         )
@@ -218,35 +389,108 @@ class DatabaseThread(Thread):
             'CREATE TABLE IF NOT EXISTS "users" ("id" INTEGER PRIMARY KEY AUTOINCREMENT, "name" TEXT NOT NULL, "email" TEXT DEFAULT "" NOT NULL, "password" TEXT NOT NULL, "role" INTEGER DEFAULT 0 NOT NULL, "permission" INTEGER DEFAULT 0 NOT NULL, "template" TEXT DEFAULT "default" NOT NULL)'
         )
 
+        self._create_pstats()
+
+    def _create_pstats(self):
+        """
+        package statistics, kept up to date by triggers on links and packages.
+        """
         self.c.execute(
-            'CREATE VIEW IF NOT EXISTS "pstats" AS \
-        SELECT p.id AS id, SUM(l.size) AS sizetotal, COUNT(l.id) AS linkstotal, linksdone, sizedone\
-        FROM packages p JOIN links l ON p.id = l.package LEFT OUTER JOIN\
-        (SELECT p.id AS id, COUNT(*) AS linksdone, SUM(l.size) AS sizedone \
-        FROM packages p JOIN links l ON p.id = l.package AND l.status in (0,4,13) GROUP BY p.id) s ON s.id = p.id \
-        GROUP BY p.id'
+            'CREATE TABLE IF NOT EXISTS "pstats" ("id" INTEGER PRIMARY KEY, "linkstotal" INTEGER DEFAULT 0 NOT NULL, "linksdone" INTEGER DEFAULT 0 NOT NULL, "sizetotal" INTEGER DEFAULT 0 NOT NULL, "sizedone" INTEGER DEFAULT 0 NOT NULL, FOREIGN KEY(id) REFERENCES packages(id))'
+        )
+        self.c.execute(
+            'CREATE TRIGGER IF NOT EXISTS "pstats_package_insert" AFTER INSERT ON packages BEGIN \
+        INSERT INTO pstats(id) VALUES (new.id); END'
+        )
+        self.c.execute(
+            'CREATE TRIGGER IF NOT EXISTS "pstats_package_delete" AFTER DELETE ON packages BEGIN \
+        DELETE FROM pstats WHERE id = old.id; END'
+        )
+        self.c.execute(
+            'CREATE TRIGGER IF NOT EXISTS "pstats_link_insert" AFTER INSERT ON links BEGIN \
+        UPDATE pstats SET linkstotal = linkstotal + 1, sizetotal = sizetotal + new.size, \
+        linksdone = linksdone + (new.status IN (0,4,13)), \
+        sizedone = sizedone + (CASE WHEN new.status IN (0,4,13) THEN new.size ELSE 0 END) \
+        WHERE id = new.package; END'
+        )
+        self.c.execute(
+            'CREATE TRIGGER IF NOT EXISTS "pstats_link_delete" AFTER DELETE ON links BEGIN \
+        UPDATE pstats SET linkstotal = linkstotal - 1, sizetotal = sizetotal - old.size, \
+        linksdone = linksdone - (old.status IN (0,4,13)), \
+        sizedone = sizedone - (CASE WHEN old.status IN (0,4,13) THEN old.size ELSE 0 END) \
+        WHERE id = old.package; END'
+        )
+        self.c.execute(
+            'CREATE TRIGGER IF NOT EXISTS "pstats_link_update" AFTER UPDATE OF size, status, package ON links \
+        WHEN old.size != new.size OR old.status != new.status OR old.package != new.package BEGIN \
+        UPDATE pstats SET linkstotal = linkstotal - 1, sizetotal = sizetotal - old.size, \
+        linksdone = linksdone - (old.status IN (0,4,13)), \
+        sizedone = sizedone - (CASE WHEN old.status IN (0,4,13) THEN old.size ELSE 0 END) \
+        WHERE id = old.package; \
+        UPDATE pstats SET linkstotal = linkstotal + 1, sizetotal = sizetotal + new.size, \
+        linksdone = linksdone + (new.status IN (0,4,13)), \
+        sizedone = sizedone + (CASE WHEN new.status IN (0,4,13) THEN new.size ELSE 0 END) \
+        WHERE id = new.package; END'
         )
 
-        # try to lower ids
-        self.c.execute("SELECT max(id) FROM LINKS")
-        fid = self.c.fetchone()[0]
-        if fid:
-            fid = int(fid)
-        else:
-            fid = 0
-        self.c.execute("UPDATE SQLITE_SEQUENCE SET seq=? WHERE name=?", (fid, "links"))
+    def schedule_maintenance(self, delay=60):
+        """
+        schedule the periodic maintenance job, see maintenance.
+        """
+        self.pyload.scheduler.add_job(delay, self._maintenance_job, long=True)
+
+    def _maintenance_job(self):
+        try:
+            self.maintenance()
+        finally:
+            interval = self.pyload.config.get("database", "maintenance_interval")
+            self.schedule_maintenance(max(1, interval) * 60 * 60)
+
+    @style.queue
+    def maintenance(self):
+        """
+        vacuum the database once the ratio of free pages passes the configured
+        threshold.
+        """
+        self.c.execute("PRAGMA page_count")
+        pages = self.c.fetchone()[0]
+        self.c.execute("PRAGMA freelist_count")
+        free = self.c.fetchone()[0]
+
+        threshold = self.pyload.config.get("database", "vacuum_threshold")
+        if not pages or free * 100 < pages * threshold:
+            return
 
-        self.c.execute("SELECT max(id) FROM packages")
-        pid = self.c.fetchone()[0]
-        if pid:
-            pid = int(pid)
+        self.c.execute("PRAGMA auto_vacuum")
+        auto_vacuum = self.c.fetchone()[0]
+        incremental = self.pyload.config.get("database", "incremental_vacuum")
+
+        start = time.time()
+        if incremental and auto_vacuum == 2:
+            self.c.execute("PRAGMA incremental_vacuum")
+            self.c.fetchall()
         else:
-            pid = 0
-        self.c.execute(
-            "UPDATE SQLITE_SEQUENCE SET seq=? WHERE name=?", (pid, "packages")
+            #: switching the auto vacuum mode only takes effect with a full vacuum
+            self.c.execute(f"PRAGMA auto_vacuum={2 if incremental else 0}")
+            self.c.execute("VACUUM")
+
+        self.pyload.log.info(
+            self._("Database vacuumed, {} of {} pages freed in {:.2f} seconds").format(
+                free, pages, time.time() - start
+            )
         )
 
-        self.c.execute("VACUUM")
+    def _lower_ids(self):
+        """
+        lower the id sequences to the highest id in use, only safe at startup
+        while no ids are handed out yet.
+        """
+        for table in ("links", "packages"):
+            self.c.execute(f"SELECT max(id) FROM {table}")
+            max_id = self.c.fetchone()[0] or 0
+            self.c.execute(
+                "UPDATE SQLITE_SEQUENCE SET seq=? WHERE name=?", (int(max_id), table)
+            )
 
     def _migrate_user(self):
         if os.path.exists("pyload.db"):
@@ -272,28 +516,61 @@ class DatabaseThread(Thread):
 
     @style.async_
     def commit(self):
-        self.conn.commit()
+        if self.batching:
+            self.batch_commit = True  #: done by _process_batch
+        else:
+            self.conn.commit()
 
     @style.queue
     def sync_save(self):
         self.conn.commit()
 
-    @style.async_
+    #: not deferred, a rollback inside a group commit batch would discard the
+    #: other jobs of the batch
+    @style.queue
     def rollback(self):
         self.conn.rollback()
 
     def async_(self, f, *args, **kwargs):
         args = (self,) + args
         job = DatabaseJob(f, *args, **kwargs)
-        self.jobs.put(job)
+        job.deferred = True
+        self._put(job)
 
     def queue(self, f, *args, **kwargs):
         args = (self,) + args
         job = DatabaseJob(f, *args, **kwargs)
-        self.jobs.put(job)
+        self._put(job)
         job.wait()
         return job.result
 
+    def read(self, f, *args, **kwargs):
+        """
+        run a read-only job on a pooled reader connection in the calling thread,
+        falls back to the writer queue if no reader pool is active or writes are
+        still queued, so callers always see their own writes.
+        """
+        readers = self.readers
+        if readers is None or self.pending:
+            return self.queue(f, *args, **kwargs)
+
+        reader = readers.get()
+        try:
+            return f(reader, *args, **kwargs)
+        except Exception:
+            exc_logger.exception(f"Database Error @ {f.__name__} {args} {kwargs}")
+        finally:
+            readers.put(reader)
+
+    def _put(self, job):
+        with self.pending_lock:
+            self.pending += 1
+        self.jobs.put(job)
+
+    def _done(self, jobs=1):
+        with self.pending_lock:
+            self.pending -= jobs
+
     @classmethod
     def register_sub(cls, klass):
         cls.subs.append(klass)
@@ -6,9 +6,19 @@ from ..datatypes.pypackage import PyPackage
 from ..utils import format
 from .database_thread import DatabaseThread, style
 
+# TODO: improve this hardcoded list
+#: plugins which are processed in collector
+COLLECTOR_PLUGINS = ("DLC", "LinkList", "SerienjunkiesOrg", "CCF", "RSDF")
+
+#: number of runnable job ids fetched at once by get_job
+JOB_PREFETCH = 25
+
+#: distance between the order values of consecutive packages and links
+ORDER_GAP = 1 << 16
+
 
 class FileDatabaseMethods:
-    @style.queue
+    @style.read
     def filecount(self, queue):
         """
         returns number of files in queue.
@@ -45,19 +55,71 @@ class FileDatabaseMethods:
     def _next_package_order(self, queue=0):
         self.c.execute("SELECT MAX(packageorder) FROM packages WHERE queue=?", (queue,))
         max = self.c.fetchone()[0]
-        if max is not None:
-            return max + 1
+        if max is not None and max >= 0:
+            return max + ORDER_GAP
         else:
-            return 0
+            return ORDER_GAP
 
     @style.inner
     def _next_file_order(self, package):
         self.c.execute("SELECT MAX(linkorder) FROM links WHERE package=?", (package,))
         max = self.c.fetchone()[0]
-        if max is not None:
-            return max + 1
+        if max is not None and max >= 0:
+            return max + ORDER_GAP
+        else:
+            return ORDER_GAP
+
+    @style.inner
+    def _order_at(self, table, column, group, value, id, position):
+        """
+        return an order value which puts row id at position within its group, or
+        None if there is no gap left between the neighbours.
+        """
+        if position <= 0:
+            prev = -1
+            self.c.execute(
+                f"SELECT {column} FROM {table} WHERE {group}=? AND id!=? AND {column}>=0 ORDER BY {column} LIMIT 1",
+                (value, id),
+            )
+            row = self.c.fetchone()
+            next = row[0] if row else None
         else:
-            return 0
+            self.c.execute(
+                f"SELECT {column} FROM {table} WHERE {group}=? AND id!=? AND {column}>=0 ORDER BY {column} LIMIT 2 OFFSET ?",
+                (value, id, position - 1),
+            )
+            rows = [r[0] for r in self.c]
+            if not rows:  #: behind the last row
+                self.c.execute(
+                    f"SELECT MAX({column}) FROM {table} WHERE {group}=? AND id!=?",
+                    (value, id),
+                )
+                rows = [self.c.fetchone()[0]]
+                if rows[0] is None or rows[0] < 0:
+                    return ORDER_GAP
+            prev = rows[0]
+            next = rows[1] if len(rows) > 1 else None
+
+        if next is None:
+            return prev + ORDER_GAP
+        if next - prev < 2:
+            return None
+        return (prev + next) // 2
+
+    @style.inner
+    def _renumber(self, table, column, group, value):
+        """
+        spread the order values of a group evenly again.
+        """
+        self.c.execute(
+            f"SELECT id FROM {table} WHERE {group}=? AND {column}>=0 ORDER BY {column}",
+            (value,),
+        )
+        ids = [r[0] for r in self.c]
+        self.c.executemany(
+            f"UPDATE {table} SET {column}=? WHERE id=?",
+            [(i * ORDER_GAP, id) for i, id in enumerate(ids, 1)],
+        )
 
     @style.queue
     def add_link(self, url, name, plugin, package):
@@ -74,12 +136,21 @@ class FileDatabaseMethods:
         links is a list of tupels (url,plugin)
         """
         order = self._next_file_order(package)
-        orders = [order + x for x in range(len(links))]
+        orders = [order + x * ORDER_GAP for x in range(len(links))]
         links = [(x[0], x[0], x[1], package, o) for x, o in zip(links, orders)]
-        self.c.executemany(
-            "INSERT INTO links(url, name, plugin, package, linkorder) VALUES(?,?,?,?,?)",
-            links,
-        )
+
+        #: one transaction for all rows instead of one per row in autocommit mode
+        begin = not self.conn.in_transaction
+        if begin:
+            self.c.execute("BEGIN")
+        try:
+            self.c.executemany(
+                "INSERT INTO links(url, name, plugin, package, linkorder) VALUES(?,?,?,?,?)",
+                links,
+            )
+        finally:
+            if begin and self.conn.in_transaction:
+                self.conn.commit()
 
     @style.queue
     def add_package(self, name, folder, queue):
@@ -94,20 +165,12 @@ class FileDatabaseMethods:
     def delete_package(self, p):
         self.c.execute("DELETE FROM links WHERE package=?", (str(p.id),))
         self.c.execute("DELETE FROM packages WHERE id=?", (str(p.id),))
-        self.c.execute(
-            "UPDATE packages SET packageorder=packageorder-1 WHERE packageorder > ? AND queue=?",
-            (p.order, p.queue),
-        )
 
     @style.queue
     def delete_link(self, f):
         self.c.execute("DELETE FROM links WHERE id=?", (str(f.id),))
-        self.c.execute(
-            "UPDATE links SET linkorder=linkorder-1 WHERE linkorder > ? AND package=?",
-            (f.order, str(f.packageid)),
-        )
 
-    @style.queue
+    @style.read
     def get_all_links(self, q):
         """
         return information about all links in queue q.
@@ -143,7 +206,7 @@ class FileDatabaseMethods:
 
         return data
 
-    @style.queue
+    @style.read
     def get_all_packages(self, q):
         """
         return information about packages in queue q (only useful in get all data)
@@ -160,8 +223,8 @@ class FileDatabaseMethods:
         self.c.execute(
             "SELECT p.id, p.name, p.folder, p.site, p.password, p.queue, p.packageorder, s.sizetotal, s.sizedone, s.linksdone, s.linkstotal \
             FROM packages p JOIN pstats s ON p.id = s.id \
-            WHERE p.queue=? ORDER BY p.packageorder",
-            str(q),
+            WHERE p.queue=? AND s.linkstotal > 0 ORDER BY p.packageorder",
+            (q,),
         )
 
         data = {}
@@ -174,16 +237,16 @@ class FileDatabaseMethods:
                 "password": r[4],
                 "queue": r[5],
                 "order": r[6],
-                "sizetotal": int(r[7]),
-                "sizedone": r[8] if r[8] else 0,  #: these can be None
-                "linksdone": r[9] if r[9] else 0,
+                "sizetotal": r[7],
+                "sizedone": r[8],
+                "linksdone": r[9],
                 "linkstotal": r[10],
                 "links": {},
             }
 
         return data
 
-    @style.queue
+    @style.read
     def get_link_data(self, id):
         """
         get link information as dict.
@@ -212,7 +275,7 @@ class FileDatabaseMethods:
 
         return data
 
-    @style.queue
+    @style.read
     def get_package_data(self, id):
         """
         get data about links for a package.
@@ -271,50 +334,86 @@ class FileDatabaseMethods:
         return ids
 
     @style.queue
-    def reorder_package(self, p, position, no_move=False):
+    def reorder_package(self, p, position):
+        """
+        move package p to position within its queue, -1 moves it to the end.
+
+        returns the new order value and whether the whole queue was renumbered.
+        """
         if position == -1:
-            position = self._next_package_order(p.queue)
-        if not no_move:
-            if p.order > position:
-                self.c.execute(
-                    "UPDATE packages SET packageorder=packageorder+1 WHERE packageorder >= ? AND packageorder < ? AND queue=? AND packageorder >= 0",
-                    (position, p.order, p.queue),
-                )
-            elif p.order < position:
-                self.c.execute(
-                    "UPDATE packages SET packageorder=packageorder-1 WHERE packageorder <= ? AND packageorder > ? AND queue=? AND packageorder >= 0",
-                    (position, p.order, p.queue),
-                )
+            order = self._next_package_order(p.queue)
+            renumbered = False
+        else:
+            args = ("packages", "packageorder", "queue", p.queue, p.id, position)
+            order = self._order_at(*args)
+            renumbered = order is None
+            if renumbered:
+                self._renumber(*args[:4])
+                order = self._order_at(*args)
 
-        self.c.execute(
-            "UPDATE packages SET packageorder=? WHERE id=?", (position, str(p.id))
-        )
+        self.c.execute("UPDATE packages SET packageorder=? WHERE id=?", (order, p.id))
+        return order, renumbered
 
     @style.queue
     def reorder_link(self, f, position):
         """
         reorder link with f as dict for pyfile.
+
+        returns the new order value and whether the whole package was renumbered.
         """
-        if f["order"] > position:
-            self.c.execute(
-                "UPDATE links SET linkorder=linkorder+1 WHERE linkorder >= ? AND linkorder < ? AND package=?",
-                (position, f["order"], f["package"]),
-            )
-        elif f["order"] < position:
-            self.c.execute(
-                "UPDATE links SET linkorder=linkorder-1 WHERE linkorder <= ? AND linkorder > ? AND package=?",
-                (position, f["order"], f["package"]),
-            )
+        args = ("links", "linkorder", "package", f["package"], f["id"], position)
+        order = self._order_at(*args)
+        renumbered = order is None
+        if renumbered:
+            self._renumber(*args[:4])
+            order = self._order_at(*args)
 
-        self.c.execute("UPDATE links SET linkorder=? WHERE id=?", (position, f["id"]))
+        self.c.execute("UPDATE links SET linkorder=? WHERE id=?", (order, f["id"]))
+        return order, renumbered
 
     @style.queue
     def clear_package_order(self, p):
         self.c.execute("UPDATE packages SET packageorder=? WHERE id=?", (-1, str(p.id)))
+
+    @style.read
+    def get_package_orders(self, queue):
+        """
+        return {id: packageorder} of all packages in queue.
+        """
+        self.c.execute("SELECT id, packageorder FROM packages WHERE queue=?", (queue,))
+        return dict(self.c.fetchall())
+
+    @style.read
+    def get_link_orders(self, package):
+        """
+        return {id: linkorder} of all links in package.
+        """
+        self.c.execute("SELECT id, linkorder FROM links WHERE package=?", (package,))
+        return dict(self.c.fetchall())
+
+    @style.read
+    def get_package_index(self, queue, order):
+        """
+        return the position of the package with the given order value within its
+        queue, the index reorder_package takes.
+        """
+        self.c.execute(
+            "SELECT COUNT(*) FROM packages WHERE queue=? AND packageorder>=0 AND packageorder<?",
+            (queue, order),
+        )
+        return self.c.fetchone()[0]
+
+    @style.read
+    def get_link_index(self, package, order):
+        """
+        return the position of the link with the given order value within its
+        package, the index reorder_link takes.
+        """
         self.c.execute(
-            "UPDATE packages SET packageorder=packageorder-1 WHERE packageorder > ? AND queue=? AND id != ?",
-            (p.order, p.queue, str(p.id)),
+            "SELECT COUNT(*) FROM links WHERE package=? AND linkorder>=0 AND linkorder<?",
+            (package, order),
         )
+        return self.c.fetchone()[0]
 
     @style.async_
     def restart_file(self, id):
@@ -359,21 +458,12 @@ class FileDatabaseMethods:
         return pyfile ids, which are suitable for download and dont use a occupied
         plugin.
         """
-        # TODO: improve this hardcoded method
-        # plugins which are processed in collector
-        pre = "('DLC', 'LinkList', 'SerienjunkiesOrg', 'CCF', 'RSDF')"
-
-        cmd = "("
-        for i, item in enumerate(occ):
-            if i:
-                cmd += ", "
-            cmd += f"'{item}'"
-
-        cmd += ")"
-        cmd = f"SELECT l.id FROM links as l INNER JOIN packages as p ON l.package=p.id WHERE ((p.queue=1 AND l.plugin NOT IN {cmd}) OR l.plugin IN {pre}) AND l.status IN (2,3,14) ORDER BY p.packageorder ASC, l.linkorder ASC LIMIT 5"
-
-        self.c.execute(cmd)  #: very bad!
-
+        occ_marks = ",".join("?" * len(occ))
+        pre_marks = ",".join("?" * len(COLLECTOR_PLUGINS))
+        self.c.execute(
+            f"SELECT l.id FROM links as l INNER JOIN packages as p ON l.package=p.id WHERE ((p.queue=1 AND l.plugin NOT IN ({occ_marks})) OR l.plugin IN ({pre_marks})) AND l.status IN (2,3,14) ORDER BY p.packageorder ASC, l.linkorder ASC LIMIT ?",
+            (*occ, *COLLECTOR_PLUGINS, JOB_PREFETCH),
+        )
         return [x[0] for x in self.c]
 
     @style.queue
@@ -381,12 +471,26 @@ class FileDatabaseMethods:
         """
         returns pyfile ids with suited plugins.
         """
-        cmd = f"SELECT l.id FROM links as l INNER JOIN packages as p ON l.package=p.id WHERE l.plugin IN {plugins} AND l.status IN (2,3,14) ORDER BY p.packageorder ASC, l.linkorder ASC LIMIT 5"
-
-        self.c.execute(cmd)  #: very bad!
-
+        marks = ",".join("?" * len(plugins))
+        self.c.execute(
+            f"SELECT l.id FROM links as l INNER JOIN packages as p ON l.package=p.id WHERE l.plugin IN ({marks}) AND l.status IN (2,3,14) ORDER BY p.packageorder ASC, l.linkorder ASC LIMIT ?",
+            (*plugins, JOB_PREFETCH),
+        )
         return [x[0] for x in self.c]
 
+    @style.queue
+    def get_runnable_links(self, pid=None):
+        """
+        return (id, plugin, package, queue, packageorder, linkorder) of all links
+        suitable for download, optionally only for one package.
+        """
+        cmd = "SELECT l.id, l.plugin, l.package, p.queue, p.packageorder, l.linkorder FROM links as l INNER JOIN packages as p ON l.package=p.id WHERE l.status IN (2,3,14)"
+        if pid is None:
+            self.c.execute(cmd)
+        else:
+            self.c.execute(cmd + " AND l.package=?", (pid,))
+        return self.c.fetchall()
+
     @style.queue
     def get_unfinished(self, pid):
         """
@@ -410,7 +514,7 @@ class FileDatabaseMethods:
     def restart_failed(self):
         self.c.execute("UPDATE links SET status=3,error='' WHERE status IN (6, 8, 9)")
 
-    @style.queue
+    @style.read
     def find_duplicates(self, id, folder, filename):
         """
         checks if filename exists with different id and same package.
@@ -22,7 +22,7 @@ class StorageDatabaseMethods:
                 (identifier, key, value),
             )
 
-    @style.queue
+    @style.read
     def get_storage(self, identifier, key=None):
         if key is not None:
             self.c.execute(
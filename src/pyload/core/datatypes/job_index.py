@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+from heapq import heapify, heappop, heappush
+from threading import Lock
+
+from ..utils.old import lock
+
+#: status ids of files which can be handed out to a thread
+RUNNABLE_STATUS = (2, 3, 14)
+
+
+class JobIndex:
+    """
+    In-memory priority index of runnable pyfile ids.
+
+    Ids are kept in one heap per (plugin, queue) pair ordered by package order
+    and link order. Removed ids are only dropped from the entries mapping, their
+    heap items are skipped lazily when they reach the top.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.clear()
+
+    def clear(self):
+        self.heaps = {}  #: (plugin, queue) -> [(packageorder, linkorder, fid)]
+        self.entries = {}  #: fid -> (plugin, queue, packageorder, linkorder, pid)
+        self.packages = {}  #: pid -> {fid}
+        self.stale = 0  #: number of heap items pointing to removed entries
+        self.loaded = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, fid):
+        return fid in self.entries
+
+    @lock
+    def add(self, fid, plugin, pid, queue, packageorder, linkorder):
+        entry = (plugin, queue, packageorder, linkorder, pid)
+        if self.entries.get(fid) == entry:
+            return
+
+        self._discard(fid)
+        self.entries[fid] = entry
+        self.packages.setdefault(pid, set()).add(fid)
+        heappush(self.heaps.setdefault((plugin, queue), []), (packageorder, linkorder, fid))
+
+    @lock
+    def discard(self, fid):
+        self._discard(fid)
+
+    def _discard(self, fid):
+        entry = self.entries.pop(fid, None)
+        if entry is None:
+            return
+
+        members = self.packages.get(entry[4])
+        if members is not None:
+            members.discard(fid)
+            if not members:
+                del self.packages[entry[4]]
+
+        self.stale += 1
+        if self.stale > len(self.entries) + 1024:
+            self._compact()
+
+    @lock
+    def discard_package(self, pid):
+        for fid in list(self.packages.get(pid, ())):
+            self._discard(fid)
+
+    @lock
+    def pop(self, accept):
+        """
+        remove and return the first id whose (plugin, queue) is accepted by the
+        given callable, or None.
+        """
+        best = None
+        for key in list(self.heaps):
+            if not accept(*key):
+                continue
+            item = self._top(key)
+            if item is None:
+                del self.heaps[key]
+            elif best is None or item < best[0]:
+                best = (item, key)
+
+        if best is None:
+            return None
+
+        heappop(self.heaps[best[1]])
+        fid = best[0][2]
+        self._discard(fid)
+        return fid
+
+    def _top(self, key):
+        heap = self.heaps[key]
+        while heap:
+            packageorder, linkorder, fid = heap[0]
+            entry = self.entries.get(fid)
+            if entry is not None and entry[:4] == (*key, packageorder, linkorder):
+                return heap[0]
+            heappop(heap)
+            self.stale = max(0, self.stale - 1)
+
+        return None
+
+    def _compact(self):
+        heaps = {}
+        for fid, (plugin, queue, packageorder, linkorder, pid) in self.entries.items():
+            heaps.setdefault((plugin, queue), []).append((packageorder, linkorder, fid))
+        for heap in heaps.values():
+            heapify(heap)
+        self.heaps = heaps
+        self.stale = 0
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from threading import RLock
+
+from ..utils.old import lock
+
+
+class ObjectCache:
+    """
+    Thread safe, size bounded mapping of ids to PyFile or PyPackage instances.
+
+    The least recently used instances are evicted first, instances for which
+    `pinned` returns True are never evicted. `evicted` is called for every
+    instance removed to make room.
+    """
+
+    def __init__(self, maxsize=0, pinned=None, evicted=None):
+        self.maxsize = maxsize  #: 0 or less means unbounded
+        self.pinned = pinned or (lambda obj: False)
+        self.evicted = evicted or (lambda obj: None)
+
+        self.lock = RLock()
+        self.data = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    @lock
+    def __getitem__(self, key):
+        value = self.data[key]
+        self.data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            old = self.data.get(key)
+            if old is not None:
+                self._removed(key, old)
+            self.data[key] = value
+            self.data.move_to_end(key)
+            self._added(key, value)
+            victims = self._shrink(key)
+
+        for obj in victims:
+            self.evicted(obj)
+
+    @lock
+    def __delitem__(self, key):
+        self._removed(key, self.data.pop(key))
+
+    @lock
+    def get(self, key, default=None):
+        """
+        like dict.get, but counts the lookup as cache hit or miss.
+        """
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self.data.move_to_end(key)
+        return value
+
+    @lock
+    def pop(self, key, default=None):
+        if key not in self.data:
+            return default
+        value = self.data.pop(key)
+        self._removed(key, value)
+        return value
+
+    @lock
+    def keys(self):
+        return list(self.data.keys())
+
+    @lock
+    def values(self):
+        return list(self.data.values())
+
+    @lock
+    def items(self):
+        return list(self.data.items())
+
+    def _shrink(self, keep):
+        excess = len(self.data) - self.maxsize
+        if self.maxsize <= 0 or excess <= 0:
+            return []
+
+        keys = []
+        for key, obj in self.data.items():
+            if len(keys) >= excess:
+                break
+            if key != keep and not self.pinned(obj):
+                keys.append(key)
+
+        self.evictions += len(keys)
+        victims = []
+        for key in keys:
+            obj = self.data.pop(key)
+            self._removed(key, obj)
+            victims.append(obj)
+        return victims
+
+    def _added(self, key, obj):
+        """
+        called with the lock held after obj was stored.
+        """
+
+    def _removed(self, key, obj):
+        """
+        called with the lock held after obj was removed.
+        """
+
+    @lock
+    def stats(self):
+        return {
+            "size": len(self.data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class FileCache(ObjectCache):
+    """
+    ObjectCache for PyFile instances, indexed by package id and by file name.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.packages = {}  #: package id -> {file id}
+        self.names = {}  #: name -> {file id}
+
+    def _added(self, key, obj):
+        self.packages.setdefault(obj.packageid, set()).add(key)
+        self.names.setdefault(obj.name, set()).add(key)
+
+    def _removed(self, key, obj):
+        self._unlink(self.packages, obj.packageid, key)
+        self._unlink(self.names, obj.name, key)
+
+    def _unlink(self, index, value, key):
+        keys = index.get(value)
+        if keys is None:
+            return
+        keys.discard(key)
+        if not keys:
+            del index[value]
+
+    @lock
+    def rename(self, obj, old_name):
+        """
+        update the name index after obj was renamed.
+        """
+        if self.data.get(obj.id) is not obj:
+            return
+        self._unlink(self.names, old_name, obj.id)
+        self.names.setdefault(obj.name, set()).add(obj.id)
+
+    @lock
+    def package_files(self, package_id):
+        """
+        return the cached files of a package.
+        """
+        return [self.data[key] for key in self.packages.get(package_id, ())]
+
+    @lock
+    def named_files(self, name):
+        """
+        return the cached files with the given name.
+        """
+        return [self.data[key] for key in self.names.get(name, ())]
@@ -31,6 +31,12 @@ def set_size(self, value):
     self._size = int(value)
 
 
+def set_name(self, value):
+    old_name, self._name = self._name, value
+    if old_name is not None and old_name != value:
+        self.m.cache.rename(self, old_name)
+
+
 class PyFile:
     """
     Represents a file object at runtime.
@@ -40,10 +46,11 @@ class PyFile:
         self, manager, id, url, name, size, status, error, pluginname, package, order
     ):
         self.m = self.manager = manager
-        self.m.cache[int(id)] = self
 
         self.id = int(id)
         self.url = url
+
+        self._name = None
         self.name = name
 
         self._size = None
@@ -73,9 +80,14 @@ class PyFile:
         self.progress = 0
         self.maxprogress = 100
 
+        self.m.cache[self.id] = self
+
     # will convert all sizes to ints
     size = property(lambda self: self._size, set_size)
 
+    # keeps the name index of the cache up to date
+    name = property(lambda self: self._name, set_name)
+
     def __repr__(self):
         return f"PyFile {self.id}: {self.name}@{self.pluginname}"
 
@@ -22,12 +22,25 @@ class PyPackage:
         self.password = password
         self.queue = queue
         self.order = order
-        self.set_finished = False
 
     @property
     def folder(self):
         return safepath(self._folder)
 
+    @property
+    def set_finished(self):
+        """
+        package_finished was sent, kept by the manager so it survives eviction.
+        """
+        return self.id in self.m.finished_packages
+
+    @set_finished.setter
+    def set_finished(self, value):
+        if value:
+            self.m.finished_packages.add(self.id)
+        else:
+            self.m.finished_packages.discard(self.id)
+
     def to_dict(self):
         """
         Returns a dictionary representation of the data.
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+from urllib.parse import urlsplit
+
+try:
+    import re._constants as sre_constants
+    import re._parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
+#: characters ending the host part of an url
+HOST_DELIMITERS = "/?#:"
+
+#: characters a wildcard may not match for the host part to stay unambiguous
+UNSAFE_CHARS = HOST_DELIMITERS + "@"
+
+#: maximum number of literal expansions tried per pattern
+MAX_EXPANSIONS = 256
+
+_SAFE_CATEGORIES = (
+    sre_constants.CATEGORY_DIGIT,
+    sre_constants.CATEGORY_WORD,
+    sre_constants.CATEGORY_SPACE,
+)
+
+
+class Unindexable(Exception):
+    pass
+
+
+class Wildcard:
+    """
+    placeholder for a part of a pattern matching more than a few literals.
+    """
+
+    def __init__(self, safe):
+        self.safe = safe  #: True if it can never match one of UNSAFE_CHARS
+
+
+END = Wildcard(True)  #: end of pattern anchor
+UNSAFE = Wildcard(False)
+SAFE = Wildcard(True)
+
+
+def host_key(host):
+    """
+    return the index key of a hostname, its last two labels.
+    """
+    return ".".join(host.lower().split(".")[-2:])
+
+
+def _is_safe_set(items):
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            if chr(av) in UNSAFE_CHARS:
+                return False
+        elif op is sre_constants.RANGE:
+            if any(av[0] <= ord(c) <= av[1] for c in UNSAFE_CHARS):
+                return False
+        elif op is sre_constants.CATEGORY:
+            if av not in _SAFE_CATEGORIES:
+                return False
+        else:
+            return False
+    return True
+
+
+def _is_safe(tokens):
+    return all(
+        token.safe if isinstance(token, Wildcard) else token not in UNSAFE_CHARS
+        for token in tokens
+    )
+
+
+def _product(left, right):
+    res = [a + b for a in left for b in right]
+    if len(res) > MAX_EXPANSIONS:
+        raise Unindexable
+    return res
+
+
+def _expand(subpattern):
+    """
+    expand a parsed pattern into the list of token sequences it can match.
+    """
+    res = [()]
+    for op, av in subpattern:
+        if op is sre_constants.LITERAL:
+            alts = [(chr(av),)]
+
+        elif op is sre_constants.IN:
+            if all(o is sre_constants.LITERAL for o, a in av) and len(av) <= 4:
+                alts = [(chr(a),) for o, a in av]
+            else:
+                alts = [(SAFE if _is_safe_set(av) else UNSAFE,)]
+
+        elif op is sre_constants.BRANCH:
+            alts = []
+            for branch in av[1]:
+                alts.extend(_expand(branch))
+
+        elif op is sre_constants.SUBPATTERN:
+            alts = _expand(av[-1])
+
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            lo, hi, item = av
+            if (lo, hi) == (1, 1):
+                alts = _expand(item)
+            elif (lo, hi) == (0, 1):
+                alts = [()] + _expand(item)
+            else:
+                try:
+                    safe = all(_is_safe(tokens) for tokens in _expand(item))
+                except Unindexable:
+                    safe = False
+                alts = [(SAFE if safe else UNSAFE,)]
+
+        elif op is sre_constants.CATEGORY:
+            alts = [(SAFE if av in _SAFE_CATEGORIES else UNSAFE,)]
+
+        elif op is sre_constants.AT:
+            #: word boundaries and start anchors don't consume anything
+            alts = [(END,)] if av is sre_constants.AT_END else [()]
+
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            #: ignoring a lookaround can only widen the matched urls
+            alts = [()]
+
+        elif op in (sre_constants.ANY, sre_constants.NOT_LITERAL):
+            alts = [(UNSAFE,)]
+
+        else:
+            raise Unindexable
+
+        res = _product(res, alts)
+
+    return res
+
+
+def _tokens_key(tokens):
+    """
+    return the host key of a single expansion of a pattern.
+    """
+    for i in range(len(tokens) - 2):
+        if tokens[i : i + 3] == (":", "/", "/"):
+            break
+    else:
+        raise Unindexable
+
+    #: the scheme must be literal for urlsplit to find the same host
+    scheme = tokens[:i]
+    if not scheme or not all(
+        isinstance(t, str) and (t.isalnum() or t in "+-.") for t in scheme
+    ):
+        raise Unindexable
+    if not scheme[0].isalpha():
+        raise Unindexable
+
+    tail = ""
+    wildcard = False
+    for token in tokens[i + 3 :]:
+        if token is END:
+            break
+        if isinstance(token, Wildcard):
+            if not token.safe:
+                raise Unindexable
+            tail = ""
+            wildcard = True
+        elif token in HOST_DELIMITERS:
+            break
+        else:
+            tail += token
+    else:
+        #: the host could go on after the end of the pattern
+        raise Unindexable
+
+    if wildcard and not (tail.startswith(".") and "." in tail[1:]):
+        raise Unindexable
+    if not tail.strip("."):
+        raise Unindexable
+
+    return host_key(tail)
+
+
+def pattern_keys(pattern, flags=0):
+    """
+    return the set of host keys the urls matched by the pattern can have, or None
+    if the pattern can't be bound to a fixed set of hosts.
+    """
+    try:
+        return {_tokens_key(tokens) for tokens in _expand(sre_parse.parse(pattern, flags))}
+    except (Unindexable, RecursionError, sre_constants.error):
+        return None
+
+
+class UrlMatcher:
+    """
+    Host based dispatcher returning the first of a list of compiled patterns
+    matching an url.
+
+    Patterns bound to a fixed set of hosts are indexed by the last two labels of
+    those hosts, the others are kept in a fallback bucket which is tried for every
+    url. Candidates are always tried in the original order, so the result is the
+    same one of a linear scan.
+    """
+
+    def __init__(self, plugins=()):
+        self._keys = {}  #: (pattern, flags) -> host keys or None
+        self.build(plugins)
+
+    def build(self, plugins):
+        """
+        (re)build the index from an ordered list of (name, compiled pattern).
+        """
+        plugins = list(plugins)
+        fallback = []
+        index = {}
+
+        keys = {}
+        for rank, (name, regex) in enumerate(plugins):
+            signature = (regex.pattern, regex.flags)
+            if signature in self._keys:
+                pkeys = self._keys[signature]
+            else:
+                pkeys = pattern_keys(regex.pattern, regex.flags)
+            keys[signature] = pkeys
+
+            entry = (rank, name, regex)
+            if pkeys is None:
+                fallback.append(entry)
+            else:
+                for key in pkeys:
+                    index.setdefault(key, []).append(entry)
+
+        #: fallback entries take part in every bucket, in the original order
+        for key, entries in index.items():
+            index[key] = sorted(entries + fallback)
+
+        self._keys = keys
+        self.fallback = fallback
+        self.index = index
+        self.plugins = plugins
+
+    def is_stale(self, plugins):
+        return self.plugins != plugins
+
+    def candidates(self, url):
+        if not isinstance(url, str):
+            return self.fallback
+
+        try:
+            host = urlsplit(url).hostname
+        except ValueError:
+            host = None
+
+        if host:
+            return self.index.get(host_key(host), self.fallback)
+        return self.fallback
+
+    def match(self, url):
+        """
+        return (name, pattern) of the first pattern matching the url, or None.
+        """
+        for rank, name, regex in self.candidates(url):
+            if regex.match(url):
+                return name, regex
+        return None
@@ -44,13 +44,15 @@ class AccountManager:
 
     def get_account_plugin(self, plugin):
         """
-        get account instance for plugin or None if anonymous.
+        get account instance for plugin or None if anonymous, the account plugin
+        is imported on first use.
         """
         if plugin in self.accounts:
             if plugin not in self.plugins:
-                self.plugins[plugin] = self.pyload.plugin_manager.load_class(
-                    "account", plugin
-                )(self, self.accounts[plugin])
+                plugin_class = self.pyload.plugin_manager.load_class("account", plugin)
+                if plugin_class is None:
+                    return None
+                self.plugins[plugin] = plugin_class(self, self.accounts[plugin])
 
             return self.plugins[plugin]
         else:
@@ -194,8 +196,8 @@ class AccountManager:
 
         for p in self.accounts.keys():
             if self.accounts[p]:
-                p = self.get_account_plugin(p)
-                data[p.__name__] = p.get_all_accounts(force)
+                plugin = self.get_account_plugin(p)
+                data[p] = plugin.get_all_accounts(force) if plugin else []
             else:
                 data[p] = []
         e = AccountUpdateEvent()
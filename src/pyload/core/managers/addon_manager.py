@@ -3,15 +3,30 @@
 
 
 from functools import wraps
-from threading import RLock
+from threading import Lock, RLock
 from types import MethodType
 
 from _thread import start_new_thread
 
+from ...plugins.base.addon import BaseAddon
 from ..threads.addon_thread import AddonThread
 from ..utils.old import lock
 from .plugin_manager import literal_eval
 
+#: hooks called by the AddonManager -> addon method they end up in
+LAZY_HOOKS = {
+    "download_preparing": "download_preparing",
+    "download_finished": "download_finished",
+    "download_failed": "download_failed",
+    "package_finished": "package_finished",
+    "before_reconnecting": "before_reconnect",
+    "after_reconnecting": "after_reconnect",
+    "new_captcha_task": "captcha_task",
+}
+
+#: addon methods which may be overridden by an addon activated on demand
+LAZY_METHODS = set(LAZY_HOOKS.values()) | {"captcha_correct", "captcha_invalid"}
+
 
 def try_catch(func):
     @wraps(func)
@@ -26,6 +41,130 @@ def try_catch(func):
     return wrapper
 
 
+def lazy_hooks(plugin_class):
+    """
+    return the hooks an addon class reacts to, or None if it must be activated
+    at startup because it overrides anything else of the addon api.
+    """
+    if plugin_class.__threaded__:
+        return None
+
+    overridden = set()
+    for klass in plugin_class.__mro__:
+        if klass is BaseAddon:
+            break
+        overridden.update(
+            name
+            for name in vars(klass)
+            if name == "__init__" or not name.startswith("__")
+        )
+
+    overridden &= set(dir(BaseAddon))
+    if not overridden <= LAZY_METHODS:
+        return None
+
+    return sorted(hook for hook, method in LAZY_HOOKS.items() if method in overridden)
+
+
+class LazyAddon:
+    """
+    Stand-in for an enabled addon which only reacts to hooks dispatched by the
+    AddonManager, the plugin is imported on the first call of one of them.
+    """
+
+    __threaded__ = []
+    cb = None
+
+    def __init__(self, manager, name, hooks):
+        self.m = self.manager = manager
+        self.pyload = manager.pyload
+        self.__name__ = name
+        self.hooks = hooks
+        self.plugin = None
+        self.failed = False
+        self.lock = Lock()
+
+    @property
+    def info(self):
+        return self.plugin.info if self.plugin else {}
+
+    def is_activated(self):
+        return self.pyload.config.get_plugin(self.__name__, "enabled")
+
+    @lock
+    def load(self):
+        """
+        import and activate the addon, returns None and deactivates the stand-in
+        if that fails.
+        """
+        if self.plugin is None and not self.failed:
+            try:
+                plugin_class = self.pyload.plugin_manager.load_class(
+                    "addon", self.__name__
+                )
+                if not plugin_class:
+                    raise ImportError(self.__name__)
+                plugin = plugin_class(self.pyload, self.manager)
+                plugin.core_ready()
+
+            except Exception:
+                self.failed = True
+                self.pyload.log.warning(
+                    self.manager._("Failed activating {}").format(self.__name__),
+                    exc_info=self.pyload.debug > 1,
+                    stack_info=self.pyload.debug > 2,
+                )
+                self.manager.remove_addon(self)
+
+            else:
+                self.manager.replace_addon(self, plugin)
+                self.plugin = plugin
+
+        return self.plugin
+
+    def __getattr__(self, name):
+        plugin = self.load()
+        if plugin is None:
+            raise AttributeError(name)
+        return getattr(plugin, name)
+
+    def _call(self, hook, *args):
+        if hook in self.hooks:
+            plugin = self.load()
+            if plugin is not None:
+                return getattr(plugin, hook)(*args)
+
+    def download_preparing(self, pyfile):
+        return self._call("download_preparing", pyfile)
+
+    def download_finished(self, pyfile):
+        return self._call("download_finished", pyfile)
+
+    def download_failed(self, pyfile):
+        return self._call("download_failed", pyfile)
+
+    def package_finished(self, pypack):
+        return self._call("package_finished", pypack)
+
+    def before_reconnecting(self, ip):
+        return self._call("before_reconnecting", ip)
+
+    def after_reconnecting(self, ip):
+        return self._call("after_reconnecting", ip)
+
+    def new_captcha_task(self, task):
+        return self._call("new_captcha_task", task)
+
+    def core_ready(self):
+        pass
+
+    def core_exiting(self):
+        pass
+
+    def unload(self):
+        pass
+
+
 class AddonManager:
     """
     Manages addons, delegates and handles Events.
@@ -101,18 +240,36 @@ class AddonManager:
 
         active = []
         deactive = []
+        lazy = []
+        new_info = False
 
         for pluginname in self.pyload.plugin_manager.addon_plugins:
             try:
                 # addon_class = getattr(plugin, plugin.__name__)
 
                 if self.pyload.config.get_plugin(pluginname, "enabled"):
+                    info = self.pyload.plugin_manager.get_plugin_info(
+                        "addon", pluginname
+                    )
+                    hooks = info.get("lazy_hooks")
+                    if hooks is not None:
+                        plugin = LazyAddon(self, pluginname, hooks)
+                        plugins.append(plugin)
+                        self.plugin_map[pluginname] = plugin
+                        active.append(pluginname)
+                        lazy.append(pluginname)
+                        continue
+
                     plugin_class = self.pyload.plugin_manager.load_class(
                         "addon", pluginname
                     )
                     if not plugin_class:
                         continue
 
+                    if info and "lazy_hooks" not in info:
+                        info["lazy_hooks"] = lazy_hooks(plugin_class)
+                        new_info = True
+
                     plugin = plugin_class(self.pyload, self)
                     plugins.append(plugin)
                     self.plugin_map[plugin_class.__name__] = plugin
@@ -134,9 +291,36 @@ class AddonManager:
         self.pyload.log.info(
             self._("Deactivate plugins: {}").format(", ".join(sorted(deactive)))
         )
+        if lazy:
+            self.pyload.log.debug(
+                "Plugins activated on demand: {}".format(", ".join(sorted(lazy)))
+            )
 
         self.plugins = plugins
 
+        if new_info:
+            self.pyload.plugin_manager.save_index_cache()
+
+    def replace_addon(self, old, new):
+        """
+        put a loaded addon in place of its LazyAddon stand-in.
+        """
+        try:
+            self.plugins[self.plugins.index(old)] = new
+        except ValueError:
+            pass
+        if self.plugin_map.get(old.__name__) is old:
+            self.plugin_map[old.__name__] = new
+
+    def remove_addon(self, old):
+        """
+        drop a LazyAddon stand-in whose addon failed to load.
+        """
+        #: replaced, not changed in place, hooks may be iterating over the list
+        self.plugins = [plugin for plugin in self.plugins if plugin is not old]
+        if self.plugin_map.get(old.__name__) is old:
+            del self.plugin_map[old.__name__]
+
     def manage_addons(self, plugin, name, value):
         if name == "enabled" and value:
             self.activate_addon(plugin)
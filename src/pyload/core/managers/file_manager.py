@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 # AUTHOR: RaNaN, mkaay
 
+import itertools
+import time
 from threading import RLock
 
+from ..database.file_database import COLLECTOR_PLUGINS
 from ..datatypes.enums import Destination
+from ..datatypes.job_index import RUNNABLE_STATUS, JobIndex
+from ..datatypes.object_cache import FileCache, ObjectCache
 from ..utils.old import lock
 from .event_manager import InsertEvent, ReloadAllEvent, RemoveEvent, UpdateEvent
 
@@ -14,6 +19,9 @@ class FileManager:
     links or packages.
     """
 
+    #: number of urls parsed and inserted at once by ingest_links
+    INGEST_BATCH = 1000
+
     def __init__(self, core):
         """
         Constructor.
@@ -40,11 +48,20 @@ class FileManager:
             self._("unknown"),
         ]
 
-        # TODO: purge the cache
-        self.cache = {}  #: holds instances for files
-        self.package_cache = {}  #: same for packages
-
-        self.job_cache = {}
+        cache_size = self.pyload.config.get("database", "cache_size")
+        #: holds instances for files
+        self.cache = FileCache(cache_size, self._is_file_pinned, self._file_evicted)
+        #: same for packages
+        self.package_cache = ObjectCache(cache_size, self._is_package_pinned)
+        #: ids of packages package_finished was sent for, see PyPackage.set_finished
+        self.finished_packages = set()
+
+        self.job_index = JobIndex()  #: runnable pyfile ids, loaded in the background
+        self.job_index_version = 0  #: bumped when a running load became outdated
+        self.job_index_loading = False
+        self.job_changes = set()  #: ids of files changed while the index loads
+        self.job_prefetch = {}  #: ids selected by the database until the index is loaded
+        self.job_handed = set()  #: ids handed out from job_prefetch
 
         self.lock = RLock()  # TODO: should be a Lock w/o R
         # self.lock._Verbose__verbose = True
@@ -58,11 +75,35 @@ class FileManager:
             args[0].unchanged = False
             args[0].filecount = -1
             args[0].queuecount = -1
-            args[0].job_cache = {}
             return func(*args)
 
         return new
 
+    def _is_file_pinned(self, pyfile):
+        """
+        files with an initialized plugin are in use by a thread.
+        """
+        return bool(getattr(pyfile, "plugin", None))
+
+    def _is_package_pinned(self, pypack):
+        """
+        packages in use by a thread.
+        """
+        return any(
+            pyfile.packageid == pypack.id
+            for pyfile in self.pyload.thread_manager.get_active_files()
+        )
+
+    def _file_evicted(self, pyfile):
+        # NOTE: packages need no sync here, they are written on every change
+        self.pyload.db.update_link(pyfile)
+
+    def get_cache_stats(self):
+        """
+        returns hit, miss and eviction counters of the file and package cache.
+        """
+        return {"files": self.cache.stats(), "packages": self.package_cache.stats()}
+
     # ----------------------------------------------------------------------
     def save(self):
         """
@@ -132,10 +173,84 @@ class FileManager:
         data = self.pyload.plugin_manager.parse_urls(urls)
 
         self.pyload.db.add_links(data, package)
+        self._index_package(package)
+        self.pyload.wakeup()
         self.pyload.thread_manager.create_info_thread(data, package)
 
-        # TODO: change from reload_all event to package update event
-        self.pyload.event_manager.add_event(ReloadAllEvent("collector"))
+        self._notify_links_added(package)
+
+    def ingest_links(self, urls, package):
+        """
+        adds links from any iterable of urls in batches, the file manager is only
+        locked while a batch gets inserted.
+
+        returns number of added links.
+        """
+        started = time.time()
+        added = []
+
+        urls = iter(urls)
+        while True:
+            batch = list(itertools.islice(urls, self.INGEST_BATCH))
+            if not batch:
+                break
+
+            if added:  #: more to come, let clients show the links so far
+                self._notify_links_added(package, insert=False)
+
+            self.pyload.addon_manager.dispatch_event("links_added", batch, package)
+            data = self.pyload.plugin_manager.parse_urls(batch)
+
+            with self.lock:
+                self.pyload.db.add_links(data, package)
+                self.unchanged = False
+                self.filecount = -1
+                self.queuecount = -1
+
+            added.extend(data)
+
+        if not added:
+            return 0
+
+        self._notify_links_added(package)
+
+        with self.lock:
+            self._index_package(package)
+        self.pyload.wakeup()
+        self.pyload.thread_manager.create_info_thread(added, package)
+
+        elapsed = max(time.time() - started, 1e-6)
+        msg = self._(
+            "Ingested {count:d} links into package #{package:d} "
+            "in {secs:.2f} seconds ({rate:.0f} links/s)"
+        )
+        self.pyload.log.info(
+            msg.format(
+                count=len(added), package=package, secs=elapsed, rate=len(added) / elapsed
+            )
+        )
+        return len(added)
+
+    def _notify_links_added(self, package, insert=True):
+        """
+        send the package with its new links to the clients as an incremental
+        insert instead of reloading everything, or as an update while links are
+        still being added.
+        """
+        pack = self.get_package(package)
+        if pack is None:
+            self.pyload.event_manager.add_event(ReloadAllEvent("collector"))
+        elif not insert:
+            e = UpdateEvent("pack", package, "collector" if not pack.queue else "queue")
+            self.pyload.event_manager.add_event(e)
+        else:
+            e = InsertEvent(
+                "pack",
+                package,
+                self.pyload.db.get_package_index(pack.queue, pack.order),
+                "collector" if not pack.queue else "queue",
+            )
+            self.pyload.event_manager.add_event(e)
 
     # ----------------------------------------------------------------------
     @lock
@@ -149,7 +264,7 @@ class FileManager:
         e = InsertEvent(
             "pack",
             last_id,
-            p.order,
+            self.pyload.db.get_package_index(p.queue, p.order),
             "collector" if queue is Destination.COLLECTOR else "queue",
         )
         self.pyload.event_manager.add_event(e)
@@ -164,33 +279,22 @@ class FileManager:
         """
         p = self.get_package(id)
         if not p:
-            if id in self.package_cache:
-                del self.package_cache[id]
+            self.package_cache.pop(id, None)
             return
 
-        oldorder = p.order
-        queue = p.queue
-
         e = RemoveEvent("pack", id, "collector" if not p.queue else "queue")
 
-        pyfiles = self.cache.values()
-        for pyfile in pyfiles:
-            if pyfile.packageid == id:
-                pyfile.abort_download()
-                pyfile.release()
+        for pyfile in self.cache.package_files(id):
+            pyfile.abort_download()
+            pyfile.release()
 
         self.pyload.db.delete_package(p)
+        self.job_index.discard_package(id)
+        self.finished_packages.discard(id)
         self.pyload.event_manager.add_event(e)
         self.pyload.addon_manager.dispatch_event("package_deleted", id)
 
-        if id in self.package_cache:
-            del self.package_cache[id]
-
-        packs = self.package_cache.values()
-        for pack in packs:
-            if pack.queue == queue and pack.order > oldorder:
-                pack.order -= 1
-                pack.notify_change()
+        self.package_cache.pop(id, None)
 
     # ----------------------------------------------------------------------
     @lock
@@ -206,15 +310,13 @@ class FileManager:
         pid = f.packageid
         e = RemoveEvent("file", id, "collector" if not f.package().queue else "queue")
 
-        oldorder = f.order
-
         if id in self.pyload.thread_manager.processing_ids():
             self.cache[id].abort_download()
 
-        if id in self.cache:
-            del self.cache[id]
+        self.cache.pop(id, None)
 
         self.pyload.db.delete_link(f)
+        self.job_index.discard(id)
 
         self.pyload.event_manager.add_event(e)
 
@@ -222,27 +324,19 @@ class FileManager:
         if not len(p.get_children()):
             p.delete()
 
-        pyfiles = self.cache.values()
-        for pyfile in pyfiles:
-            if pyfile.packageid == pid and pyfile.order > oldorder:
-                pyfile.order -= 1
-                pyfile.notify_change()
-
     # ----------------------------------------------------------------------
     def release_link(self, id):
         """
         removes pyfile from cache.
         """
-        if id in self.cache:
-            del self.cache[id]
+        self.cache.pop(id, None)
 
     # ----------------------------------------------------------------------
     def release_package(self, id):
         """
         removes package from cache.
         """
-        if id in self.package_cache:
-            del self.package_cache[id]
+        self.package_cache.pop(id, None)
 
     # ----------------------------------------------------------------------
     def update_link(self, pyfile):
@@ -250,6 +344,7 @@ class FileManager:
         updates link.
         """
         self.pyload.db.update_link(pyfile)
+        self._index_file(pyfile)
 
         e = UpdateEvent(
             "file", pyfile.id, "collector" if not pyfile.package().queue else "queue"
@@ -271,10 +366,10 @@ class FileManager:
         """
         return package instance.
         """
-        if id in self.package_cache:
-            return self.package_cache[id]
-        else:
-            return self.pyload.db.get_package(id)
+        pack = self.package_cache.get(id)
+        if pack is None:
+            pack = self.pyload.db.get_package(id)
+        return pack
 
     # ----------------------------------------------------------------------
     def get_package_data(self, id):
@@ -290,13 +385,9 @@ class FileManager:
 
         data = self.pyload.db.get_package_data(id)
 
-        tmplist = []
-
-        cache = self.cache.values()
-        for x in cache:
-            if int(x.to_db_dict()[x.id]["package"]) == int(id):
-                tmplist.append((x.id, x.to_db_dict()[x.id]))
-        data.update(tmplist)
+        data.update(
+            (x.id, x.to_db_dict()[x.id]) for x in self.cache.package_files(int(id))
+        )
 
         pack["links"] = data
 
@@ -307,8 +398,9 @@ class FileManager:
         """
         returns dict with file information.
         """
-        if id in self.cache:
-            return self.cache[id].to_db_dict()
+        pyfile = self.cache.get(id)
+        if pyfile is not None:
+            return pyfile.to_db_dict()
 
         return self.pyload.db.get_link_data(id)
 
@@ -317,74 +409,168 @@ class FileManager:
         """
         returns pyfile instance.
         """
-        if id in self.cache:
-            return self.cache[id]
-        else:
-            return self.pyload.db.get_file(id)
+        pyfile = self.cache.get(id)
+        if pyfile is None:
+            pyfile = self.pyload.db.get_file(id)
+        return pyfile
 
     # ----------------------------------------------------------------------
-    @lock
-    def get_job(self, occ):
+    def _index_file(self, pyfile, status=None):
         """
-        get suitable job.
+        add or remove pyfile from the job index according to its status.
         """
-        # TODO: clean mess
-        # TODO: improve selection of valid jobs
-
-        if occ in self.job_cache:
-            if self.job_cache[occ]:
-                id = self.job_cache[occ].pop()
-                if id == "empty":
-                    pyfile = None
-                    self.job_cache[occ].append("empty")
-                else:
-                    pyfile = self.get_file(id)
-            else:
-                jobs = self.pyload.db.get_job(occ)
-                jobs.reverse()
-                if not jobs:
-                    self.job_cache[occ].append("empty")
-                    pyfile = None
-                else:
-                    self.job_cache[occ].extend(jobs)
-                    pyfile = self.get_file(self.job_cache[occ].pop())
+        if not self.job_index.loaded:
+            if self.job_index_loading:
+                self.job_changes.add(pyfile.id)
+            return
 
-        else:
-            self.job_cache = {}  #: better not caching to much
-            jobs = self.pyload.db.get_job(occ)
-            jobs.reverse()
-            self.job_cache[occ] = jobs
+        if status is None:
+            status = pyfile.status
 
-            if not jobs:
-                self.job_cache[occ].append("empty")
-                pyfile = None
-            else:
-                pyfile = self.get_file(self.job_cache[occ].pop())
+        if status not in RUNNABLE_STATUS:
+            self.job_index.discard(pyfile.id)
+            return
 
-            # TODO: maybe the new job has to be approved...
+        if pyfile.id in self.job_index:
+            entry = self.job_index.entries.get(pyfile.id)
+            if entry and entry[3:] == (pyfile.order, pyfile.packageid):
+                return
+
+        pack = self.get_package(pyfile.packageid)
+        if pack:
+            self.job_index.add(
+                pyfile.id,
+                pyfile.pluginname,
+                pack.id,
+                pack.queue,
+                pack.order,
+                pyfile.order,
+            )
+
+    def _index_package(self, pid):
+        """
+        reload the runnable files of a package into the job index.
+        """
+        if not self.job_index.loaded:
+            if self.job_index_loading:
+                self.job_index_version += 1
+            return
 
-        # pyfile = self.get_file(self.job_cache[occ].pop())
-        return pyfile
+        self.job_index.discard_package(pid)
+        for row in self.pyload.db.get_runnable_links(pid):
+            self.job_index.add(*row)
+
+    def _invalidate_job_index(self):
+        self.job_index.loaded = False
+        self.job_index_version += 1
+
+    def _load_job_index(self):
+        """
+        load the job index from the database, runs on a scheduler thread while
+        get_job answers from the database.
+        """
+        with self.lock:
+            version = self.job_index_version
+
+        try:
+            rows = self.pyload.db.get_runnable_links()
+        except Exception:
+            with self.lock:
+                self.job_index_loading = False
+            raise
+
+        with self.lock:
+            self.job_index_loading = False
+            if version != self.job_index_version:
+                self._schedule_job_index()  #: outdated while loading
+                return
+
+            self.job_index.clear()
+            for row in rows:
+                self.job_index.add(*row)
+            self.job_index.loaded = True
+
+            for id in self.job_changes:
+                pyfile = self.get_file(id)
+                if pyfile:
+                    self._index_file(pyfile)
+            for id in self.job_handed:
+                self.job_index.discard(id)
+
+            self.job_changes.clear()
+            self.job_handed.clear()
+            self.job_prefetch.clear()
+
+        self.pyload.wakeup()
+
+    def _schedule_job_index(self):
+        if not self.job_index_loading:
+            self.job_index_loading = True
+            self.pyload.scheduler.add_job(0, self._load_job_index)
+
+    def _pop_job(self, accept, key, fetch):
+        if not self.job_index.loaded:
+            #: a full load can take a while, meanwhile use the indexed query
+            self._schedule_job_index()
+            return self._pop_prefetched(key, fetch)
+
+        while True:
+            id = self.job_index.pop(accept)
+            if id is None:
+                return None
+
+            pyfile = self.get_file(id)
+            if pyfile and pyfile.status in RUNNABLE_STATUS:
+                return pyfile
+
+    def _pop_prefetched(self, key, fetch):
+        ids = self.job_prefetch.get(key)
+        if not ids:
+            ids = self.job_prefetch[key] = [
+                id for id in fetch() if id not in self.job_handed
+            ]
+
+        while ids:
+            id = ids.pop(0)
+            pyfile = self.get_file(id)
+            if pyfile and pyfile.status in RUNNABLE_STATUS:
+                self.job_handed.add(id)
+                return pyfile
+
+        return None
+
+    @lock
+    def get_job(self, occ):
+        """
+        get suitable job.
+        """
+        return self._pop_job(
+            lambda plugin, queue: (queue == 1 and plugin not in occ)
+            or plugin in COLLECTOR_PLUGINS,
+            occ,
+            lambda: self.pyload.db.get_job(occ),
+        )
 
     @lock
     def get_decrypt_job(self):
         """
         return job for decrypting.
         """
-        if "decrypt" in self.job_cache:
-            return None
+        plugins = set(self.pyload.plugin_manager.crypter_plugins.keys())
+        plugins.update(self.pyload.plugin_manager.container_plugins.keys())
 
-        plugins = list(self.pyload.plugin_manager.crypter_plugins.keys()) + list(
-            self.pyload.plugin_manager.container_plugins.keys()
+        return self._pop_job(
+            lambda plugin, queue: plugin in plugins,
+            "decrypt",
+            lambda: self.pyload.db.get_plugin_job(tuple(plugins)),
         )
-        plugins = str(tuple(plugins))
 
-        jobs = self.pyload.db.get_plugin_job(plugins)
-        if jobs:
-            return self.get_file(jobs[0])
-        else:
-            self.job_cache["decrypt"] = "empty"
-            return None
+    def requeue_job(self, pyfile):
+        """
+        put a job returned by get_job back into the job index.
+        """
+        self.job_handed.discard(pyfile.id)
+        self._index_file(pyfile, RUNNABLE_STATUS[0])
 
     def get_file_count(self):
         """
@@ -439,15 +625,14 @@ class FileManager:
         """
         restart package.
         """
-        pyfiles = self.cache.values()
-        for pyfile in pyfiles:
-            if pyfile.packageid == id:
-                self.restart_file(pyfile.id)
+        for pyfile in self.cache.package_files(id):
+            self.restart_file(pyfile.id)
 
         self.pyload.db.restart_package(id)
+        self._index_package(id)
+        self.pyload.wakeup()
 
-        if id in self.package_cache:
-            self.package_cache[id].set_finished = False
+        self.finished_packages.discard(id)
 
         e = UpdateEvent(
             "pack", id, "collector" if not self.get_package(id).queue else "queue"
@@ -460,18 +645,23 @@ class FileManager:
         """
         restart file.
         """
-        if id in self.cache:
-            self.cache[id].status = 3
-            self.cache[id].name = self.cache[id].url
-            self.cache[id].error = ""
-            self.cache[id].abort_download()
+        pyfile = self.cache.get(id)
+        if pyfile is not None:
+            pyfile.status = 3
+            pyfile.name = pyfile.url
+            pyfile.error = ""
+            pyfile.abort_download()
 
         self.pyload.db.restart_file(id)
 
+        pyfile = self.get_file(id)
+        self._index_file(pyfile, 3)
+        self.pyload.wakeup()
+
         e = UpdateEvent(
             "file",
             id,
-            "collector" if not self.get_file(id).package().queue else "queue",
+            "collector" if not pyfile.package().queue else "queue",
         )
         self.pyload.event_manager.add_event(e)
 
@@ -483,7 +673,6 @@ class FileManager:
         """
         queue = queue.value
         p = self.pyload.db.get_package(id)
-        oldorder = p.order
 
         e = RemoveEvent("pack", id, "collector" if not p.queue else "queue")
         self.pyload.event_manager.add_event(e)
@@ -495,19 +684,16 @@ class FileManager:
         p.queue = queue
         self.pyload.db.update_package(p)
 
-        self.pyload.db.reorder_package(p, -1, True)
-
-        packs = self.package_cache.values()
-        for pack in packs:
-            if pack.queue != queue and pack.order > oldorder:
-                pack.order -= 1
-                pack.notify_change()
+        self.pyload.db.reorder_package(p, -1)
 
         self.pyload.db.commit()
         self.release_package(id)
+        self._index_package(id)
+        self.pyload.wakeup()
         p = self.get_package(id)
 
-        e = InsertEvent("pack", id, p.order, "collector" if not p.queue else "queue")
+        position = self.pyload.db.get_package_index(p.queue, p.order)
+        e = InsertEvent("pack", id, position, "collector" if not p.queue else "queue")
         self.pyload.event_manager.add_event(e)
 
     @lock
@@ -517,24 +703,21 @@ class FileManager:
 
         e = RemoveEvent("pack", id, "collector" if not p.queue else "queue")
         self.pyload.event_manager.add_event(e)
-        self.pyload.db.reorder_package(p, position)
+        p.order, renumbered = self.pyload.db.reorder_package(p, position)
 
-        packs = self.package_cache.values()
-        for pack in packs:
-            if pack.queue != p.queue or pack.order < 0 or pack == p:
-                continue
-            if p.order > position:
-                if pack.order >= position and pack.order < p.order:
-                    pack.order += 1
-                    pack.notify_change()
-            elif p.order < position:
-                if pack.order <= position and pack.order > p.order:
-                    pack.order -= 1
+        if renumbered:
+            orders = self.pyload.db.get_package_orders(p.queue)
+            for pack in self.package_cache.values():
+                if pack.queue == p.queue and pack.id in orders:
+                    pack.order = orders[pack.id]
                     pack.notify_change()
+            self._invalidate_job_index()  #: all package orders changed
+        else:
+            self._index_package(id)
 
-        p.order = position
         self.pyload.db.commit()
 
+        position = self.pyload.db.get_package_index(p.queue, p.order)
         e = InsertEvent("pack", id, position, "collector" if not p.queue else "queue")
         self.pyload.event_manager.add_event(e)
 
@@ -551,30 +734,26 @@ class FileManager:
         )
         self.pyload.event_manager.add_event(e)
 
-        self.pyload.db.reorder_link(f, position)
+        order, renumbered = self.pyload.db.reorder_link(f, position)
 
-        pyfiles = self.cache.values()
-        for pyfile in pyfiles:
-            if pyfile.packageid != f["package"] or pyfile.order < 0:
-                continue
-            if f["order"] > position:
-                if pyfile.order >= position and pyfile.order < f["order"]:
-                    pyfile.order += 1
-                    pyfile.notify_change()
-            elif f["order"] < position:
-                if pyfile.order <= position and pyfile.order > f["order"]:
-                    pyfile.order -= 1
+        if renumbered:
+            orders = self.pyload.db.get_link_orders(f["package"])
+            for pyfile in self.cache.package_files(f["package"]):
+                if pyfile.id in orders:
+                    pyfile.order = orders[pyfile.id]
                     pyfile.notify_change()
-
-        if id in self.cache:
-            self.cache[id].order = position
+        else:
+            pyfile = self.cache.get(id)
+            if pyfile is not None:
+                pyfile.order = order
 
         self.pyload.db.commit()
+        self._index_package(f["package"])
 
         e = InsertEvent(
             "file",
             id,
-            position,
+            self.pyload.db.get_link_index(f["package"], order),
             "collector" if not self.get_package(f["package"]).queue else "queue",
         )
         self.pyload.event_manager.add_event(e)
@@ -585,6 +764,8 @@ class FileManager:
         updates file info (name, size, status, url)
         """
         self.pyload.db.update_link_info(data)
+        self._index_package(pid)
+        self.pyload.wakeup()
         e = UpdateEvent(
             "pack", pid, "collector" if not self.get_package(pid).queue else "queue"
         )
@@ -596,12 +777,11 @@ class FileManager:
         """
         ids = self.pyload.db.get_unfinished(pyfile.packageid)
         if not ids or (pyfile.id in ids and len(ids) == 1):
-            if not pyfile.package().set_finished:
-                self.pyload.log.info(
-                    self._("Package finished: {}").format(pyfile.package().name)
-                )
-                self.pyload.addon_manager.package_finished(pyfile.package())
-                pyfile.package().set_finished = True
+            pack = pyfile.package()
+            if not pack.set_finished:
+                self.pyload.log.info(self._("Package finished: {}").format(pack.name))
+                pack.set_finished = True
+                self.pyload.addon_manager.package_finished(pack)
 
     def re_check_package(self, pid):
         """
@@ -627,6 +807,7 @@ class FileManager:
         old_packs.update(self.get_info_data(1))
 
         self.pyload.db.delete_finished()
+        self._invalidate_job_index()
 
         new_packs = self.pyload.db.get_all_packages(0)
         new_packs.update(self.pyload.db.get_all_packages(1))
@@ -647,3 +828,5 @@ class FileManager:
         restart all failed links.
         """
         self.pyload.db.restart_failed()
+        self._invalidate_job_index()
+        self.pyload.wakeup()
@@ -2,16 +2,57 @@
 # AUTHOR: mkaay, RaNaN
 
 import importlib
+import importlib.abc
+import importlib.util
 import os
+import pickle
 import re
 import sys
+import time
 from ast import literal_eval
+from functools import lru_cache
 from itertools import chain
 
 import semver
 
 from pyload import APPID, PKGDIR
 
+from ..datatypes.url_matcher import UrlMatcher
+
+
+@lru_cache()
+def _parse_version_info(version):
+    return semver.parse_version_info(version)
+
+
+class PluginFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    """
+    Import hook redirecting plugin modules between the pyload and the user plugin
+    packages, according to the newest version found while indexing.
+    """
+
+    def __init__(self, log=None):
+        self.log = log
+        self.redirects = {}  #: module name -> module name to import instead
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname not in self.redirects:
+            return None
+        return importlib.util.spec_from_loader(fullname, self)
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        name = module.__name__
+        newname = self.redirects[name]
+        if self.log is not None:
+            self.log.debug(f"Redirected import {name} -> {newname}")
+
+        #: inject under new and old name, the import system picks up the
+        #: replacement of the placeholder module in sys.modules
+        sys.modules[name] = importlib.import_module(newname)
+
 
 class PluginManager:
     ROOT = "pyload.plugins."
@@ -32,15 +73,36 @@ class PluginManager:
     _CONFIG = re.compile(r"\s*__config__\s*=\s*(\[[^\]]+\])", re.MULTILINE)
     _DESC = re.compile(r'\s*__description__\s*=\s*(?:"|"""|\')([^"\']+)', re.MULTILINE)
 
+    FOLDERS = {
+        "decrypter": "decrypters",
+        "container": "containers",
+        "downloader": "downloaders",
+        "anticaptcha": "anticaptchas",
+        "account": "accounts",
+        "addon": "addons",
+        "base": "base",
+    }
+
+    INDEX_FILENAME = "plugins.idx"
+    INDEX_VERSION = 1
+
     def __init__(self, core):
         self.pyload = core
         self._ = core._
 
         self.plugins = {}
+        self.url_matcher = UrlMatcher()
+
+        self.index_file = os.path.join(core.cachedir, self.INDEX_FILENAME)
+        self.index_cache = {}  #: path -> ((mtime, size), info)
+        self.index_seen = set()
+        self.import_times = {}  #: "type.name" -> seconds spent importing
+
+        self.finder = PluginFinder(core.log)
         self.create_index()
 
         # register for import addon
-        sys.meta_path.append(self)
+        sys.meta_path.insert(0, self.finder)
 
     def create_index(self):
         """
@@ -63,7 +125,12 @@ class PluginManager:
 
         self.pyload.log.debug("Indexing plugins...")
 
-        sys.path.append(os.path.join(self.pyload.userdir, "plugins"))
+        self.load_index_cache()
+        self.index_seen = set()
+
+        #: user plugins are imported as USERROOT package from the user folder
+        if self.pyload.userdir not in sys.path:
+            sys.path.append(self.pyload.userdir)
 
         userplugins_dir = os.path.join(self.pyload.userdir, "plugins")
         os.makedirs(userplugins_dir, exist_ok=True)
@@ -102,6 +169,15 @@ class PluginManager:
         self.plugins["base"] = self.internal_plugins
         merge(default_config, config)
 
+        #: forget removed plugin files
+        self.index_cache = {
+            path: value
+            for path, value in self.index_cache.items()
+            if path in self.index_seen
+        }
+        self.save_index_cache()
+        self.update_redirects()
+
         for name, config in default_config.items():
             desc = config.pop("desc", "")
             config = [[k] + list(v) for k, v in config.items()]
@@ -115,10 +191,11 @@ class PluginManager:
                     stack_info=self.pyload.debug > 2,
                 )
 
-    def parse(self, folder, pattern=False, home={}):
+    def parse(self, folder, pattern=False, home={}, names=None):
         """
         returns dict with information
         home contains parsed plugins from pyload.
+        names limits the parsing to the given plugin names.
 
         {
         name : {path, version, config, (pattern, re), (plugin, class)}
@@ -143,23 +220,25 @@ class PluginManager:
                 os.path.isfile(os.path.join(pfolder, entry)) and entry.endswith(".py")
             ) and not entry.startswith("_"):
 
-                with open(os.path.join(pfolder, entry)) as data:
-                    content = data.read()
-
                 name = entry[:-3]
                 if name[-1] == ".":
                     name = name[:-4]
 
-                m_pyver = self._PYLOAD_VERSION.search(content)
-                if m_pyver is None:
+                if names is not None and name not in names:
+                    continue
+
+                path = os.path.join(pfolder, entry)
+                info = self.read_plugin_info(path)
+
+                if info["pyload_version"] is None:
                     self.pyload.log.debug(
                         f"__pyload_version__ not found in plugin {name}"
                     )
                 else:
-                    pyload_version = m_pyver.group(1)
+                    pyload_version = info["pyload_version"]
 
                     requires_version = f"{pyload_version}.0"
-                    requires_version_info = semver.parse_version_info(requires_version)
+                    requires_version_info = _parse_version_info(requires_version)
 
                     if self.pyload.version_info.major:
                         core_version = self.pyload.version_info.major
@@ -176,12 +255,11 @@ class PluginManager:
                         )
                         continue
 
-                m_ver = self._VERSION.search(content)
-                if m_ver is None:
+                if info["version"] is None:
                     self.pyload.log.debug(f"__version__ not found in plugin {name}")
                     version = 0
                 else:
-                    version = float(m_ver.group(1))
+                    version = float(info["version"])
 
                 # home contains plugins from pyload root
                 if isinstance(home, dict) and name in home:
@@ -197,10 +275,10 @@ class PluginManager:
                 plugins[name]["user"] = True if home else False
                 plugins[name]["name"] = module
                 plugins[name]["folder"] = folder
+                plugins[name]["path"] = path
 
                 if pattern:
-                    m_pat = self._PATTERN.search(content)
-                    pattern = r"^unmachtable$" if m_pat is None else m_pat.group(1)
+                    pattern = info["pattern"] or r"^unmachtable$"
 
                     plugins[name]["pattern"] = pattern
 
@@ -216,19 +294,14 @@ class PluginManager:
                     self.pyload.config.delete_config(name)
                     continue
 
-                m_desc = self._DESC.search(content)
-                desc = "" if m_desc is None else m_desc.group(1)
+                desc = info["desc"]
 
-                config = self._CONFIG.findall(content)
-                if not config:
+                config = info["config"]
+                if config is None:
                     new_config = {"enabled": ["bool", "Activated", False], "desc": desc}
                     configs[name] = new_config
                     continue
 
-                config = literal_eval(
-                    config[0].strip().replace("\n", "").replace("\r", "")
-                )
-
                 if isinstance(config, list) and all(
                     isinstance(c, tuple) for c in config
                 ):
@@ -246,18 +319,96 @@ class PluginManager:
                 configs[name] = config
 
         if not home:
-            temp_plugins, temp_configs = self.parse(folder, pattern, plugins or True)
+            temp_plugins, temp_configs = self.parse(
+                folder, pattern, plugins or True, names
+            )
             plugins.update(temp_plugins)
             configs.update(temp_configs)
 
         return plugins, configs
 
+    def read_plugin_info(self, path):
+        """
+        return the metadata found in a plugin source, cached by mtime and size.
+        """
+        self.index_seen.add(path)
+
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        cached = self.index_cache.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        with open(path) as data:
+            content = data.read()
+
+        m_pyver = self._PYLOAD_VERSION.search(content)
+        m_ver = self._VERSION.search(content)
+        m_pat = self._PATTERN.search(content)
+        m_desc = self._DESC.search(content)
+
+        config = self._CONFIG.findall(content)
+        if config:
+            config = literal_eval(
+                config[0].strip().replace("\n", "").replace("\r", "")
+            )
+        else:
+            config = None
+
+        info = {
+            "pyload_version": None if m_pyver is None else m_pyver.group(1),
+            "version": None if m_ver is None else m_ver.group(1),
+            "pattern": None if m_pat is None else m_pat.group(1),
+            "desc": "" if m_desc is None else m_desc.group(1),
+            "config": config,
+        }
+        self.index_cache[path] = (stamp, info)
+        return info
+
+    def load_index_cache(self):
+        try:
+            with open(self.index_file, mode="rb") as fp:
+                version, cache = pickle.load(fp)
+        except FileNotFoundError:
+            return
+        except Exception as exc:
+            self.pyload.log.debug(f"Plugin index cache not loaded: {exc}")
+            return
+
+        if version == (self.INDEX_VERSION, self.pyload.version):
+            self.index_cache = cache
+
+    def get_plugin_info(self, type, name):
+        """
+        return the cached index info of a plugin, changes are kept until the
+        plugin file changes.
+        """
+        plugin = self.plugins.get(type, {}).get(name)
+        cached = plugin and self.index_cache.get(plugin.get("path"))
+        return cached[1] if cached else {}
+
+    def save_index_cache(self):
+        tmp_file = self.index_file + ".tmp"
+        try:
+            with open(tmp_file, mode="wb") as fp:
+                pickle.dump(
+                    ((self.INDEX_VERSION, self.pyload.version), self.index_cache),
+                    fp,
+                    pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp_file, self.index_file)
+        except Exception as exc:
+            self.pyload.log.warning(
+                self._("Unable to save plugin index cache: {}").format(exc)
+            )
+
     def parse_urls(self, urls):
         """
         parse plugins for given list of urls.
         """
         last = None
         res = []  #: tupels of (url, plugin)
+        matcher = self.get_url_matcher()
 
         for url in urls:
             if type(url) not in (
@@ -266,28 +417,37 @@ class PluginManager:
                 memoryview,
             ):  #: check memoryview (as py2 byffer)
                 continue
-            found = False
 
             # NOTE: E1136: Value 'last' is unsubscriptable (unsubscriptable-object)
-            if last and last[1]["re"].match(url):
+            if last and last[1].match(url):
                 res.append((url, last[0]))
                 continue
 
+            found = matcher.match(url)
+            if found:
+                res.append((url, found[0]))
+                last = found
+            else:
+                res.append((url, "DefaultPlugin"))
+
+        return res
+
+    def get_url_matcher(self):
+        """
+        return the url matcher, rebuilt if a plugin pattern changed since the
+        last call (multi-hoster accounts replace them at runtime).
+        """
+        plugins = [
+            (name, value["re"])
             for name, value in chain(
                 self.crypter_plugins.items(),
                 self.hoster_plugins.items(),
                 self.container_plugins.items(),
-            ):
-                if value["re"].match(url):
-                    res.append((url, name))
-                    last = (name, value)
-                    found = True
-                    break
-
-            if not found:
-                res.append((url, "DefaultPlugin"))
-
-        return res
+            )
+        ]
+        if self.url_matcher.is_stale(plugins):
+            self.url_matcher.build(plugins)
+        return self.url_matcher
 
     def find_plugin(self, name, pluginlist=("decrypter", "downloader", "container")):
         for ptype in pluginlist:
@@ -335,12 +495,18 @@ class PluginManager:
             try:
                 module_name = plugins[name]["name"]
                 module_folder = plugins[name]["folder"]
+                start = time.perf_counter()
                 module = __import__(
                     self.ROOT + f"{module_folder}.{module_name}",
                     globals(),
                     locals(),
                     plugins[name]["name"],
                 )
+                elapsed = time.perf_counter() - start
+                self.import_times[f"{type}.{name}"] = elapsed
+                self.pyload.log.debug(
+                    f"Imported {type} plugin {name} in {elapsed * 1000:.1f} ms"
+                )
                 plugins[name][APPID] = module  #: cache import, maybe unneeded
                 return module
             except Exception as exc:
@@ -361,55 +527,34 @@ class PluginManager:
         if module:
             return getattr(module, name)
 
+    def get_import_times(self):
+        """
+        return the seconds spent importing each loaded plugin, slowest first.
+        """
+        return dict(
+            sorted(self.import_times.items(), key=lambda x: x[1], reverse=True)
+        )
+
     def get_account_plugins(self):
         """
         return list of account plugin names.
         """
         return list(self.account_plugins.keys())
 
-    def find_module(self, fullname, path=None):
-        # redirecting imports if necesarry
-        if fullname.startswith(self.ROOT) or fullname.startswith(
-            self.USERROOT
-        ):  #: os.seperate pyload plugins
-            if fullname.startswith(self.USERROOT):
-                user = 1
-            else:
-                user = 0  #: used as bool and int
-
-            split = fullname.split(".")
-            if len(split) != 4 - user:
-                return
-            type, name = split[2 - user : 4 - user]
-
-            if type in self.plugins and name in self.plugins[type]:
-                # userplugin is a newer version
-                if not user and self.plugins[type][name]["user"]:
-                    return self
-                # imported from userdir, but pyloads is newer
-                if user and not self.plugins[type][name]["user"]:
-                    return self
-
-    def load_module(self, name, replace=True):
-        if name not in sys.modules:  #: could be already in modules
-            if replace:
-                if self.ROOT in name:
-                    newname = name.replace(self.ROOT, self.USERROOT)
+    def update_redirects(self):
+        """
+        rebuild the import redirects, user plugins replace older pyload ones and
+        the other way round.
+        """
+        redirects = {}
+        for plugins in self.plugins.values():
+            for plugin in plugins.values():
+                module = f"{plugin['folder']}.{plugin['name']}"
+                if plugin["user"]:
+                    redirects[self.ROOT + module] = self.USERROOT + module
                 else:
-                    newname = name.replace(self.USERROOT, self.ROOT)
-            else:
-                newname = name
-
-            base, plugin = newname.rsplit(".", 1)
-
-            self.pyload.log.debug(f"Redirected import {name} -> {newname}")
-
-            module = __import__(newname, globals(), locals(), [plugin])
-            # inject under new an old name
-            sys.modules[name] = module
-            sys.modules[newname] = module
-
-        return sys.modules[name]
+                    redirects[self.USERROOT + module] = self.ROOT + module
+        self.finder.redirects = redirects
 
     def reload_plugins(self, type_plugins):
         """
@@ -453,26 +598,21 @@ class PluginManager:
                         self.pyload.log.debug(f"Reloading {plugin}")
                         importlib.reload(self.plugins[type][plugin][APPID])
 
-        # index creation
-        self.crypter_plugins, config = self.parse("decrypters", pattern=True)
-        self.plugins["decrypter"] = self.crypter_plugins
-        default_config = config
-
-        self.container_plugins, config = self.parse("containers", pattern=True)
-        self.plugins["container"] = self.container_plugins
-        merge(default_config, config)
-
-        self.hoster_plugins, config = self.parse("downloaders", pattern=True)
-        self.plugins["downloader"] = self.hoster_plugins
-        merge(default_config, config)
-
-        self.captcha_plugins, config = self.parse("anticaptchas")
-        self.plugins["anticaptcha"] = self.captcha_plugins
-        merge(default_config, config)
+        # index creation, limited to the requested plugins
+        default_config = {}
+        for type, names in as_dict.items():
+            plugins, config = self.parse(
+                self.FOLDERS[type],
+                pattern=type in ("decrypter", "container", "downloader"),
+                names=names,
+            )
+            for name in names:
+                self.plugins[type].pop(name, None)
+            self.plugins[type].update(plugins)
+            merge(default_config, config)
 
-        self.account_plugins, config = self.parse("accounts")
-        self.plugins["account"] = self.account_plugins
-        merge(default_config, config)
+        self.save_index_cache()
+        self.update_redirects()
 
         for name, config in default_config.items():
             desc = config.pop("desc", "")
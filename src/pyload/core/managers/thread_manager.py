@@ -35,7 +35,7 @@ class ThreadManager:
         self.threads = []  #: thread list
         self.local_threads = []  #: addon+decrypter threads
 
-        self.pause = True
+        self._pause = True
 
         self.reconnecting = Event()
         self.reconnecting.clear()
@@ -124,6 +124,16 @@ class ThreadManager:
         """
         return [x.id for x in self.get_active_files()]
 
+    @property
+    def pause(self):
+        return self._pause
+
+    @pause.setter
+    def pause(self, value):
+        self._pause = value
+        if not value:
+            self.pyload.wakeup()
+
     def run(self):
         """
         run all task which have to be done (this is for repetivive call by core)
@@ -340,11 +350,11 @@ class ThreadManager:
                     # self.downloaded += 1
 
                     thread.put(job)
+                    #: more threads may be free, try again right away
+                    self.pyload.wakeup()
                 else:
                     # put job back
-                    if occ not in self.pyload.files.job_cache:
-                        self.pyload.files.job_cache[occ] = []
-                    self.pyload.files.job_cache[occ].append(job.id)
+                    self.pyload.files.requeue_job(job)
 
                     # check for decrypt jobs
                     job = self.pyload.files.get_decrypt_job()
@@ -354,6 +364,7 @@ class ThreadManager:
 
             else:
                 thread = DecrypterThread(self, job)
+                self.pyload.wakeup()
 
     def get_limit(self, thread):
         limit = thread.active.plugin.account.get_account_data(
@@ -18,6 +18,7 @@ class Browser:
         self.cj = None  #: needs to be setted later
         self.http = None
         self._size = 0
+        self.hashes = {}  #: checksums computed by the last download
 
         self.renew_http_request()
         self.dl = None
@@ -48,6 +49,12 @@ class Browser:
             return self.dl.speed
         return 0
 
+    @property
+    def write_stats(self):
+        if self.dl:
+            return self.dl.get_write_stats()
+        return {}
+
     @property
     def size(self):
         if self._size:
@@ -99,6 +106,7 @@ class Browser:
         this can also download ftp.
         """
         self._size = 0
+        self.hashes = {}
         self.dl = HTTPDownload(
             url,
             filename,
@@ -113,6 +121,7 @@ class Browser:
         )
         name = self.dl.download(chunks, resume)
         self._size = self.dl.size
+        self.hashes = self.dl.hashes
 
         self.dl = None
 
@@ -157,6 +166,13 @@ class Browser:
     def clear_headers(self):
         self.http.clear_headers()
 
+    def set_speed_limit(self, rate):
+        """
+        limits the downloads of this request to rate bytes/s, -1 for no limit.
+        """
+        if self.bucket is not None:
+            self.bucket.set_rate(rate)
+
     def close(self):
         """
         cleanup.
@@ -168,3 +184,5 @@ class Browser:
             del self.dl
         if hasattr(self, "cj"):
             del self.cj
+        if self.bucket is not None:
+            self.bucket.close()
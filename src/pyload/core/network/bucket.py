@@ -1,24 +1,66 @@
 # -*- coding: utf-8 -*-
 # AUTHOR: RaNaN
 
+import math
 import time
-from threading import Lock
+from threading import Lock, local
+from weakref import WeakSet
 
 from ..utils.old import lock
 
 
 class Bucket:
+    """
+    Speed limiter, buckets form a tree: global, plugin, account and download.
+
+    Every bucket may have its own rate. The rate of a bucket is split between its
+    children by their demand, a child using less than its share leaves the rest to
+    the others. Only the leaves are used to throttle transfers, so a download never
+    contends for a lock with other downloads. Transfers reserve tokens in quanta,
+    so the lock is only taken once per quantum, not on every callback.
+    """
 
     MIN_RATE = 10 << 10  # 10kb minimum rate
 
-    def __init__(self):
-        self._rate = 0
+    #: seconds between two splits of the rates
+    REFRESH_INTERVAL = 1
+
+    #: seconds of the rate reserved at once by consumed
+    QUANTUM = 0.1
+
+    def __init__(self, rate=0, parent=None):
+        self._rate = int(rate)
         self.token = 0
         self.timestamp = time.time()
         self.lock = Lock()
+        self.refresh_lock = Lock()
+        self.reserved = local()  #: tokens reserved by the calling thread
+
+        self.parent = parent
+        self.children = WeakSet()
+        self.share = None  #: rate assigned by the parent, None until the first split
+        self.speed = None  #: measured speed, set by the transfer using the bucket
+        self.active = False  #: a transfer is using the bucket
+        self.group = False  #: has or had children, no transfer uses it directly
+        self.refreshed = 0
+
+        if parent is not None:
+            parent.attach(self)
 
     def __bool__(self):
-        return self._rate >= self.MIN_RATE
+        return self.limited
+
+    @property
+    def limited(self):
+        """
+        True if this bucket or one of its parents has a rate set.
+        """
+        bucket = self
+        while bucket is not None:
+            if bucket._rate >= self.MIN_RATE:
+                return True
+            bucket = bucket.parent
+        return False
 
     @lock
     def set_rate(self, rate):
@@ -29,22 +71,133 @@ class Bucket:
 
     rate = property(get_rate, set_rate)
 
-    def _calc_token(self):
-        if self.token >= self._rate:
+    def attach(self, child):
+        with self.lock:
+            self.group = True
+            self.children.add(child)
+
+    def close(self):
+        if self.parent is not None:
+            with self.parent.lock:
+                self.parent.children.discard(self)
+
+    def start(self):
+        """
+        a transfer starts, it gets a full share until its speed is known.
+        """
+        self.speed = None
+        self.share = None
+        self.active = True
+        self.get_root().refreshed = 0
+
+    def stop(self):
+        self.speed = None
+        self.active = False
+
+    def get_root(self):
+        bucket = self
+        while bucket.parent is not None:
+            bucket = bucket.parent
+        return bucket
+
+    def get_share(self):
+        """
+        return the rate in bytes/s this bucket may use, math.inf for no limit.
+        """
+        root = self.get_root()
+        if root.refreshed + self.REFRESH_INTERVAL < time.time():
+            root.refresh()
+        return math.inf if self.share is None else self.share
+
+    def refresh(self):
+        """
+        split the rates from the top of the tree down to the leaves.
+        """
+        if not self.refresh_lock.acquire(False):
+            return  #: someone else is already doing it
+        try:
+            self.refreshed = time.time()
+            self._distribute(math.inf)
+        finally:
+            self.refresh_lock.release()
+
+    def _own_rate(self):
+        return self._rate if self._rate >= self.MIN_RATE else math.inf
+
+    def _get_children(self):
+        with self.lock:
+            return list(self.children)
+
+    def _demand(self):
+        """
+        estimate the rate the bucket could use.
+        """
+        if self.group:
+            demand = sum(child._demand() for child in self._get_children())
+
+        elif not self.active:
+            demand = 0
+
+        elif self.speed is None or self.share is None or self.share == math.inf:
+            demand = math.inf
+
+        elif self.speed >= self.share * 0.8:
+            #: uses its share, let it grow
+            demand = self.share * 2
+
+        else:
+            #: limited somewhere else, shrink slowly as transfers are bursty
+            demand = max(self.speed * 1.25, self.share / 2, self.MIN_RATE)
+
+        return min(demand, self._own_rate())
+
+    def _distribute(self, limit):
+        limit = min(limit, self._own_rate())
+        children = self._get_children()
+
+        if children:
+            if limit == math.inf:
+                for child in children:
+                    child._distribute(math.inf)
+            else:
+                demands = sorted(
+                    ((child._demand(), i, child) for i, child in enumerate(children)),
+                    key=lambda x: x[:2],
+                )
+                left = limit
+                for i, (demand, _, child) in enumerate(demands):
+                    rate = min(demand, left / (len(demands) - i))
+                    child._distribute(rate)
+                    left -= rate
+
+        self.share = limit
+
+    def _calc_token(self, rate):
+        if self.token >= rate:
             return
         now = time.time()
-        delta = self._rate * (now - self.timestamp)
-        self.token = min(self._rate, self.token + delta)
+        delta = rate * (now - self.timestamp)
+        self.token = min(rate, self.token + delta)
         self.timestamp = now
 
-    @lock
     def consumed(self, amount):
         """
         Return time the process have to sleep, after consumed specified amount.
         """
-        if self.rate < self.MIN_RATE:
-            return 0  # NOTE: May become unresponsive otherwise
-        self._calc_token()
-        self.token -= amount
-        consumed = -self.token // self._rate if self.token < 0 else 0
-        return consumed
+        rate = self.get_share()
+        if rate == math.inf:
+            return 0
+        rate = max(rate, self.MIN_RATE)  # NOTE: May become unresponsive otherwise
+
+        left = getattr(self.reserved, "token", 0) - amount
+        if left >= 0:
+            self.reserved.token = left
+            return 0
+
+        #: reservation used up, take what is missing and the next quantum
+        quantum = rate * self.QUANTUM
+        self.reserved.token = quantum
+        with self.lock:
+            self._calc_token(rate)
+            self.token -= quantum - left
+            return -self.token / rate if self.token < 0 else 0
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from threading import Lock
+
+
+class ChunkTuner:
+    """
+    Picks the number of connections per host from the speed of past downloads.
+
+    Every finished download moves the count of its host one step, in the same
+    direction as long as the speed does not drop, else back. The count never
+    exceeds the limit asked for.
+    """
+
+    #: downloads smaller than this are too short to measure anything
+    MIN_SIZE = 16 << 20
+
+    #: relative speed loss needed to change direction, hides noise
+    TOLERANCE = 0.05
+
+    def __init__(self):
+        self.lock = Lock()
+        self.hosts = {}  #: host -> {"chunks", "speed", "step"}
+
+    def get_chunks(self, host, limit):
+        with self.lock:
+            stats = self.hosts.get(host)
+            if stats is None:
+                return limit
+            return max(1, min(stats["chunks"], limit))
+
+    def record(self, host, chunks, size, speed):
+        """
+        report a finished download of size bytes, using chunks connections.
+        """
+        if size < self.MIN_SIZE or not speed:
+            return
+
+        with self.lock:
+            stats = self.hosts.get(host)
+            if stats is None:
+                #: start by trying fewer connections, the limit is the upper bound
+                self.hosts[host] = {"chunks": max(chunks - 1, 1), "speed": speed, "step": -1}
+                return
+
+            if speed < stats["speed"] * (1 - self.TOLERANCE):
+                stats["step"] = -stats["step"]
+            stats["speed"] = speed
+            stats["chunks"] = max(chunks + stats["step"], 1)
+
+    def get_stats(self):
+        with self.lock:
+            return {host: dict(stats) for host, stats in self.hosts.items()}
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+import os
+import selectors
+import time
+from collections import deque
+from logging import getLogger
+from threading import Condition, Event, Lock, Thread, get_ident
+
+import pycurl
+from pyload import APPID
+
+
+class CurlEngine:
+    """
+    Runs the transfers of all downloads on a single CurlMulti.
+
+    One reactor thread owns the multi handle and drives it through the socket and
+    timer callbacks of libcurl, so it only wakes up when a socket is ready or a
+    timeout expires. Other threads never touch the multi handle directly, they
+    submit handles through a queue and wait for them on an :class:`EngineMulti`.
+    If the reactor dies, all its transfers are finished with an error.
+    """
+
+    #: max time the reactor sleeps when libcurl has no timer set
+    IDLE_TIMEOUT = 1
+
+    def __init__(self):
+        self.log = getLogger(APPID)
+
+        self.m = pycurl.CurlMulti()
+        self.m.setopt(pycurl.M_SOCKETFUNCTION, self._socket_cb)
+        self.m.setopt(pycurl.M_TIMERFUNCTION, self._timer_cb)
+
+        self.selector = selectors.DefaultSelector()
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+
+        self.lock = Lock()
+        self.pending = deque()  #: calls to run in the reactor thread
+        self.owners = {}  #: curl handle -> EngineMulti
+        self.deadline = None  #: time libcurl wants to be called back
+        self.running = 0
+        self.stopped = False
+        self.closed = False  #: the reactor takes no more calls
+        self.error = "Curl engine stopped"  #: reported to the transfers left at the end
+
+        self.thread = Thread(target=self._run, name="curl-engine", daemon=True)
+        self.thread.start()
+
+    def add(self, c, owner):
+        if not self._submit(self._add, c, owner):
+            owner.finished(c, pycurl.E_FAILED_INIT, self.error)
+
+    def remove(self, c):
+        """
+        detach a handle and wait until the reactor released it, it can be closed
+        safely afterwards.
+        """
+        if self.thread.ident == get_ident():  #: called from a callback
+            self._remove(c, None)
+            return
+        done = Event()
+        if not self._submit(self._remove, c, done):
+            return
+        while not done.wait(self.IDLE_TIMEOUT):
+            if not self.thread.is_alive():  #: the reactor died, nobody holds c
+                return
+
+    def resume(self, c):
+        """
+        continue a transfer paused by its write callback.
+        """
+        self._submit(self._resume, c)
+
+    def setopt(self, c, option, value):
+        """
+        set an option of a handle, curl handles must not change while transferring.
+        """
+        self._submit(c.setopt, option, value)
+
+    def stop(self):
+        self.stopped = True
+        with self.lock:
+            if not self.closed:
+                self._wakeup()
+        self.thread.join(self.IDLE_TIMEOUT * 2)
+
+    def _submit(self, func, *args):
+        """
+        returns False if the reactor is gone and func will never be called.
+        """
+        with self.lock:
+            if self.closed:
+                return False
+            self.pending.append((func, args))
+        self._wakeup()
+        return True
+
+    def _wakeup(self):
+        try:
+            os.write(self.wake_w, b"\0")
+        except BlockingIOError:  #: pipe full, the reactor wakes up anyway
+            pass
+
+    def _add(self, c, owner):
+        self.owners[c] = owner  #: first, so it is finished if adding fails
+        self.m.add_handle(c)
+
+    def _remove(self, c, done):
+        try:
+            if self.owners.pop(c, None) is not None:
+                self.m.remove_handle(c)
+        except pycurl.error as exc:
+            self.log.debug(f"Error removing curl handle: {exc}")
+        finally:
+            if done is not None:
+                done.set()
+
+    def _resume(self, c):
+        if c not in self.owners:
+            return
+        try:
+            c.pause(pycurl.PAUSE_CONT)
+        except pycurl.error:
+            pass  #: the write callback stopped the transfer, it is reported by info_read
+
+    def _socket_cb(self, what, fd, multi, data):
+        if what == pycurl.POLL_REMOVE:
+            try:
+                self.selector.unregister(fd)
+            except (KeyError, ValueError, OSError):
+                pass
+            return
+
+        events = 0
+        if what in (pycurl.POLL_IN, pycurl.POLL_INOUT):
+            events |= selectors.EVENT_READ
+        if what in (pycurl.POLL_OUT, pycurl.POLL_INOUT):
+            events |= selectors.EVENT_WRITE
+
+        try:
+            self.selector.modify(fd, events)
+        except KeyError:
+            self.selector.register(fd, events)
+
+    def _timer_cb(self, timeout_ms):
+        self.deadline = None if timeout_ms < 0 else time.time() + timeout_ms / 1000
+
+    def _socket_action(self, fd, events):
+        while True:
+            ret, self.running = self.m.socket_action(fd, events)
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+
+    def _timeout(self):
+        timeouts = [self.IDLE_TIMEOUT]
+        if self.deadline is not None:
+            timeouts.append(self.deadline - time.time())
+        return max(min(timeouts), 0)
+
+    def _run_pending(self):
+        with self.lock:
+            pending, self.pending = self.pending, deque()
+        for func, args in pending:
+            try:
+                func(*args)
+            except Exception as exc:
+                self.log.error(f"Curl engine error: {exc}")
+
+    def _read_info(self):
+        while True:
+            num_q, ok_list, err_list = self.m.info_read()
+            for c in ok_list:
+                self._finish(c, 0, "")
+            for c, errno, msg in err_list:
+                self._finish(c, errno, msg)
+            if not num_q:
+                break
+
+    def _finish(self, c, errno, msg):
+        owner = self.owners.pop(c, None)
+        try:
+            self.m.remove_handle(c)
+        finally:
+            if owner is not None:
+                owner.finished(c, errno, msg)
+
+    def _step(self):
+        self._run_pending()
+
+        for key, mask in self.selector.select(self._timeout()):
+            if key.fd == self.wake_r:
+                try:
+                    while os.read(self.wake_r, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                continue
+
+            events = 0
+            if mask & selectors.EVENT_READ:
+                events |= pycurl.CSELECT_IN
+            if mask & selectors.EVENT_WRITE:
+                events |= pycurl.CSELECT_OUT
+            self._socket_action(key.fd, events)
+
+        if self.deadline is not None and self.deadline <= time.time():
+            self.deadline = None
+            self._socket_action(pycurl.SOCKET_TIMEOUT, 0)
+
+        self._read_info()
+
+    def _run(self):
+        while not self.stopped:
+            try:
+                self._step()
+            except Exception as exc:
+                self.log.error(f"Curl engine failed: {exc}", exc_info=True)
+                self.error = f"Curl engine failed: {exc}"
+                self.stopped = True
+
+        with self.lock:
+            self.closed = True
+        self._run_pending()  #: release the threads waiting in remove
+        for c, owner in list(self.owners.items()):
+            self._remove(c, None)
+            try:
+                owner.finished(c, pycurl.E_FAILED_INIT, self.error)
+            except Exception as exc:
+                self.log.debug(f"Error finishing curl handle: {exc}")
+        self.m.close()
+        self.selector.close()
+        os.close(self.wake_r)
+        os.close(self.wake_w)
+
+
+class EngineMulti:
+    """
+    CurlMulti look-alike for one download, its handles run on a shared
+    :class:`CurlEngine`.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.cond = Condition()
+        self.handles = set()
+        self.ok_list = []
+        self.err_list = []
+
+    def add_handle(self, c):
+        with self.cond:
+            self.handles.add(c)
+        self.engine.add(c, self)
+
+    def remove_handle(self, c):
+        with self.cond:
+            if c not in self.handles:
+                return
+            self.handles.discard(c)
+        self.engine.remove(c)
+
+    def perform(self):
+        #: the engine thread does the transfers
+        return pycurl.E_MULTI_OK, len(self.handles)
+
+    def info_read(self):
+        with self.cond:
+            ok_list, self.ok_list = self.ok_list, []
+            err_list, self.err_list = self.err_list, []
+        return 0, ok_list, err_list
+
+    def select(self, timeout):
+        with self.cond:
+            if not self.ok_list and not self.err_list:
+                self.cond.wait(timeout)
+
+    def finished(self, c, errno, msg):
+        """
+        called by the engine thread when a transfer is done.
+        """
+        with self.cond:
+            self.handles.discard(c)
+            if errno:
+                self.err_list.append((c, errno, msg))
+            else:
+                self.ok_list.append(c)
+            self.cond.notify_all()
+
+    def close(self):
+        for c in list(self.handles):
+            self.remove_handle(c)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import time
+from collections import deque
+from threading import Condition, Thread
+
+
+class FileWriter:
+    """
+    Writes the data buffered by the chunks of a download on a background thread.
+
+    Submitting blocks while more than MAX_PENDING bytes wait to be written, so
+    memory stays bounded when the disk is slower than the network. Callers which
+    must not block, like the curl engine thread, check pause first and are called
+    back once the queue went down to RESUME_PENDING. An error of the writer is
+    raised on the next submit or drain.
+    """
+
+    #: max bytes queued for writing
+    MAX_PENDING = 16 << 20
+
+    #: bytes queued when paused callers are resumed
+    RESUME_PENDING = 8 << 20
+
+    def __init__(self):
+        self.cond = Condition()
+        self.queue = deque()  #: (write function, data, time queued)
+        self.pending = 0  #: bytes queued or being written
+        self.busy = False  #: the thread is running a job
+        self.resumers = []  #: callbacks of paused callers, see pause
+        self.error = None
+        self.closed = False
+        self.thread = None
+
+        #: stats
+        self.received = 0  #: bytes passed by curl
+        self.callbacks = 0
+        self.written = 0
+        self.writes = 0
+        self.waited = 0.0  #: time submitters spent blocked on a full queue
+        self.pauses = 0  #: times a caller was paused instead of blocked
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def submit(self, func, data, block=True):
+        """
+        queue func(data) to be called by the writer thread.
+        """
+        with self.cond:
+            if block and self.pending >= self.MAX_PENDING and not self.error:
+                start = time.time()
+                while self.pending >= self.MAX_PENDING and not self.error:
+                    self.cond.wait()
+                self.waited += time.time() - start
+
+            if self.error:
+                raise self.error
+
+            self._queue(func, data)
+            self.pending += len(data)
+
+    def pause(self, resume):
+        """
+        returns True if the queue is full, resume() is then called by the writer
+        thread once there is room again.
+        """
+        with self.cond:
+            if self.pending < self.MAX_PENDING or self.error:
+                return False
+            self.resumers.append(resume)
+            self.pauses += 1
+            return True
+
+    def sync(self, func):
+        """
+        queue func() to be called by the writer thread once the data queued before
+        is written.
+        """
+        with self.cond:
+            if self.error:
+                raise self.error
+            self._queue(func, None)
+
+    def drain(self):
+        """
+        wait until everything queued is written.
+        """
+        with self.cond:
+            while (self.queue or self.busy) and not self.error:
+                self.cond.wait()
+            if self.error:
+                raise self.error
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def get_stats(self):
+        with self.cond:
+            return {
+                "received": self.received,
+                "written": self.written,
+                "callbacks": self.callbacks,
+                "writes": self.writes,
+                "write_amplification": self.written / max(self.received, 1),
+                "callbacks_per_write": self.callbacks / max(self.writes, 1),
+                "pending": self.pending,
+                "waited": self.waited,
+                "pauses": self.pauses,
+                "avg_flush_latency": self.total_latency / max(self.writes, 1),
+                "max_flush_latency": self.max_latency,
+            }
+
+    def _queue(self, func, data):
+        self.queue.append((func, data, time.time()))
+        if self.thread is None:
+            self.thread = Thread(target=self._run, name="file-writer", daemon=True)
+            self.thread.start()
+        self.cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                func, data, queued = self.queue.popleft()
+                self.busy = True
+
+            try:
+                if data is None:
+                    func()
+                else:
+                    func(data)
+            except Exception as exc:
+                with self.cond:
+                    self.error = exc
+                    self.queue.clear()
+                    self.pending = 0
+                    self.busy = False
+                    self.cond.notify_all()
+                self._resume()  #: they get the error on their next submit
+                return
+
+            latency = time.time() - queued
+            with self.cond:
+                self.busy = False
+                if data is None:
+                    self.cond.notify_all()
+                    continue
+                self.pending -= len(data)
+                self.written += len(data)
+                self.writes += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+                self.cond.notify_all()
+                if self.pending > self.RESUME_PENDING:
+                    continue
+
+            self._resume()
+
+    def _resume(self):
+        with self.cond:
+            resumers, self.resumers = self.resumers, []
+        for resume in resumers:
+            resume()
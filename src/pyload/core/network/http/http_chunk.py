@@ -3,7 +3,8 @@
 
 import os
 import re
-import time
+import struct
+from functools import partial
 
 import pycurl
 
@@ -15,11 +16,30 @@ class WrongFormat(Exception):
 
 
 class ChunkInfo:
+    """
+    Resume journal of a download, saved as ``<name>.chunks``.
+
+    The journal is binary with a fixed layout: a header, the file name, then one
+    record per chunk holding its range and the bytes of it known to be on disk.
+    It is replaced atomically, so a crash leaves either the old or the new one.
+    """
+
+    MAGIC = b"pyLJ"
+    VERSION = 1
+    FLAG_SINGLE = 1
+
+    #: magic, version, flags, length of the name, file size, number of chunks
+    HEADER = struct.Struct("<4sBBHQI")
+    #: first byte, last byte, bytes committed
+    RECORD = struct.Struct("<QQQ")
+
     def __init__(self, name):
         self.name = os.fsdecode(name)
         self.size = 0
         self.resume = False
+        self.single = False  #: all chunks are written in place into one file
         self.chunks = []
+        self.progress = []  #: bytes committed per chunk, None if unknown
 
     def __repr__(self):
         ret = f"ChunkInfo: {self.name}, {self.size}\n"
@@ -31,11 +51,18 @@ class ChunkInfo:
     def set_size(self, size):
         self.size = int(size)
 
-    def add_chunk(self, name, range):
+    def add_chunk(self, name, range, arrived=0):
         self.chunks.append((name, range))
+        self.progress.append(arrived)
 
     def clear(self):
         self.chunks = []
+        self.progress = []
+
+    def make_chunk_name(self, index):
+        if self.single:
+            return f"{self.name}.part"
+        return f"{self.name}.chunk{index}"
 
     def create_chunks(self, chunks):
         self.clear()
@@ -44,55 +71,117 @@ class ChunkInfo:
         current = 0
         for i in range(chunks):
             end = self.size - 1 if (i == chunks - 1) else current + chunk_size
-            self.add_chunk(f"{self.name}.chunk{i}", (current, end))
+            self.add_chunk(self.make_chunk_name(i), (current, end))
             current += chunk_size + 1
 
     def save(self):
         fs_name = f"{self.name}.chunks"
-        with open(fs_name, mode="w", encoding="utf-8") as fh:
-            fh.write(f"name:{self.name}\n")
-            fh.write(f"size:{self.size}\n")
-            for i, c in enumerate(self.chunks):
-                fh.write(f"#{i}:\n")
-                fh.write(f"\tname:{c[0]}\n")
-                fh.write(f"\trange:{c[1][0]}-{c[1][1]}\n")
+        name = os.fsencode(self.name)
+        data = bytearray(
+            self.HEADER.pack(
+                self.MAGIC,
+                self.VERSION,
+                self.FLAG_SINGLE if self.single else 0,
+                len(name),
+                self.size,
+                len(self.chunks),
+            )
+        )
+        data += name
+        for (_, range), arrived in zip(self.chunks, self.progress):
+            data += self.RECORD.pack(range[0], range[1], arrived or 0)
+
+        with open(f"{fs_name}.tmp", mode="wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(f"{fs_name}.tmp", fs_name)
 
     @staticmethod
     def load(name):
         fs_name = f"{name}.chunks"
         if not os.path.exists(fs_name):
             raise IOError
-        with open(fs_name, encoding="utf-8") as fh:
-            name = fh.readline()[:-1]
-            size = fh.readline()[:-1]
-            if name.startswith("name:") and size.startswith("size:"):
-                name = name[5:]
-                size = size[5:]
-            else:
-                fh.close()
+        with open(fs_name, mode="rb") as fh:
+            data = fh.read()
+
+        if not data.startswith(ChunkInfo.MAGIC):
+            return ChunkInfo.load_text(data.decode("utf-8"))
+
+        try:
+            magic, version, flags, length, size, count = ChunkInfo.HEADER.unpack_from(
+                data
+            )
+            offset = ChunkInfo.HEADER.size
+            name = os.fsdecode(data[offset : offset + length])
+            offset += length
+            records = [
+                ChunkInfo.RECORD.unpack_from(data, offset + i * ChunkInfo.RECORD.size)
+                for i in range(count)
+            ]
+        except struct.error:
+            raise WrongFormat
+
+        if version != ChunkInfo.VERSION:
+            raise WrongFormat
+
+        ci = ChunkInfo(name)
+        ci.loaded = True
+        ci.set_size(size)
+        ci.single = bool(flags & ChunkInfo.FLAG_SINGLE)
+        for i, (start, end, arrived) in enumerate(records):
+            ci.add_chunk(ci.make_chunk_name(i), (start, end), arrived)
+
+        return ci
+
+    @staticmethod
+    def load_text(data):
+        """
+        load the text format used by older versions.
+        """
+        lines = data.splitlines()
+        if (
+            len(lines) < 2
+            or not lines[0].startswith("name:")
+            or not lines[1].startswith("size:")
+        ):
+            raise WrongFormat
+
+        ci = ChunkInfo(lines[0][5:])
+        ci.loaded = True
+        ci.set_size(lines[1][5:])
+
+        chunks = []
+        for line in lines[2:]:
+            if line.startswith("#"):
+                chunks.append({})
+                continue
+
+            key, delimiter, value = line.strip().partition(":")
+            if not delimiter:
                 raise WrongFormat
-            ci = ChunkInfo(name)
-            ci.loaded = True
-            ci.set_size(size)
-            while True:
-                if not fh.readline():  #: skip line
-                    break
-                name = fh.readline()[1:-1]
-                range = fh.readline()[1:-1]
-                if name.startswith("name:") and range.startswith("range:"):
-                    name = name[5:]
-                    range = range[6:].split("-")
-                else:
-                    raise WrongFormat
+            if chunks:
+                chunks[-1][key] = value
+            elif key == "mode":
+                ci.single = value == "single"
 
-                ci.add_chunk(name, (int(range[0]), int(range[1])))
+        for chunk in chunks:
+            if "name" not in chunk or "range" not in chunk:
+                raise WrongFormat
+            range = chunk["range"].split("-")
+            arrived = chunk.get("arrived")
+            ci.add_chunk(
+                chunk["name"],
+                (int(range[0]), int(range[1])),
+                None if arrived is None else int(arrived),
+            )
 
         return ci
 
     def remove(self):
-        fs_name = f"{self.name}.chunks"
-        if os.path.exists(fs_name):
-            os.remove(fs_name)
+        for fs_name in (f"{self.name}.chunks", f"{self.name}.chunks.tmp"):
+            if os.path.exists(fs_name):
+                os.remove(fs_name)
 
     def get_count(self):
         return len(self.chunks)
@@ -103,8 +192,21 @@ class ChunkInfo:
     def get_chunk_range(self, index):
         return self.chunks[index][1]
 
+    def set_chunk_range(self, index, range):
+        self.chunks[index] = (self.chunks[index][0], range)
+
+    def get_chunk_progress(self, index):
+        return self.progress[index]
+
+    def set_chunk_progress(self, index, arrived):
+        self.progress[index] = arrived
+
 
 class HTTPChunk(HTTPRequest):
+
+    BUFFER_SIZE = 512 << 10  #: max bytes passed by curl to write_body at once
+    BLOCK_SIZE = 1 << 20  #: data is written in blocks of this size, aligned in the file
+
     def __init__(self, id, parent, range=None, resume=False):
         self.id = id
         self.p = parent  #: HTTPDownload instance
@@ -122,6 +224,10 @@ class HTTPChunk(HTTPRequest):
         self.header_parsed = False  #: indicates if the header has been processed
 
         self.fp = None  #: file handle
+        self.fd = None  #: file descriptor, used instead of fp to write in place
+        self.buffer = bytearray()  #: received data not yet handed to the writer
+        self.written = 0  #: bytes of arrived already written to the file
+        self.committed = 0  #: bytes of written known to be on disk
 
         self.init_handle()
         self.set_interface(self.p.options)
@@ -130,9 +236,6 @@ class HTTPChunk(HTTPRequest):
 
         self.rep = None
 
-        self.sleep = 0.000
-        self.last_size = 0
-
     def __repr__(self):
         return f"<HTTPChunk id={self.id}, size={self.size}, arrived={self.arrived}>"
 
@@ -149,16 +252,37 @@ class HTTPChunk(HTTPRequest):
         )
         self.c.setopt(pycurl.WRITEFUNCTION, self.write_body)
         self.c.setopt(pycurl.HEADERFUNCTION, self.write_header)
+        #: fewer, larger callbacks keep the per write overhead low
+        self.c.setopt(pycurl.BUFFERSIZE, self.BUFFER_SIZE)
 
         # request all bytes, since some servers in russia seems to have a defect
         # arihmetic unit
 
         fs_name = self.p.info.get_chunk_name(self.id)
+        if self.p.info.single:
+            flags = os.O_RDWR | os.O_CREAT  #: read back to catch up hashing
+            if not self.resume and not self.id:
+                flags |= os.O_TRUNC
+            self.fd = os.open(fs_name, flags, 0o666)
+
         if self.resume:
-            self.fp = open(fs_name, mode="ab")
-            self.arrived = self.fp.tell()
-            if not self.arrived:
-                self.arrived = os.stat(fs_name).st_size
+            progress = self.p.info.get_chunk_progress(self.id)
+            if self.fd is not None:
+                self.arrived = progress or 0
+            else:
+                #: drop what was written after the last commit, it may be garbage
+                if (
+                    progress is not None
+                    and os.path.exists(fs_name)
+                    and os.path.getsize(fs_name) > progress
+                ):
+                    os.truncate(fs_name, progress)
+                self.fp = open(fs_name, mode="ab")
+                self.arrived = self.fp.tell()
+                if not self.arrived:
+                    self.arrived = os.stat(fs_name).st_size
+            self.written = self.committed = self.arrived
+            self.p.info.set_chunk_progress(self.id, self.arrived)
 
             if self.range:
                 # do nothing if chunk already finished
@@ -166,9 +290,8 @@ class HTTPChunk(HTTPRequest):
                     return None
 
                 start = self.arrived + self.range[0]
-                if (
-                    self.id == len(self.p.info.chunks) - 1
-                ):  #: as last chunk dont set end range, so we get everything
+                if self.is_last():
+                    #: as last chunk dont set end range, so we get everything
                     end = ""
                 else:
                     end = min(self.range[1] + 1, self.p.size - 1)
@@ -184,7 +307,7 @@ class HTTPChunk(HTTPRequest):
         else:
             if self.range:
                 start = self.range[0]
-                if self.id == len(self.p.info.chunks) - 1:  #: see above
+                if self.is_last():  #: see above
                     end = ""
                 else:
                     end = min(self.range[1] + 1, self.p.size - 1)
@@ -194,10 +317,27 @@ class HTTPChunk(HTTPRequest):
                 self.log.debug(f"Chunked with range {range}")
                 self.c.setopt(pycurl.RANGE, range)
 
-            self.fp = open(fs_name, mode="wb")
+            if self.fd is None:
+                self.fp = open(fs_name, mode="wb")
 
         return self.c
 
+    def is_last(self):
+        """
+        True if the range of the chunk reaches the end of the file, chunks split off
+        later get higher ids but not the last range.
+        """
+        return self.range[1] >= self.p.size - 1
+
+    @property
+    def remaining(self):
+        """
+        bytes of the range not received yet.
+        """
+        if not self.range:
+            return 0
+        return max(self.range[1] + 1 - self.range[0] - self.arrived, 0)
+
     def write_header(self, buf):
         self.header += buf
         # TODO: forward headers?, this is possibly unneeeded, when we just parse valid 200 headers
@@ -214,36 +354,109 @@ class HTTPChunk(HTTPRequest):
         self.header_parsed = True
 
     def write_body(self, buf):
+        if self.p.engine and self.p.writer.pause(self.unpause):
+            #: never block the engine thread, curl passes buf again once resumed
+            return pycurl.WRITEFUNC_PAUSE
+
         # ignore BOM, it confuses unrar
         if not self.BOMChecked:
-            if [ord(b) for b in buf[:3]] == [239, 187, 191]:
+            if buf.startswith(b"\xef\xbb\xbf"):
                 buf = buf[3:]
             self.BOMChecked = True
 
-        size = len(buf)
+        self.p.writer.received += len(buf)
+        self.p.writer.callbacks += 1
 
-        self.arrived += size
+        if self.fd is not None and self.range:
+            #: drop what overlaps the next chunk in the shared file
+            offset = self.range[0] + self.arrived
+            buf = buf[: max(self.range[1] + 1 - offset, 0)]
 
-        self.fp.write(buf)
+        self.buffer += buf
+        self.arrived += len(buf)
 
-        if self.p.bucket:
-            time.sleep(self.p.bucket.consumed(size))
-        else:
-            # Avoid small buffers, increasing sleep time slowly if buffer size gets smaller
-            # otherwise reduce sleep time percentual (values are based on tests)
-            # So in general cpu time is saved without reducing bandwith too much
+        if len(self.buffer) >= self.BLOCK_SIZE:
+            self.flush_buffer(aligned=True, block=not self.p.engine)
 
-            if size < self.last_size:
-                self.sleep += 0.002
-            else:
-                self.sleep *= 0.7
+        if self.range and self.arrived > self.size:
+            return 0  #: close if we have enough data
 
-            self.last_size = size
+    @property
+    def start(self):
+        """
+        first byte of the file loaded by the chunk.
+        """
+        return self.range[0] if self.range else 0
 
-            time.sleep(self.sleep)
+    def get_offset(self, position):
+        """
+        returns the offset in the file of a position in the chunk.
+        """
+        if self.fd is not None and self.range:
+            return self.range[0] + position
+        return position
 
-        if self.range and self.arrived > self.size:
-            return 0  #: close if we have enough data
+    def unpause(self):
+        """
+        continue the transfer paused by write_body, called by the writer thread.
+        """
+        self.p.engine.resume(self.c)
+
+    def flush_buffer(self, aligned=False, block=True):
+        """
+        hand the buffered data to the writer, with aligned only up to the last block
+        boundary in the file.
+        """
+        size = len(self.buffer)
+        position = self.arrived - size
+        if aligned:
+            size -= (self.get_offset(position) + size) % self.BLOCK_SIZE
+        if size <= 0:
+            return
+
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.p.writer.submit(partial(self.write_data, position), data, block)
+
+    def write_data(self, position, data):
+        """
+        called by the writer thread.
+        """
+        if self.fd is not None:
+            offset = self.get_offset(position)
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            self.fp.write(data)
+        self.written += len(data)
+
+        if self.p.hasher:
+            self.p.hasher.update(self.start + position, data, self.p.read_written)
+
+    def read_written(self, offset, size):
+        """
+        returns up to size bytes of the file at offset if the chunk wrote them,
+        called by the writer thread.
+        """
+        position = offset - self.start
+        if not 0 <= position < self.written:
+            return b""
+        size = min(size, self.written - position)
+
+        #: the chunk may get closed meanwhile, hashing reads the rest at the end
+        try:
+            if self.fd is not None:
+                return os.pread(self.fd, size, offset)
+
+            self.fp.flush()
+            with open(self.fp.name, mode="rb") as fp:
+                fp.seek(position)
+                return fp.read(size)
+        except (OSError, ValueError):
+            return b""
 
     def parse_header(self):
         """
@@ -282,20 +495,47 @@ class HTTPChunk(HTTPRequest):
         self.range = range
         self.size = range[1] - range[0]
 
+    def sync(self):
+        """
+        make the written data durable, called by the writer thread.
+        """
+        if self.fd is not None:
+            os.fsync(self.fd)
+        else:
+            self.fp.flush()
+            os.fsync(self.fp.fileno())
+
     def flush_file(self):
         """
-        flush and close file.
+        flush and close file, the download syncs the complete file once.
         """
-        self.fp.flush()
-        os.fsync(self.fp.fileno())  #: make sure everything was written to disk
+        self.flush_buffer()
+        self.p.writer.drain()
+
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            return
+
         self.fp.close()  #: needs to be closed, or merging chunks will fail
 
     def close(self):
         """
         closes everything, unusable after this.
         """
+        if hasattr(self, "p"):
+            #: keep what was received, it can be resumed
+            try:
+                self.flush_buffer()
+                self.p.writer.drain()
+            except Exception as exc:
+                self.log.debug(f"Error writing chunk {self.id + 1}: {exc}")
+
         if self.fp:
             self.fp.close()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
         self.c.close()
         if hasattr(self, "p"):
             del self.p
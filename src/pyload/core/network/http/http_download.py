@@ -1,17 +1,24 @@
 # -*- coding: utf-8 -*-
 # AUTHOR: RaNaN
 
+import errno
+import math
 import os
 import shutil
 import time
+from functools import partial
 from logging import getLogger
+from urllib.parse import urlparse
 
 import pycurl
 from pyload import APPID
 
 from ..exceptions import Abort
+from .curl_engine import EngineMulti
+from .file_writer import FileWriter
 from .http_chunk import ChunkInfo, HTTPChunk
 from .http_request import BadHeader
+from .stream_hasher import StreamHasher
 
 
 class HTTPDownload:
@@ -19,6 +26,12 @@ class HTTPDownload:
     loads a url http + ftp.
     """
 
+    #: smallest remaining range worth splitting onto a new connection
+    MIN_SPLIT = 4 << 20
+
+    #: seconds between two syncs of the data and saves of the resume journal
+    JOURNAL_INTERVAL = 5
+
     def __init__(
         self,
         url,
@@ -43,6 +56,9 @@ class HTTPDownload:
         self.disposition = disposition
         # all arguments
 
+        #: write all chunks in place into one preallocated file
+        self.preallocate = bool(options.get("preallocate")) and hasattr(os, "pwrite")
+
         self.abort = False
         self.size = 0
         self.name_disposition = None  #: will be parsed from content disposition
@@ -60,7 +76,19 @@ class HTTPDownload:
             self.info = ChunkInfo(filename)
 
         self.chunk_support = None
-        self.m = self.manager = pycurl.CurlMulti()
+        self.connections = 1  #: number of chunks loading at the same time
+        #: learns the number of connections that works best per hoster
+        self.tuner = options.get("chunk_tuner")
+        self.writer = FileWriter()  #: writes the chunk data in the background
+        self.speed_limit = None  #: MAX_RECV_SPEED_LARGE set on every chunk
+        self.hasher = None  #: computes the checksums asked for with the hashes option
+        self.hashes = {}  #: algorithm -> hex digest of the complete file
+        #: shared transfer engine, chunks run on its thread instead of ours
+        self.engine = options.get("engine")
+        if self.engine:
+            self.m = self.manager = EngineMulti(self.engine)
+        else:
+            self.m = self.manager = pycurl.CurlMulti()
 
         # needed for speed calculation
         self.last_arrived = []
@@ -87,13 +115,27 @@ class HTTPDownload:
     def _copy_chunks(self):
         init = self.info.get_chunk_name(0)  #: initial chunk name
 
-        if self.info.get_count() > 1:
+        if self.info.single:
+            self.sync_progress()
+            if self.size and sum(self.info.progress) < self.size:
+                os.remove(init)
+                self.info.remove()
+                raise Exception("Downloaded content was smaller than expected.")
+
+        elif self.info.get_count() > 1:
+            #: split chunks are appended to the info, merge them in file order
+            order = sorted(
+                range(1, self.info.get_count()),
+                key=lambda i: self.info.get_chunk_range(i)[0],
+            )
             with open(init, mode="rb+") as fo:  #: first chunkfile
-                for i in range(1, self.info.get_count()):
+                prev = 0
+                for i in order:
                     # input file
                     # seek to beginning of chunk, to get rid of overlapping chunks
-                    fo.seek(self.info.get_chunk_range(i - 1)[1] + 1)
-                    fname = f"{self.filename}.chunk{i}"
+                    fo.seek(self.info.get_chunk_range(prev)[1] + 1)
+                    prev = i
+                    fname = self.info.get_chunk_name(i)
                     with open(fname, mode="rb") as fi:
                         buf = 32 << 10
                         while True:  #: copy in chunks, consumes less memory
@@ -110,6 +152,9 @@ class HTTPDownload:
                         )
                     os.remove(fname)  #: os.remove chunk
 
+        with open(init, mode="rb+") as fo:
+            os.fsync(fo.fileno())  #: make sure everything was written to disk
+
         if self.name_disposition and self.disposition:
             self.filename = os.path.join(
                 os.path.dirname(self.filename), self.name_disposition
@@ -125,6 +170,15 @@ class HTTPDownload:
         chunks = max(1, chunks)
         resume = self.info.resume and resume
 
+        host = self.options.get("plugin") or urlparse(self.url).hostname
+        if self.tuner is not None and not resume:
+            chunks = self.tuner.get_chunks(host, chunks)
+        self.connections = chunks
+
+        if self.bucket is not None:
+            self.bucket.start()
+
+        start = time.time()
         try:
             self._download(chunks, resume)
         except pycurl.error as exc:
@@ -142,17 +196,34 @@ class HTTPDownload:
             else:
                 raise
         finally:
+            if self.bucket is not None:
+                self.bucket.stop()
             self.close()
 
+        stats = self.get_write_stats()
+        self.log.debug(
+            "Wrote {written} bytes in {writes} writes for {callbacks} callbacks, "
+            "max flush latency {max_flush_latency:.3f}s".format(**stats)
+        )
+
+        #: a speed limit says nothing about the connections
+        if self.tuner is not None and not resume and not self.bucket:
+            size = stats["written"]
+            self.tuner.record(host, chunks, size, size / max(time.time() - start, 1))
+
         if self.name_disposition and self.disposition:
             return self.name_disposition
         return None
 
     def _download(self, chunks, resume):
+        algorithms = self.options.get("hashes")
+        self.hasher = StreamHasher(algorithms) if algorithms else None
+
         if not resume:
             self.info.clear()
+            self.info.single = self.preallocate
             self.info.add_chunk(
-                f"{self.filename}.chunk0", (0, 0)
+                self.info.make_chunk_name(0), (0, 0)
             )  #: create an initial entry)
 
         self.chunks = []
@@ -162,9 +233,12 @@ class HTTPDownload:
 
         self.chunks.append(init)
         self.m.add_handle(init.get_handle())
+        self.speed_limit = None
+        self.apply_speed_limit()
 
         last_finish_check = 0
         last_time_check = 0
+        last_journal = time.time()
         chunks_done = set()  #: list of curl handles that are finished
         chunks_created = False
         done = False
@@ -182,6 +256,8 @@ class HTTPDownload:
                 if not resume:
                     self.info.set_size(self.size)
                     self.info.create_chunks(chunks)
+                    if self.info.single:
+                        self.allocate()
                     self.info.save()
 
                 chunks = self.info.get_count()
@@ -201,6 +277,8 @@ class HTTPDownload:
                         c.close()
 
                 chunks_created = True
+                self.speed_limit = None
+                self.apply_speed_limit()
 
             while True:
                 ret, num_handles = self.m.perform()
@@ -231,7 +309,7 @@ class HTTPDownload:
                     curl, errno, msg = c
                     chunk = self.find_chunk(curl)
                     # test if chunk was finished
-                    if errno != 23 or "0 !=" not in msg:
+                    if errno != 23 or ("0 !=" not in msg and "returned 0" not in msg):
                         failed.append(chunk)
                         ex = pycurl.error(errno, msg)
                         self.log.debug(f"Chunk {chunk.id + 1} failed: {ex}")
@@ -259,13 +337,19 @@ class HTTPDownload:
                         for chunk in to_clean:
                             self.close_chunk(chunk)
                             self.chunks.remove(chunk)
-                            os.remove(self.info.get_chunk_name(chunk.id))
+                            if not self.info.single:
+                                os.remove(self.info.get_chunk_name(chunk.id))
 
                         # let first chunk load the rest and update the info file
                         init.reset_range()
                         self.info.clear()
-                        self.info.add_chunk(f"{self.filename}.chunk0", (0, self.size))
+                        self.info.add_chunk(
+                            self.info.make_chunk_name(0), (0, self.size), init.committed
+                        )
                         self.info.save()
+                        self.connections = 1  #: splitting again would fail the same way
+                        self.speed_limit = None
+                        self.apply_speed_limit()
                     elif failed:
                         raise ex or Exception
 
@@ -278,6 +362,9 @@ class HTTPDownload:
                             )
                         done = True  #: all chunks loaded
 
+                    elif chunks_created:
+                        self.split_chunks(chunks_done)
+
                     break
 
             if done:
@@ -295,10 +382,29 @@ class HTTPDownload:
                 self.last_speeds[0] = self.speeds
                 self.speeds = [float(a) / (t - last_time_check) for a in diff]
                 self.last_arrived = [c.arrived for c in self.chunks]
+                if self.bucket is not None and last_time_check:
+                    self.bucket.speed = self.speed
                 last_time_check = t
                 self.update_progress()
 
+                if self.bucket is not None:
+                    self.apply_speed_limit()
+
+            if chunks_created and last_journal + self.JOURNAL_INTERVAL < t:
+                #: save what the last sync committed, then start the next one
+                self.save_progress()
+                self.writer.sync(partial(self.commit, list(self.chunks)))
+                last_journal = t
+
+            if self.writer.error:
+                raise self.writer.error
+
             if self.abort:
+                if chunks_created:
+                    try:
+                        self.save_progress(sync=True)
+                    except Exception as exc:
+                        self.log.debug(f"Error saving download progress: {exc}")
                 raise Abort
 
             # time.sleep(0.003) #supress busy waiting - limits dl speed to  (1 / x) *
@@ -310,6 +416,127 @@ class HTTPDownload:
 
         self._copy_chunks()
 
+        if self.hasher:
+            self.hashes = self.hasher.finish(self.filename)
+
+    def split_chunks(self, chunks_done):
+        """
+        while fewer chunks than connections are loading, split the largest remaining
+        range and load its second half on a new connection.
+        """
+        running = [c for c in self.chunks if c.c not in chunks_done]
+        split = False
+
+        while len(running) < self.connections:
+            chunk = max(running, key=lambda c: c.remaining, default=None)
+            if chunk is None or chunk.remaining < self.MIN_SPLIT:
+                break
+
+            start, end = chunk.range
+            middle = start + chunk.arrived + chunk.remaining // 2
+            chunk.set_range((start, middle - 1))
+            self.info.set_chunk_range(chunk.id, chunk.range)
+
+            index = self.info.get_count()
+            self.info.add_chunk(self.info.make_chunk_name(index), (middle, end))
+            new = HTTPChunk(index, self, (middle, end))
+            self.chunks.append(new)
+            self.m.add_handle(new.get_handle())
+            running.append(new)
+            split = True
+
+            self.log.debug(
+                f"Chunk {chunk.id + 1} split at {middle}, chunk {index + 1} loads the rest"
+            )
+
+        if split:
+            self.save_progress()
+            self.speed_limit = None
+            self.apply_speed_limit()
+
+    def apply_speed_limit(self):
+        """
+        let curl throttle the chunks to the share of the speed limit of this download.
+        """
+        rate = self.bucket.get_share() if self.bucket is not None else math.inf
+        if rate == math.inf or not self.chunks:
+            limit = 0
+        else:
+            limit = max(int(rate // len(self.chunks)), 1)
+
+        if limit == self.speed_limit:
+            return
+        self.speed_limit = limit
+
+        for chunk in self.chunks:
+            if self.engine:
+                self.engine.setopt(chunk.c, pycurl.MAX_RECV_SPEED_LARGE, limit)
+            else:
+                chunk.c.setopt(pycurl.MAX_RECV_SPEED_LARGE, limit)
+
+    def allocate(self):
+        """
+        reserve the disk space of the whole file.
+        """
+        fd = os.open(self.info.get_chunk_name(0), os.O_WRONLY | os.O_CREAT, 0o666)
+        try:
+            try:
+                os.posix_fallocate(fd, 0, self.size)
+            except AttributeError:
+                os.ftruncate(fd, self.size)
+            except OSError as exc:
+                #: filesystem without fallocate support, fall back to a sparse file
+                if exc.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                    raise
+                os.ftruncate(fd, self.size)
+        finally:
+            os.close(fd)
+
+    def sync_progress(self):
+        for chunk in self.chunks:
+            self.info.set_chunk_progress(chunk.id, chunk.written)
+
+    def commit(self, chunks):
+        """
+        sync the chunk files and mark what they hold as committed, called by the
+        writer thread.
+        """
+        written = [chunk.written for chunk in chunks]
+        #: in place all chunks share one file, syncing it once is enough
+        for chunk in chunks[:1] if self.info.single else chunks:
+            chunk.sync()
+        for chunk, size in zip(chunks, written):
+            chunk.committed = size
+
+    def save_progress(self, sync=False):
+        """
+        save the bytes committed per chunk, with sync everything received is
+        written and committed first.
+        """
+        if sync:
+            for chunk in self.chunks:
+                chunk.flush_buffer()
+            self.writer.drain()
+            self.commit(self.chunks)
+
+        for chunk in self.chunks:
+            self.info.set_chunk_progress(chunk.id, chunk.committed)
+        self.info.save()
+
+    def read_written(self, offset, size):
+        """
+        returns up to size bytes of the file at offset already written by a chunk,
+        called by the writer thread.
+        """
+        for chunk in list(self.chunks):
+            data = chunk.read_written(offset, size)
+            if data:
+                return data
+        return b""
+
+    def get_write_stats(self):
+        return self.writer.get_stats()
+
     def update_progress(self):
         if self.progress_notify:
             self.progress_notify(self.percent)
@@ -338,6 +565,7 @@ class HTTPDownload:
             self.close_chunk(chunk)
 
         self.chunks = []
+        self.writer.close()
         if hasattr(self, "m"):
             self.m.close()
             del self.m
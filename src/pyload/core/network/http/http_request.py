@@ -302,7 +302,7 @@ class HTTPRequest:
         """
         decode with correct encoding, relies on header.
         """
-        header = self.header.splitlines()
+        header = self.header.decode("iso-8859-1").splitlines()
         encoding = "utf-8"  #: default encoding
 
         for line in header:
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import zlib
+
+CRC32_POLY = 0xEDB88320
+
+
+def _gf2_times(mat, vec):
+    result = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            result ^= mat[i]
+        vec >>= 1
+        i += 1
+    return result
+
+
+def _gf2_square(mat):
+    return [_gf2_times(mat, mat[n]) for n in range(32)]
+
+
+def crc32_combine(crc1, crc2, len2):
+    """
+    returns the crc32 of two blocks from their crc32 and the length of the second,
+    port of zlib's crc32_combine.
+    """
+    if len2 <= 0:
+        return crc1
+
+    odd = [CRC32_POLY] + [1 << n for n in range(31)]  #: operator for one zero bit
+    even = _gf2_square(odd)  #: two zero bits
+    odd = _gf2_square(even)  #: four zero bits
+
+    #: apply len2 zero bytes to crc1, the first square gives one zero byte
+    while True:
+        even = _gf2_square(odd)
+        if len2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+
+        odd = _gf2_square(even)
+        if len2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+
+    return crc1 ^ crc2
+
+
+class Adler32:
+    """
+    hashlib like wrapper of zlib.adler32.
+    """
+
+    def __init__(self):
+        self.value = 1
+
+    def update(self, data):
+        self.value = zlib.adler32(data, self.value)
+
+    def hexdigest(self):
+        return "{:08x}".format(self.value)
+
+
+class StreamHasher:
+    """
+    Computes checksums of a download from the data written by its chunks.
+
+    CRC32 is computed per contiguous range and the ranges are combined as they
+    meet, so it never needs the data in order. The other algorithms need the
+    file in order: they follow the chunk loading the start of the file, and once
+    it reaches data written by another chunk they catch up by reading it back,
+    at most CATCH_UP bytes per write so the writer is not held up. What is still
+    missing when the download is done is read from the finished file.
+    """
+
+    #: max bytes read back per write to catch up
+    CATCH_UP = 4 << 20
+
+    #: bytes read at once from disk
+    READ_SIZE = 1 << 20
+
+    def __init__(self, algorithms):
+        self.crc32 = False
+        self.hashers = {}  #: algorithm -> hasher fed in order
+        for algorithm in algorithms:
+            algorithm = algorithm.replace("-", "").lower()
+            if algorithm == "crc32":
+                self.crc32 = True
+            elif algorithm == "adler32":
+                self.hashers[algorithm] = Adler32()
+            elif algorithm in hashlib.algorithms_available:
+                self.hashers[algorithm] = hashlib.new(algorithm)
+
+        self.position = 0  #: bytes fed to the ordered hashers
+        self.segments = []  #: sorted [start, end, crc32] of the ranges seen
+
+    def __bool__(self):
+        return self.crc32 or bool(self.hashers)
+
+    def update(self, offset, data, read=None):
+        """
+        feed data written at offset of the file, read(offset, size) returns data
+        already on disk, called by the writer thread.
+        """
+        self._feed(offset, data)
+        if read is not None and self.hashers:
+            self._catch_up(read, self.CATCH_UP)
+
+    def finish(self, filename):
+        """
+        feed what was not seen from the complete file and return the hex digests.
+        """
+        with open(filename, mode="rb") as fp:
+
+            def read(offset, size):
+                fp.seek(offset)
+                return fp.read(size)
+
+            if self.hashers:
+                self._catch_up(read)
+
+            if self.crc32:
+                for start, end in self._gaps(os.fstat(fp.fileno()).st_size):
+                    for offset in range(start, end, self.READ_SIZE):
+                        size = min(self.READ_SIZE, end - offset)
+                        self._feed(offset, read(offset, size))
+
+        digests = {name: h.hexdigest() for name, h in self.hashers.items()}
+        if self.crc32:
+            crc = self.segments[0][2] if self.segments else 0
+            digests["crc32"] = "{:08x}".format(crc)
+        return digests
+
+    def _catch_up(self, read, limit=None):
+        while limit is None or limit > 0:
+            size = self.READ_SIZE if limit is None else min(self.READ_SIZE, limit)
+            data = read(self.position, size)
+            if not data:
+                break
+            self._feed(self.position, data)
+            if limit is not None:
+                limit -= len(data)
+
+    def _feed(self, offset, data):
+        if not data:
+            return
+        end = offset + len(data)
+
+        if offset <= self.position < end:
+            view = memoryview(data)[self.position - offset :]
+            for h in self.hashers.values():
+                h.update(view)
+            self.position = end
+
+        if self.crc32:
+            for start, stop in self._uncovered(offset, end):
+                self._add_segment(start, memoryview(data)[start - offset : stop - offset])
+
+    def _uncovered(self, start, end):
+        """
+        returns the parts of the range not covered by a segment yet.
+        """
+        parts = []
+        for seg_start, seg_end, _ in self.segments:
+            if seg_end <= start:
+                continue
+            if seg_start >= end:
+                break
+            if seg_start > start:
+                parts.append((start, seg_start))
+            start = max(start, seg_end)
+        if start < end:
+            parts.append((start, end))
+        return parts
+
+    def _gaps(self, size):
+        return self._uncovered(0, size)
+
+    def _add_segment(self, start, data):
+        end = start + len(data)
+        i = 0
+        while i < len(self.segments) and self.segments[i][0] < start:
+            i += 1
+
+        if i and self.segments[i - 1][1] == start:
+            #: a chunk continues its range, the usual case and cheap
+            left = self.segments[i - 1]
+            left[1] = end
+            left[2] = zlib.crc32(data, left[2])
+            i -= 1
+        else:
+            self.segments.insert(i, [start, end, zlib.crc32(data)])
+
+        #: two ranges meet, only happens about once per chunk
+        if i + 1 < len(self.segments) and self.segments[i + 1][0] == end:
+            seg, right = self.segments[i], self.segments.pop(i + 1)
+            seg[1] = right[1]
+            seg[2] = crc32_combine(seg[2], right[2], right[1] - right[0])
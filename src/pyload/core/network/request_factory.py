@@ -7,6 +7,8 @@ from ..utils.old import lock
 from .browser import Browser
 from .bucket import Bucket
 from .cookie_jar import CookieJar
+from .http.chunk_tuner import ChunkTuner
+from .http.curl_engine import CurlEngine
 from .http.http_request import HTTPRequest
 from .xdcc.request import XDCCRequest
 
@@ -19,8 +21,11 @@ class RequestFactory:
         self.pyload = core
         self._ = core._
         self.bucket = Bucket()
+        self.buckets = {}  #: (plugin, account) -> Bucket shared by their downloads
         self.update_bucket()
         self.cookiejars = {}
+        self.engine = None
+        self.chunk_tuner = ChunkTuner()
 
         # TODO: Rewrite...
         global DEFAULT_REQUEST
@@ -33,13 +38,17 @@ class RequestFactory:
     @lock
     def get_request(self, plugin_name, account=None, type="HTTP", **kwargs):
         options = self.get_options()
+        options["plugin"] = plugin_name
         options.update(kwargs)  #: submit kwargs as additional options
 
+        #: every request gets its own bucket, so it can be limited on its own
+        bucket = Bucket(parent=self.get_bucket(plugin_name, account))
+
         if type == "XDCC":
-            req = XDCCRequest(self.bucket, options)
+            req = XDCCRequest(bucket, options)
 
         else:
-            req = Browser(self.bucket, options)
+            req = Browser(bucket, options)
 
             if account:
                 cj = self.get_cookie_jar(plugin_name, account)
@@ -65,6 +74,44 @@ class RequestFactory:
             rep = h.load(*args, **kwargs)
         return rep
 
+    def get_bucket(self, plugin_name, account=None):
+        """
+        returns the bucket shared by the requests of a plugin or an account of it.
+        """
+        if (plugin_name, account) in self.buckets:
+            return self.buckets[(plugin_name, account)]
+
+        if account is None:
+            bucket = Bucket(self.get_plugin_speeds().get(plugin_name, -1), self.bucket)
+        else:
+            bucket = Bucket(parent=self.get_bucket(plugin_name))
+
+        self.buckets[(plugin_name, account)] = bucket
+        return bucket
+
+    @lock
+    def set_speed_limit(self, plugin_name, rate, account=None):
+        """
+        sets the speed limit in bytes/s of a plugin or one of its accounts, -1 for none.
+        """
+        self.get_bucket(plugin_name, account).set_rate(rate)
+
+    def get_plugin_speeds(self):
+        """
+        returns the speed limits in bytes/s of the plugins set in the config.
+        """
+        if not self.pyload.config.get("download", "limit_speed"):
+            return {}
+
+        speeds = {}
+        for entry in self.pyload.config.get("download", "plugin_speeds").split(","):
+            name, delimiter, speed = entry.partition(":")
+            try:
+                speeds[name.strip()] = int(speed) << 10
+            except ValueError:
+                continue
+        return speeds
+
     def get_cookie_jar(self, plugin_name, account=None):
         if (plugin_name, account) in self.cookiejars:
             return self.cookiejars[(plugin_name, account)]
@@ -117,8 +164,34 @@ class RequestFactory:
             "interface": self.iface(),
             "proxies": self.get_proxies(),
             "ipv6": self.pyload.config.get("download", "ipv6"),
+            "engine": self.get_engine(),
+            "preallocate": self.pyload.config.get("download", "preallocate"),
+            "chunk_tuner": self.get_chunk_tuner(),
         }
 
+    def get_chunk_tuner(self):
+        """
+        returns the tuner of the connections per hoster, or None if it is disabled.
+        """
+        if not self.pyload.config.get("download", "adaptive_chunks"):
+            return None
+        return self.chunk_tuner
+
+    def get_engine(self):
+        """
+        returns the shared transfer engine, or None if it is disabled.
+        """
+        if not self.pyload.config.get("download", "curl_engine"):
+            return None
+        if self.engine is None or self.engine.stopped:  #: replace a failed engine
+            self.engine = CurlEngine()
+        return self.engine
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.stop()
+            self.engine = None
+
     def update_bucket(self):
         """
         set values in the bucket according to settings.
@@ -128,6 +201,11 @@ class RequestFactory:
         else:
             self.bucket.set_rate(self.pyload.config.get("download", "max_speed") << 10)
 
+        speeds = self.get_plugin_speeds()
+        for (plugin_name, account), bucket in self.buckets.items():
+            if account is None:
+                bucket.set_rate(speeds.get(plugin_name, -1))
+
 
 def get_url(*args, **kwargs):
     return DEFAULT_REQUEST.get_url(*args, **kwargs)
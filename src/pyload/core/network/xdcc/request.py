@@ -12,6 +12,10 @@ from ..exceptions import Abort
 
 
 class XDCCRequest:
+
+    RECV_SIZE = 256 << 10  #: max bytes read from the dcc socket at once
+    WRITE_BUFFER = 1 << 20  #: size of the file write buffer
+
     def __init__(self, bucket=None, options={}):
         self.proxies = options.get("proxies", {})
         self.bucket = bucket
@@ -22,9 +26,8 @@ class XDCCRequest:
         self.filesize = 0
         self.received = 0
         self.speeds = [0.0, 0.0, 0.0]
+        self.throttled_until = 0  #: time the speed limit lets us receive again
 
-        self.sleep = 0.000
-        self.last_recv_size = 0
         self.send_64bits_ack = False
 
         self.abort = False
@@ -61,21 +64,7 @@ class XDCCRequest:
         self.fh.write(buf)
 
         if self.bucket:
-            time.sleep(self.bucket.consumed(size))
-
-        else:
-            # Avoid small buffers, increasing sleep time slowly if buffer size gets smaller
-            # otherwise reduce sleep time percentequal (values are based on tests)
-            # So in general cpu time is saved without reducing bandwidth too much
-
-            if size < self.last_recv_size:
-                self.sleep += 0.002
-            else:
-                self.sleep *= 0.7
-
-            self.last_recv_size = size
-
-            time.sleep(self.sleep)
+            self.throttled_until = time.time() + self.bucket.consumed(size)
 
     def _send_ack(self):
         # acknowledge data by sending number of recceived bytes
@@ -94,7 +83,7 @@ class XDCCRequest:
         chunk_name = filename + ".chunk0"
 
         if resume and os.path.exists(chunk_name):
-            self.fh = open(chunk_name, mode="ab")
+            self.fh = open(chunk_name, mode="ab", buffering=self.WRITE_BUFFER)
             resume_position = self.fh.tell()
             if not resume_position:
                 resume_position = os.stat(chunk_name).st_size
@@ -104,7 +93,7 @@ class XDCCRequest:
             self.received = resume_position
 
         else:
-            self.fh = open(chunk_name, mode="wb")
+            self.fh = open(chunk_name, mode="wb", buffering=self.WRITE_BUFFER)
 
         last_update = time.time()
         cum_recv_len = 0
@@ -115,37 +104,47 @@ class XDCCRequest:
         self.dccsock.connect((ip, port))
         self.dccsock.setblocking(0)
 
+        if self.bucket is not None:
+            self.bucket.start()
+
         # recv loop for dcc socket
         while True:
             if self.abort:
                 self.dccsock.close()
                 self.fh.close()
+                if self.bucket is not None:
+                    self.bucket.stop()
                 raise Abort
 
-            fdset = select.select(recv_list, [], [], 0.1)
-            if self.dccsock in fdset[0]:
-                try:
-                    data = self.dccsock.recv(16384)
+            wait = self.throttled_until - time.time()
+            if wait > 0:
+                #: over the speed limit, leave the data in the socket for now
+                time.sleep(min(wait, 0.1))
+            else:
+                fdset = select.select(recv_list, [], [], 0.1)
+                if self.dccsock in fdset[0]:
+                    try:
+                        data = self.dccsock.recv(self.RECV_SIZE)
 
-                except socket.error as exc:
-                    if exc.errno == errno.EAGAIN or exc.errno == errno.EWOULDBLOCK:
-                        continue
+                    except socket.error as exc:
+                        if exc.errno == errno.EAGAIN or exc.errno == errno.EWOULDBLOCK:
+                            continue
 
-                    else:
-                        raise
+                        else:
+                            raise
 
-                data_len = len(data)
-                if (
-                    data_len == 0
-                    or self.filesize
-                    and self.received + data_len > self.filesize
-                ):
-                    break
+                    data_len = len(data)
+                    if (
+                        data_len == 0
+                        or self.filesize
+                        and self.received + data_len > self.filesize
+                    ):
+                        break
 
-                cum_recv_len += data_len
+                    cum_recv_len += data_len
 
-                self._write_func(data)
-                self._send_ack()
+                    self._write_func(data)
+                    self._send_ack()
 
             now = time.time()
             timespan = now - last_update
@@ -158,10 +157,14 @@ class XDCCRequest:
                 cum_recv_len = 0
                 last_update = now
 
+                if self.bucket is not None:
+                    self.bucket.speed = self.speeds[0]
                 self.update_progress()
 
         self.dccsock.close()
         self.fh.close()
+        if self.bucket is not None:
+            self.bucket.stop()
 
         os.rename(chunk_name, filename)
 
@@ -194,4 +197,6 @@ class XDCCRequest:
         return (self.received * 100) // self.filesize
 
     def close(self):
-        pass
+        if self.bucket is not None:
+            self.bucket.stop()
+            self.bucket.close()
@@ -2,12 +2,11 @@
 # AUTHOR: mkaay
 
 import time
-from heapq import heappop, heappush
-from threading import Lock
-
-from _thread import start_new_thread
-
-from .utils.old import lock
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from heapq import heapify, heappop, heappush
+from itertools import count
+from threading import Condition, Thread
 
 
 class AlreadyCalled(Exception):
@@ -18,6 +17,7 @@ class Deferred:
     def __init__(self):
         self.call = []
         self.result = ()
+        self.job = None  #: scheduled job, used as handle to cancel it
 
     def add_callback(self, f, *cargs, **ckwargs):
         self.call.append((f, cargs, ckwargs))
@@ -29,20 +29,63 @@ class Deferred:
         for f, cargs, ckwargs in self.call:
             args += tuple(cargs)
             kwargs.update(ckwargs)
-            f(*args ** kwargs)
+            f(*args, **kwargs)
 
 
 class Scheduler:
+    """
+    Runs jobs at given times.
+
+    A timer thread sleeps until the next deadline. Due threaded jobs are run by a
+    bounded worker pool, jobs added with long=True, like the database maintenance,
+    by a small pool of their own so they never hold back the short ones. Jobs
+    added with threaded=False are handed to the core thread, which runs them one
+    after another in its loop, see run. Removed jobs are only flagged and skipped
+    when due.
+    """
+
+    #: max number of threaded jobs running at once
+    MAX_WORKERS = 8
+
+    #: max number of long jobs running at once
+    MAX_LONG_WORKERS = 2
+
     def __init__(self, core):
         self.pyload = core
         self._ = core._
-        self.queue = PriorityQueue()
 
-    def add_job(self, t, call, args=[], kwargs={}, threaded=True):
+        self.queue = []  #: heap of (time, seq, job)
+        self.cond = Condition()
+        self.seq = count()
+        self.cancelled = 0
+        self.stopped = False
+
+        self.pool = ThreadPoolExecutor(self.MAX_WORKERS, "scheduler")
+        self.long_pool = ThreadPoolExecutor(self.MAX_LONG_WORKERS, "scheduler-long")
+        self.ready = deque()  #: due jobs waiting for the core thread
+
+        #: metrics
+        self.executed = 0
+        self.waiting = 0  #: due jobs not yet started by a worker
+        self.running = 0
+        self.lateness = 0.0  #: start delay of the last job
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+
+        self.thread = Thread(target=self._timer, name="scheduler", daemon=True)
+        self.thread.start()
+
+    def add_job(self, t, call, args=[], kwargs={}, threaded=True, long=False):
         d = Deferred()
         t += time.time()
-        j = Job(t, call, args, kwargs, d, threaded)
-        self.queue.put((t, j))
+        j = Job(t, call, args, kwargs, d, threaded, long)
+        d.job = j
+
+        with self.cond:
+            heappush(self.queue, (t, next(self.seq), j))
+            #: wake the timer only if the new job is the next one
+            if self.queue[0][2] is j:
+                self.cond.notify()
         return d
 
     def remove_job(self, d):
@@ -50,39 +93,122 @@ class Scheduler:
         :param d: defered object
         :return: if job was deleted
         """
-        index = -1
-
-        for i, j in enumerate(self.queue):
-            if j[1].deferred == d:
-                index = i
-
-        if index >= 0:
-            del self.queue[index]
-            return True
-
-        return False
+        job = getattr(d, "job", None)
+        if job is None:
+            return False
+
+        with self.cond:
+            if job.state != Job.PENDING:
+                return False
+            job.state = Job.CANCELLED
+            self.cancelled += 1
+            if self.cancelled > len(self.queue) // 2:
+                self._compact()
+        return True
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.pool.shutdown(wait=False)
+        self.long_pool.shutdown(wait=False)
+        self.ready.clear()
 
     def run(self):
+        """
+        run the due jobs added with threaded=False, called by the core loop.
+        """
+        while self.ready:
+            self._execute(self.ready.popleft())
+
+    def get_stats(self):
+        with self.cond:
+            return {
+                "queued": len(self.queue) - self.cancelled,
+                "waiting": self.waiting,
+                "running": self.running,
+                "executed": self.executed,
+                "lateness": self.lateness,
+                "max_lateness": self.max_lateness,
+                "avg_lateness": self.total_lateness / max(self.executed, 1),
+            }
+
+    def _compact(self):
+        self.queue = [x for x in self.queue if x[2].state == Job.PENDING]
+        heapify(self.queue)
+        self.cancelled = 0
+
+    def _timer(self):
         while True:
-            t, j = self.queue.get()
-            if not j:
-                break
-            else:
-                if t <= time.time():
-                    j.start()
-                else:
-                    self.queue.put((t, j))
-                    break
+            with self.cond:
+                while not self.stopped:
+                    if self.queue and self.queue[0][2].state == Job.CANCELLED:
+                        heappop(self.queue)
+                        self.cancelled -= 1
+                        continue
+
+                    timeout = self.queue[0][0] - time.time() if self.queue else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self.cond.wait(timeout)
+
+                if self.stopped:
+                    return
+
+                job = heappop(self.queue)[2]
+                job.state = Job.STARTED
+                self.waiting += 1
+
+            if not job.threaded:
+                self.ready.append(job)
+                self.pyload.wakeup()
+                continue
+
+            try:
+                executor = self.long_pool if job.long else self.pool
+                executor.submit(self._execute, job)
+            except RuntimeError:  #: executor shut down
+                return
+
+    def _execute(self, job):
+        lateness = max(time.time() - job.time, 0)
+        with self.cond:
+            self.waiting -= 1
+            self.running += 1
+            self.executed += 1
+            self.lateness = lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+            self.total_lateness += lateness
+
+        try:
+            job.run()
+        except Exception as exc:
+            self.pyload.log.error(
+                self._("Error executing scheduled job {}: {}").format(job.call, exc),
+                exc_info=self.pyload.debug > 1,
+                stack_info=self.pyload.debug > 2,
+            )
+        finally:
+            with self.cond:
+                self.running -= 1
 
 
 class Job:
-    def __init__(self, time, call, args=[], kwargs={}, deferred=None, threaded=True):
+    PENDING = 0
+    STARTED = 1
+    CANCELLED = 2
+
+    def __init__(
+        self, time, call, args=[], kwargs={}, deferred=None, threaded=True, long=False
+    ):
         self.time = float(time)
         self.call = call
         self.args = args
         self.kwargs = kwargs
         self.deferred = deferred
         self.threaded = threaded
+        self.long = long
+        self.state = self.PENDING
 
     def run(self):
         ret = self.call(*self.args, **self.kwargs)
@@ -90,40 +216,3 @@ class Job:
             return
         else:
             self.deferred.callback(ret)
-
-    def start(self):
-        if self.threaded:
-            start_new_thread(self.run, ())
-        else:
-            self.run()
-
-
-class PriorityQueue:
-    """
-    a non blocking priority queue.
-    """
-
-    def __init__(self):
-        self.queue = []
-        self.lock = Lock()
-
-    def __iter__(self):
-        return iter(self.queue)
-
-    def __delitem__(self, key):
-        del self.queue[key]
-
-    @lock
-    def put(self, element):
-        heappush(self.queue, element)
-
-    @lock
-    def get(self):
-        """
-        return element or None.
-        """
-        try:
-            el = heappop(self.queue)
-            return el
-        except IndexError:
-            return None, None
@@ -34,6 +34,8 @@ class DownloadThread(PluginThread):
 
         while True:
             del pyfile
+            #: a download slot is free, let the core hand out the next job
+            self.pyload.wakeup()
             self.active = self.queue.get()
             pyfile = self.active
 
@@ -220,6 +222,8 @@ class DownloadThread(PluginThread):
         """
         assing job to thread.
         """
+        if job != "quit":
+            self.active = job  #: not free anymore, even before the job is picked up
         self.queue.put(job)
 
     def stop(self):
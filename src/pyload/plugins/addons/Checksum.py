@@ -4,6 +4,7 @@ import os
 import re
 import time
 import zlib
+from concurrent.futures import ThreadPoolExecutor
 from threading import Event
 
 from pyload.core.utils import format
@@ -11,6 +12,10 @@ from pyload.core.utils import format
 from ..base.addon import BaseAddon, threaded
 
 
+#: bytes read at once, hashlib and zlib release the GIL on large buffers
+READ_SIZE = 1 << 20
+
+
 def compute_checksum(local_file, algorithm, progress_notify=None, abort=None):
     file_size = os.stat(local_file).st_size
     processed = 0
@@ -25,39 +30,40 @@ def compute_checksum(local_file, algorithm, progress_notify=None, abort=None):
         ):
             h = getattr(hashlib, algorithm)()
 
-            with open(local_file, mode="rb") as fp:
-                for chunk in iter(lambda: fp.read(128 * h.block_size), ""):
-                    if abort and abort():
-                        return False
-
-                    h.update(chunk)
-                    processed += len(chunk)
+        elif algorithm in ("adler32", "crc32"):
+            hf = getattr(zlib, algorithm)
+            h = None
+            last = hf(b"")
 
-                    if progress_notify:
-                        progress_notify(processed * 100 // file_size)
+        else:
+            return None
 
-            return h.hexdigest()
+        buf = bytearray(READ_SIZE)
+        view = memoryview(buf)
 
-        elif algorithm in ("adler32", "crc32"):
-            hf = getattr(zlib, algorithm)
-            last = 0
+        with open(local_file, mode="rb", buffering=0) as fp:
+            while True:
+                size = fp.readinto(buf)
+                if not size:
+                    break
 
-            with open(local_file, mode="rb") as fp:
-                for chunk in iter(lambda: fp.read(8192), ""):
-                    if abort and abort():
-                        return False
+                if abort and abort():
+                    return False
 
-                    last = hf(chunk, last)
-                    processed += len(chunk)
+                if h is not None:
+                    h.update(view[:size])
+                else:
+                    last = hf(view[:size], last)
+                processed += size
 
-                    if progress_notify:
-                        progress_notify(processed * 100 // file_size)
+                if progress_notify:
+                    progress_notify(processed * 100 // file_size)
 
-            #: zlib sometimes return negative value
-            return "{:x}".format((2 ** 32 + last) & 0xFFFFFFFF)
+        if h is not None:
+            return h.hexdigest()
 
-        else:
-            return None
+        #: zlib sometimes return negative value
+        return "{:08x}".format((2 ** 32 + last) & 0xFFFFFFFF)
 
     finally:
         if progress_notify:
@@ -67,7 +73,7 @@ def compute_checksum(local_file, algorithm, progress_notify=None, abort=None):
 class Checksum(BaseAddon):
     __name__ = "Checksum"
     __type__ = "addon"
-    __version__ = "0.34"
+    __version__ = "0.38"
     __status__ = "testing"
 
     __pyload_version__ = "0.5"
@@ -84,6 +90,18 @@ class Checksum(BaseAddon):
         ("max_tries", "int", "Number of retries", 2),
         ("retry_action", "fail;nothing", "What to do if all retries fail?", "fail"),
         ("wait_time", "int", "Time to wait before each retry (seconds)", 1),
+        (
+            "stream_checksum",
+            "bool",
+            "Compute checksums while downloading instead of reading the file again",
+            True,
+        ),
+        (
+            "verify_workers",
+            "int",
+            "Files to verify at once (0 for one per CPU core)",
+            0,
+        ),
     ]
 
     __description__ = """Verify downloaded file size and checksum"""
@@ -99,7 +117,7 @@ class Checksum(BaseAddon):
 
     _regexmap = {
         "sfv": r"^(?P<NAME>[^;].+)\s+(?P<HASH>[0-9A-Fa-f]{8})$",
-        "md5": r"^(?P<NAME>[0-9A-Fa-f]{32})  (?P<FILE>.+)$",
+        "md5": r"^(?P<HASH>[0-9A-Fa-f]{32})  \*?(?P<NAME>.+)$",
         "crc": r"filename=(?P<NAME>.+)\nsize=(?P<SIZE>\d+)\ncrc32=(?P<HASH>[0-9A-Fa-f]{8})$",
         "default": r"^(?P<HASH>[0-9A-Fa-f]+)\s+\*?(?P<NAME>.+)$",
     }
@@ -125,33 +143,92 @@ class Checksum(BaseAddon):
         self.formats = self.algorithms + ["sfv", "crc", "hash"]
 
         self.retries = {}
+        self.stream_hashes = {}  #: file -> (size, mtime, checksums of the download)
 
-    def download_finished(self, pyfile):
-        """
-        Compute checksum for the downloaded file and compare it with the hash provided
-        by the hoster.
-
-        pyfile.plugin.check_data should be a dictionary which can
-        contain: a) if known, the exact filesize in bytes (e.g. 'size':
-        123456789) b) hexadecimal hash string with algorithm name as key
-        (e.g. 'md5': "d76505d0869f9f928a17d42d66326307")
-        """
+    def get_check_data(self, pyfile):
         if hasattr(pyfile.plugin, "check_data") and isinstance(
             pyfile.plugin.check_data, dict
         ):
-            data = pyfile.plugin.check_data.copy()
+            return pyfile.plugin.check_data.copy()
 
         elif hasattr(pyfile.plugin, "api_data") and isinstance(
             pyfile.plugin.api_data, dict
         ):
-            data = pyfile.plugin.api_data.copy()
+            return pyfile.plugin.api_data.copy()
 
         elif hasattr(pyfile.plugin, "info") and isinstance(pyfile.plugin.info, dict):
             data = pyfile.plugin.info.copy()
             # NOTE: Don't check file size until a similary matcher will be implemented
             data.pop("size", None)
+            return data
 
-        else:
+        return None
+
+    def download_start(self, pyfile, url, filename):
+        """
+        Let the download compute the checksums while loading, CRC32 is always asked
+        for as it is cheap and used by sfv files.
+        """
+        if not self.config.get("check_checksum") or not self.config.get(
+            "stream_checksum"
+        ):
+            return
+
+        req = getattr(pyfile.plugin, "req", None)
+        if not hasattr(req, "set_option"):
+            return
+
+        data = self.get_check_data(pyfile) or {}
+        algorithms = {"crc32"}
+        algorithms.update(
+            key for key in self.algorithms if key in data or key in data.get("hash", {})
+        )
+        req.set_option("hashes", sorted(algorithms))
+
+    def save_stream_hashes(self, pyfile):
+        hashes = getattr(getattr(pyfile.plugin, "req", None), "hashes", None)
+        if not hashes or not pyfile.plugin.last_download:
+            return
+
+        local_file = os.fsdecode(pyfile.plugin.last_download)
+        st = os.stat(local_file)
+        self.stream_hashes[local_file] = (st.st_size, st.st_mtime_ns, hashes)
+
+    def get_stream_checksum(self, local_file, algorithm):
+        """
+        returns the checksum computed while downloading, None if unknown or the
+        file changed since.
+        """
+        try:
+            size, mtime, hashes = self.stream_hashes[local_file]
+            st = os.stat(local_file)
+        except (KeyError, OSError):
+            return None
+
+        if (st.st_size, st.st_mtime_ns) != (size, mtime):
+            self.stream_hashes.pop(local_file, None)
+            return None
+        return hashes.get(algorithm.replace("-", "").lower())
+
+    def download_failed(self, pyfile):
+        last_download = getattr(pyfile.plugin, "last_download", None)
+        if last_download:
+            self.stream_hashes.pop(os.fsdecode(last_download), None)
+
+    def download_finished(self, pyfile):
+        """
+        Compute checksum for the downloaded file and compare it with the hash provided
+        by the hoster.
+
+        pyfile.plugin.check_data should be a dictionary which can
+        contain: a) if known, the exact filesize in bytes (e.g. 'size':
+        123456789) b) hexadecimal hash string with algorithm name as key
+        (e.g. 'md5': "d76505d0869f9f928a17d42d66326307")
+        """
+        self.save_stream_hashes(pyfile)
+
+        data = self.get_check_data(pyfile)
+        if data is None:
             return
 
         pyfile.set_status("processing")
@@ -194,16 +271,18 @@ class Checksum(BaseAddon):
             if len(data["hash"]) > 0:
                 for key in self.algorithms:
                     if key in data["hash"]:
-                        pyfile.set_custom_status(self._("checksum verifying"))
-                        try:
-                            checksum = compute_checksum(
-                                local_file,
-                                key.replace("-", "").lower(),
-                                progress_notify=pyfile.set_progress,
-                                abort=lambda: pyfile.abort,
-                            )
-                        finally:
-                            pyfile.set_status("processing")
+                        checksum = self.get_stream_checksum(local_file, key)
+                        if checksum is None:
+                            pyfile.set_custom_status(self._("checksum verifying"))
+                            try:
+                                checksum = compute_checksum(
+                                    local_file,
+                                    key.replace("-", "").lower(),
+                                    progress_notify=pyfile.set_progress,
+                                    abort=lambda: pyfile.abort,
+                                )
+                            finally:
+                                pyfile.set_status("processing")
 
                         if checksum is False:
                             continue
@@ -216,6 +295,7 @@ class Checksum(BaseAddon):
                                     ).format(pyfile.name, key.upper(), checksum.lower())
                                 )
                                 pyfile.error = self._("checksum verified")
+                                self.stream_hashes.pop(local_file, None)
                                 break
 
                             else:
@@ -273,6 +353,7 @@ class Checksum(BaseAddon):
 
     @threaded
     def verify_package(self, pypack, event_finished, thread=None):
+        checked = set()  #: files whose stream checksums are no longer needed
         try:
             dl_folder = os.path.join(
                 self.pyload.config.get("general", "storage_folder"), pypack.folder, ""
@@ -281,103 +362,159 @@ class Checksum(BaseAddon):
             pdata = list(pypack.get_children().items())
             files_ids = {fdata["name"]: fdata["id"] for fid, fdata in pdata}
             failed_queue = []
-            for fid, fdata in pdata:
-                file_type = os.path.splitext(fdata["name"])[1][1:].lower()
-
-                if file_type not in self.formats:
-                    continue
-
-                hash_file = os.fsdecode(os.path.join(dl_folder, fdata["name"]))
-                if not os.path.isfile(hash_file):
-                    self.log_warning(self._("File not found"), fdata["name"])
-                    continue
-
-                with open(hash_file) as fp:
-                    text = fp.read()
-
-                failed = []
-                for m in re.finditer(
-                    self._regexmap.get(file_type, self._regexmap["default"]), text, re.M
-                ):
-                    data = m.groupdict()
-                    self.log_debug(fdata["name"], data)
-
-                    local_file = os.fsdecode(os.path.join(dl_folder, data["NAME"]))
-                    algorithm = self._methodmap.get(file_type, file_type)
-
-                    pyfile = None
-                    fid = files_ids.get(data["NAME"], None)
-                    if fid is not None:
-                        pyfile = self.pyload.files.get_file(fid)
-                        pyfile.set_custom_status(self._("checksum verifying"))
-                        thread.add_active(pyfile)
-                        try:
-                            checksum = compute_checksum(
-                                local_file,
-                                algorithm,
-                                progress_notify=pyfile.set_progress,
-                                abort=lambda: pyfile.abort,
-                            )
-                        finally:
-                            thread.finish_file(pyfile)
 
-                    else:
-                        checksum = compute_checksum(local_file, algorithm)
+            checked.update(
+                os.fsdecode(os.path.join(dl_folder, fdata["name"]))
+                for fid, fdata in pdata
+            )
+
+            with ThreadPoolExecutor(
+                max_workers=self.get_workers(), thread_name_prefix="Checksum"
+            ) as pool:
+                #: start all files first, then check them in order
+                jobs = []
+                for fid, fdata in pdata:
+                    file_type = os.path.splitext(fdata["name"])[1][1:].lower()
+
+                    if file_type not in self.formats:
+                        continue
 
-                    if checksum is False:
+                    hash_file = os.fsdecode(os.path.join(dl_folder, fdata["name"]))
+                    if not os.path.isfile(hash_file):
+                        self.log_warning(self._("File not found"), fdata["name"])
                         continue
 
-                    elif checksum is not None:
-                        if checksum.lower() == data["HASH"].lower():
-                            self.retries.pop(fid, 0)
-                            self.log_info(
-                                self._(
-                                    'File integrity of "{}" verified by {} checksum ({})'
-                                ).format(data["NAME"], algorithm, checksum)
+                    with open(hash_file) as fp:
+                        text = fp.read()
+
+                    entries = []
+                    for m in re.finditer(
+                        self._regexmap.get(file_type, self._regexmap["default"]),
+                        text,
+                        re.M,
+                    ):
+                        data = m.groupdict()
+                        self.log_debug(fdata["name"], data)
+
+                        local_file = os.fsdecode(os.path.join(dl_folder, data["NAME"]))
+                        algorithm = self._methodmap.get(file_type, file_type)
+                        fid = files_ids.get(data["NAME"], None)
+                        future = pool.submit(
+                            self.verify_file, local_file, algorithm, fid, thread
+                        )
+                        entries.append((data, local_file, algorithm, fid, future))
+                        checked.add(local_file)
+
+                    jobs.append((fdata["name"], entries))
+
+                for name, entries in jobs:
+                    failed = []
+                    for data, local_file, algorithm, fid, future in entries:
+                        try:
+                            pyfile, checksum = future.result()
+
+                        except Exception as exc:
+                            self.log_warning(
+                                self._("Could not verify file {}").format(
+                                    data["NAME"]
+                                ),
+                                exc,
                             )
+                            if fid is not None:
+                                failed.append((fid, local_file))
+                            continue
 
-                            if pyfile is not None:
-                                pyfile.error = self._("checksum verified")
-                                pyfile.set_status("finished")
-                                pyfile.release()
+                        if checksum is False:
+                            continue
+
+                        elif checksum is not None:
+                            if checksum.lower() == data["HASH"].lower():
+                                self.retries.pop(fid, 0)
+                                self.log_info(
+                                    self._(
+                                        'File integrity of "{}" verified by {} checksum ({})'
+                                    ).format(data["NAME"], algorithm, checksum)
+                                )
 
+                                if pyfile is not None:
+                                    pyfile.error = self._("checksum verified")
+                                    pyfile.set_status("finished")
+                                    pyfile.release()
+
+                            else:
+                                self.log_warning(
+                                    self._(
+                                        "{} checksum for file {} does not match ({} != {})"
+                                    ).format(
+                                        algorithm.upper(),
+                                        data["NAME"],
+                                        checksum.lower(),
+                                        data["HASH"].lower(),
+                                    )
+                                )
+
+                                if fid is not None:
+                                    failed.append((fid, local_file))
                         else:
                             self.log_warning(
-                                self._(
-                                    "{} checksum for file {} does not match ({} != {})"
-                                ).format(
-                                    algorithm.upper(),
-                                    data["NAME"],
-                                    checksum.lower(),
-                                    data["HASH"].lower(),
-                                )
+                                self._("Unsupported hashing algorithm"),
+                                algorithm.upper(),
                             )
 
-                            if fid is not None:
-                                failed.append((fid, local_file))
+                    if failed:
+                        failed_queue.extend(failed)
+
                     else:
-                        self.log_warning(
-                            self._("Unsupported hashing algorithm"), algorithm.upper()
+                        self.log_info(
+                            self._(
+                                'All files specified by "{}" verified successfully'
+                            ).format(name)
                         )
 
-                if failed:
-                    failed_queue.extend(failed)
-
-                else:
-                    self.log_info(
-                        self._(
-                            'All files specified by "{}" verified successfully'
-                        ).format(fdata["name"])
-                    )
-
             if failed_queue:
                 self.package_check_failed(
                     failed_queue, thread, "Checksums do not match"
                 )
 
         finally:
+            for local_file in checked:
+                self.stream_hashes.pop(local_file, None)
             event_finished.set()
 
+    def get_workers(self):
+        workers = self.config.get("verify_workers")
+        return workers if workers > 0 else os.cpu_count() or 1
+
+    def verify_file(self, local_file, algorithm, fid, thread):
+        """
+        Compute the checksum of a file listed in a hash file, runs in the pool of
+        verify_package.
+
+        Returns the pyfile of the file if it was downloaded, and the checksum.
+        """
+        pyfile = self.pyload.files.get_file(fid) if fid is not None else None
+
+        checksum = self.get_stream_checksum(local_file, algorithm)
+        if checksum is not None:
+            return pyfile, checksum
+
+        if pyfile is None:
+            return pyfile, compute_checksum(local_file, algorithm)
+
+        pyfile.set_custom_status(self._("checksum verifying"))
+        thread.add_active(pyfile)
+        try:
+            checksum = compute_checksum(
+                local_file,
+                algorithm,
+                progress_notify=pyfile.set_progress,
+                abort=lambda: pyfile.abort,
+            )
+        finally:
+            thread.finish_file(pyfile)
+
+        return pyfile, checksum
+
     @threaded
     def package_check_failed(self, failed_queue, parent_thread, msg):
         parent_thread.join()  #: wait for calling thread to finish
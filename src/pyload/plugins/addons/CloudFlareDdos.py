@@ -7,7 +7,6 @@ import urllib.parse
 from pyload.core.network.http.exceptions import BadHeader
 from pyload.core.utils.misc import eval_js
 
-from ..anticaptchas.ReCaptcha import ReCaptcha
 from ..base.addon import BaseAddon
 from ..helpers import parse_html_header
 
@@ -137,6 +136,10 @@ class CloudFlare:
         try:
             last_url = owner_plugin.req.last_effective_url
 
+            #: imported here, the anticaptcha plugin is only needed on a check page
+            ReCaptcha = addon_plugin.pyload.plugin_manager.load_class(
+                "anticaptcha", "ReCaptcha"
+            )
             captcha = ReCaptcha(owner_plugin.pyfile)
 
             captcha_key = captcha.detect_key(data)
@@ -187,7 +190,7 @@ class PreloadStub:
 class CloudFlareDdos(BaseAddon):
     __name__ = "CloudFlareDdos"
     __type__ = "addon"
-    __version__ = "0.13"
+    __version__ = "0.14"
     __status__ = "testing"
 
     __pyload_version__ = "0.5"
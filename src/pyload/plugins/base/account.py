@@ -231,6 +231,17 @@ class BaseAccount(BasePlugin):
         d = self.get_info()["data"]
         return d.get(key, default) if key else d
 
+    def get_speed_limit(self):
+        """
+        returns the speed limit in bytes/s of the `max_speed` option (KiB/s), -1 if
+        not set.
+        """
+        try:
+            speed = int(self.info["data"]["options"]["max_speed"][0])
+        except (KeyError, IndexError, TypeError, ValueError):
+            return -1
+        return speed << 10 if speed > 0 else -1
+
     def _grab_info(self):
         try:
             data = self.grab_info(
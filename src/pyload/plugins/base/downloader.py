@@ -507,12 +507,8 @@ class BaseDownloader(BaseHoster):
         """
         pack_folder = self.pyfile.package().folder
 
-        for pyfile in self.pyload.files.cache.values():
-            if (
-                pyfile != self.pyfile
-                and pyfile.name == self.pyfile.name
-                and pyfile.package().folder == pack_folder
-            ):
+        for pyfile in self.pyload.files.cache.named_files(self.pyfile.name):
+            if pyfile != self.pyfile and pyfile.package().folder == pack_folder:
                 if pyfile.status in (
                     0,
                     12,
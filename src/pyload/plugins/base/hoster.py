@@ -165,6 +165,9 @@ class BaseHoster(BasePlugin):
             self.req = self.pyload.request_factory.get_request(
                 self.classname, self.account.user
             )
+            self.pyload.request_factory.set_speed_limit(
+                self.classname, self.account.get_speed_limit(), self.account.user
+            )
             # NOTE: Avoid one unnecessary get_info call by `self.account.premium` here
             self.premium = self.account.info["data"]["premium"]
         else:
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import importlib
+import sys
+import timeit
+
+from pyload.core.managers.plugin_manager import PluginFinder
+
+__author__ = "pyLoad team"
+__copyright__ = "pyLoad team"
+__license__ = "agpl3"
+
+#: stdlib modules imported from scratch to measure the hook overhead
+MODULES = ("colorsys", "fractions", "statistics", "textwrap", "difflib", "glob")
+
+
+def make_finder(size=1000):
+    finder = PluginFinder()
+    finder.redirects = {
+        f"pyload.plugins.downloaders.Plugin{i}": f"plugins.downloaders.Plugin{i}"
+        for i in range(size)
+    }
+    return finder
+
+
+def fresh_imports():
+    for name in MODULES:
+        sys.modules.pop(name, None)
+        importlib.import_module(name)
+
+
+def import_time(finder=None, number=20):
+    if finder is not None:
+        sys.meta_path.insert(0, finder)
+    try:
+        return timeit.timeit(fresh_imports, number=number)
+    finally:
+        if finder is not None:
+            sys.meta_path.remove(finder)
+
+
+if __name__ == "__main__":
+    finder = make_finder()
+    number = 100000
+
+    elapsed = timeit.timeit(lambda: finder.find_spec("email.mime.text"), number=number)
+    print(f"find_spec miss: {elapsed / number * 1e9:.0f} ns")
+
+    base = min(import_time() for _ in range(5))
+    hooked = min(import_time(finder) for _ in range(5))
+    print(f"imports without hook: {base * 1000:.1f} ms")
+    print(f"imports with hook: {hooked * 1000:.1f} ms ({(hooked / base - 1) * 100:+.1f}%)")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from pyload.core.network.http.http_download import HTTPDownload
+
+__author__ = "pyLoad team"
+__copyright__ = "pyLoad team"
+__license__ = "agpl3"
+
+OPTIONS = {"interface": None, "proxies": {}, "ipv6": False}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory):
+    handler = partial(QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_file(directory, size):
+    block = os.urandom(1 << 20)
+    path = os.path.join(directory, "source.bin")
+    with open(path, mode="wb") as fp:
+        for offset in range(0, size, len(block)):
+            fp.write(block[: size - offset])
+    return path
+
+
+def md5(path):
+    h = hashlib.md5()
+    with open(path, mode="rb") as fp:
+        for data in iter(lambda: fp.read(1 << 20), b""):
+            h.update(data)
+    return h.hexdigest()
+
+
+def download(server, directory, name="target.bin"):
+    """
+    returns (seconds, cpu seconds) spent downloading the source file.
+    """
+    url = "http://127.0.0.1:{}/source.bin".format(server.server_address[1])
+    filename = os.path.join(directory, name)
+
+    start, cpu = time.perf_counter(), time.process_time()
+    HTTPDownload(url, filename, options=dict(OPTIONS)).download()
+    return time.perf_counter() - start, time.process_time() - cpu
+
+
+def test_download():
+    with tempfile.TemporaryDirectory() as directory:
+        server = serve(directory)
+        try:
+            source = make_file(directory, 8 << 20)
+            download(server, directory)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert md5(os.path.join(directory, "target.bin")) == md5(source)
+
+
+def benchmark(size=512 << 20, number=3):
+    with tempfile.TemporaryDirectory() as directory:
+        server = serve(directory)
+        try:
+            make_file(directory, size)
+            results = [download(server, directory) for _ in range(number)]
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    elapsed, cpu = min(results)
+    print(f"downloaded {size >> 20} MiB from a local server")
+    print(f"throughput: {size / elapsed / (1 << 20):.1f} MiB/s")
+    # the server runs in this process too, so this includes its share
+    print(f"cpu: {cpu / elapsed * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import importlib
+import logging
+import sys
+
+from pyload.core.managers.plugin_manager import PluginFinder, PluginManager
+
+__author__ = "pyLoad team"
+__copyright__ = "pyLoad team"
+__license__ = "agpl3"
+
+
+class FakeCore:
+    debug = 0
+    log = logging.getLogger("pyload.tests")
+
+    def _(self, text):
+        return text
+
+
+def make_manager():
+    #: skip __init__, it indexes the plugin folders
+    manager = PluginManager.__new__(PluginManager)
+    manager.pyload = FakeCore()
+    manager._ = manager.pyload._
+    manager.import_times = {}
+    manager.plugins = {
+        "downloader": {
+            "Missing": {"name": "Missing", "folder": "pyload_tests_missing"},
+        }
+    }
+    return manager
+
+
+def test_redirect():
+    finder = PluginFinder()
+    finder.redirects = {"pyload_redirected_json": "json"}
+
+    sys.meta_path.insert(0, finder)
+    try:
+        module = importlib.import_module("pyload_redirected_json")
+    finally:
+        sys.meta_path.remove(finder)
+        sys.modules.pop("pyload_redirected_json", None)
+
+    assert module is importlib.import_module("json")
+    assert module.__spec__.name == "json"
+
+
+def test_miss():
+    finder = PluginFinder()
+    finder.redirects = {"pyload.plugins.downloaders.Plugin": "plugins.downloaders.Plugin"}
+
+    assert finder.find_spec("email.mime.text") is None
+    assert finder.find_spec("pyload.plugins.downloaders") is None
+
+    manager = make_manager()
+    assert manager.load_module("downloader", "Unknown") is None
+    assert manager.load_module("downloader", "Missing") is None
+    assert manager.import_times == {}
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+
+from pyload.core.scheduler import Scheduler
+
+__author__ = "pyLoad team"
+__copyright__ = "pyLoad team"
+__license__ = "agpl3"
+
+
+class FakeCore:
+    debug = 0
+    log = logging.getLogger("pyload.tests")
+
+    def __init__(self):
+        self.woken = threading.Event()
+
+    def _(self, text):
+        return text
+
+    def wakeup(self):
+        self.woken.set()
+
+
+def test_threaded_jobs_are_bounded():
+    scheduler = Scheduler(FakeCore())
+    release = threading.Event()
+    started = threading.Semaphore(0)
+    done = threading.Event()
+
+    def block():
+        started.release()
+        release.wait()
+
+    try:
+        for _ in range(scheduler.MAX_WORKERS + 2):
+            scheduler.add_job(0, block)
+        scheduler.add_job(0, done.set)
+        for _ in range(scheduler.MAX_WORKERS):
+            assert started.acquire(timeout=5)
+
+        #: the pool is full, the other jobs wait for a worker
+        assert not started.acquire(timeout=0.2)
+        assert not done.is_set()
+        stats = scheduler.get_stats()
+        assert stats["running"] == scheduler.MAX_WORKERS
+        assert stats["waiting"] == 3
+        assert stats["queued"] == 0
+
+        release.set()
+        assert done.wait(5)
+        stats = scheduler.get_stats()
+        assert stats["executed"] == scheduler.MAX_WORKERS + 3
+        assert stats["max_lateness"] >= 0.2
+    finally:
+        release.set()
+        scheduler.stop()
+
+
+def test_long_jobs_do_not_hold_back_others():
+    scheduler = Scheduler(FakeCore())
+    release = threading.Event()
+    done = threading.Event()
+    try:
+        for _ in range(scheduler.MAX_LONG_WORKERS + 1):
+            scheduler.add_job(0, release.wait, long=True)
+        scheduler.add_job(0, done.set)
+        assert done.wait(5)
+        assert scheduler.get_stats()["waiting"] == 1
+    finally:
+        release.set()
+        scheduler.stop()
+
+
+def test_unthreaded_jobs_run_on_core_thread():
+    core = FakeCore()
+    scheduler = Scheduler(core)
+    threads = []
+    try:
+        scheduler.add_job(0, lambda: threads.append(threading.current_thread()), threaded=False)
+        assert core.woken.wait(5)
+        assert not threads
+
+        scheduler.run()
+        assert threads == [threading.current_thread()]
+    finally:
+        scheduler.stop()
+
+
+def test_remove_job():
+    core = FakeCore()
+    scheduler = Scheduler(core)
+    calls = []
+    try:
+        d = scheduler.add_job(0.2, calls.append, [1], threaded=False)
+        assert scheduler.remove_job(d)
+        assert not scheduler.remove_job(d)
+        assert not core.woken.wait(0.5)
+
+        scheduler.run()
+        assert not calls
+    finally:
+        scheduler.stop()
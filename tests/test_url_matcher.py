@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import timeit
+
+from pyload import PKGDIR
+from pyload.core.datatypes.url_matcher import UrlMatcher
+from pyload.core.managers.plugin_manager import PluginManager
+
+__author__ = "pyLoad team"
+__copyright__ = "pyLoad team"
+__license__ = "agpl3"
+
+
+def load_patterns():
+    plugins = []
+    for folder in ("decrypters", "downloaders", "containers"):
+        path = os.path.join(PKGDIR, "plugins", folder)
+        for filename in sorted(os.listdir(path)):
+            if not filename.endswith(".py") or filename.startswith("_"):
+                continue
+            with open(os.path.join(path, filename), encoding="utf-8") as fp:
+                found = PluginManager._PATTERN.findall(fp.read())
+            pattern = found[0] if found else r"^unmatchable$"
+            plugins.append((filename[:-3], re.compile(pattern)))
+    return plugins
+
+
+def make_urls(matcher):
+    urls = []
+    for key in sorted(matcher.index):
+        urls.extend(
+            (
+                f"https://www.{key}/file/abc123",
+                f"http://{key}/d/XyZ09",
+                f"https://sub.{key}/f/1234567890",
+                f"http://{key}:8080/?id=abc",
+                f"https://{key}.evil.org/file/abc123",
+            )
+        )
+    urls.extend(("https://example.com/some.dlc", "ftp://example.org/a", "no url"))
+    return urls
+
+
+def linear_scan(plugins, url):
+    for name, regex in plugins:
+        if regex.match(url):
+            return name
+    return None
+
+
+def indexed(matcher, url):
+    found = matcher.match(url)
+    return found[0] if found else None
+
+
+def test_same_result_as_linear_scan():
+    plugins = load_patterns()
+    matcher = UrlMatcher(plugins)
+    assert matcher.index
+
+    for url in make_urls(matcher):
+        assert indexed(matcher, url) == linear_scan(plugins, url), url
+
+
+def test_rebuild_on_pattern_change():
+    plugins = load_patterns()
+    matcher = UrlMatcher(plugins)
+
+    changed = list(plugins)
+    changed[-1] = (changed[-1][0], re.compile(r"https?://(?:www\.)?changed\.example/"))
+    assert matcher.is_stale(changed)
+
+    matcher.build(changed)
+    assert indexed(matcher, "http://changed.example/x") == changed[-1][0]
+
+
+def benchmark(number=5):
+    plugins = load_patterns()
+    matcher = UrlMatcher(plugins)
+    urls = make_urls(matcher)
+
+    scan = timeit.timeit(lambda: [linear_scan(plugins, u) for u in urls], number=number)
+    index = timeit.timeit(lambda: [indexed(matcher, u) for u in urls], number=number)
+
+    count = len(urls) * number
+    print(f"{len(plugins)} patterns, {len(matcher.fallback)} not indexed")
+    print(f"linear scan: {scan / count * 1e6:.1f} us/url")
+    print(f"url matcher: {index / count * 1e6:.1f} us/url ({scan / index:.1f}x)")
+
+
+if __name__ == "__main__":
+    benchmark()